@@ -0,0 +1,247 @@
+"""
+Benchmarks the resource endpoints in process against benchmarks.fake_etcd, so it runs
+offline without etcd, RabbitMQ or Docker. Every etcd request can be delayed with --latency.
+With --storage sqlite the endpoints run on the embedded SQLite backend instead, and with
+--encoding zlib or zstd the values are stored encoded.
+
+    python -m benchmarks.endpoints
+    python -m benchmarks.endpoints --storage sqlite
+    python -m benchmarks.endpoints --latency 1 --sizes 1000 10000 --save
+    python -m benchmarks.endpoints --compare
+
+Reports throughput and p50/p99 latency per scenario. --save writes the results to the
+baseline file, --compare prints the change against it and exits with 1 if a scenario
+got slower than --threshold allows.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmarks import fake_etcd
+from core_api.etcd.client import etcd_client, put_request
+from core_api.etcd.keys import key_builder
+from settings import BASE_DIR, config
+
+BASELINE = BASE_DIR / 'benchmarks' / 'baselines' / 'endpoints.json'
+GROUP = 'bench.catcode.io'
+
+
+def resource_definition(kind: str, plural: str, singular: str) -> dict:
+    return {
+        'apiVersion': 'api.catcode.io/v1alpha1',
+        'kind': 'ResourceDefinition',
+        'metadata': {'name': f'{kind}ResourceDefinition'},
+        'spec': {
+            'group': GROUP,
+            'names': {'plural': plural, 'singular': singular, 'kind': kind},
+            'versions': [{
+                'name': 'v1alpha1',
+                'schemaVersion': 'openAPISchemaV3',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'owner': {'type': 'string'},
+                        'lifecycle': {'type': 'string', 'enum': ['Development', 'Production', 'Deprecated']},
+                        'tags': {'type': 'array', 'items': {'type': 'string', 'pattern': '^[a-z0-9-]+$'}}
+                    },
+                    'required': ['owner', 'lifecycle']
+                }
+            }]
+        }
+    }
+
+
+def resource(kind: str, name: str) -> dict:
+    return {
+        'apiVersion': f'{GROUP}/v1alpha1',
+        'kind': kind,
+        'metadata': {'name': name, 'labels': {'team': 'platform'}, 'annotations': {}},
+        'spec': {'owner': 'mw', 'lifecycle': 'Development', 'tags': ['python', 'core-api', 'backend']}
+    }
+
+
+def seed_items(sizes: list[int]) -> dict[str, str]:
+    """
+    Returns the definitions, a Component type for single resource scenarios and one List<size> type per list size.
+    """
+    items = {}
+    types = [('Component', 'components', 'component', 1000)] + [(f'List{n}', f'list{n}s', f'list{n}', n) for n in sizes]
+    for kind, plural, singular, count in types:
+        definition = resource_definition(kind, plural, singular)
+        items[key_builder.from_resource(definition)] = json.dumps(definition)
+        # The definitions are not in the cache yet, so resource keys are built by hand
+        for i in range(count):
+            items[f'{key_builder.prefix}/{GROUP}/{singular}/{singular}-{i}'] = json.dumps(resource(kind, f'{singular}-{i}'))
+    return items
+
+
+def summarise(timings: list[float], elapsed: float) -> dict:
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'throughput': len(timings) / elapsed,
+        'p50_ms': statistics.median(timings) * 1000,
+        'p99_ms': timings[max(0, int(len(timings) * 0.99) - 1)] * 1000,
+    }
+
+
+async def run_scenario(client: httpx.AsyncClient, request, iterations: int, concurrency: int) -> dict:
+    """
+    Sends iterations requests built by request(i), concurrency at a time, and times each of them.
+    """
+    timings, counter = [], iter(range(iterations))
+
+    async def worker():
+        for i in counter:
+            method, url, kwargs = request(i)
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            timings.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                raise RuntimeError(f'{method} {url} answered {response.status_code}: {response.text[:200]}')
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarise(timings, time.perf_counter() - start)
+
+
+def scenarios(args) -> dict:
+    def post(i):
+        return 'POST', '/resource/v1', {'json': resource('Component', f'posted-{i}')}
+
+    def bulk(i):
+        return 'POST', '/resource/v1/bulk', {'json': [resource('Component', f'bulk-{i}-{j}') for j in range(args.bulk_size)]}
+
+    result = {
+        'get': (lambda i: ('GET', f'/resource/v1/component/component-{i % 1000}', {}), args.iterations),
+        'get consistent': (lambda i: ('GET', f'/resource/v1/component/component-{i % 1000}?consistent=true', {}), args.iterations),
+        'post': (post, args.iterations),
+        'patch': (lambda i: ('PATCH', f'/resource/v1/component/component-{i % 1000}', {'json': {'spec': {'owner': f'owner-{i}'}}}), args.iterations),
+        f'bulk {args.bulk_size}': (bulk, max(1, args.iterations // args.bulk_size)),
+    }
+    for n in args.sizes:
+        # Fewer iterations for bigger lists, so every scenario takes a similar time
+        iterations = max(3, args.iterations * 100 // n)
+        result[f'list {n}'] = (lambda i, n=n: ('GET', f'/resource/v1/list{n}s', {}), iterations)
+        result[f'list {n} raw'] = (lambda i, n=n: ('GET', f'/resource/v1/list{n}s?raw=true', {}), iterations)
+        result[f'list {n} count'] = (lambda i, n=n: ('GET', f'/resource/v1/list{n}s?count=true&consistent=true', {}), iterations)
+        result[f'list {n} keys'] = (lambda i, n=n: ('GET', f'/resource/v1/list{n}s?keysOnly=true&consistent=true', {}), iterations)
+        result[f'list {n} fields'] = (lambda i, n=n: ('GET', f'/resource/v1/list{n}s?fields=metadata.name,spec.owner', {}), iterations)
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=BASE_DIR).stdout.strip()
+    except OSError:
+        return ''
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """
+    Prints the change of every scenario against the baseline and returns whether any got slower than threshold.
+    """
+    regressed = False
+    print(f'\ncompared with {baseline.get("commit") or "baseline"} from {baseline.get("date", "?")}')
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if not before:
+            continue
+        change = result['throughput'] / before['throughput'] - 1
+        slower = change < -threshold
+        regressed |= slower
+        print(f'{name:<24} throughput {change:>+7.1%}  p99 {result["p99_ms"] - before["p99_ms"]:>+8.2f} ms{"  REGRESSION" if slower else ""}')
+    return regressed
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0, help='Milliseconds added to every etcd request')
+    parser.add_argument('--storage', choices=['etcd', 'sqlite'], default='etcd', help='Run on the fake etcd or an in-memory SQLite backend')
+    parser.add_argument('--encoding', choices=['json', 'zlib', 'zstd'], default='json', help='Value encoding to store resources with')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[1000, 10000, 100000], help='Item counts of the list scenarios')
+    parser.add_argument('--bulk-size', type=int, default=100)
+    parser.add_argument('--only', nargs='*', help='Only run scenarios whose name starts with one of these')
+    parser.add_argument('--baseline', type=Path, default=BASELINE)
+    parser.add_argument('--save', action='store_true', help='Save the results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='Compare the results with the baseline')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Throughput drop counted as a regression')
+    args = parser.parse_args()
+
+    # Nothing may leave the process
+    config.events_enabled = False
+    config.storage_backend, config.sqlite_path = args.storage, ':memory:'
+    config.value_encoding = args.encoding
+    items = seed_items(args.sizes)
+    # Imported once config is set, the storage package builds the store on import
+    from core_api.storage.codec import ValueCodec
+    if args.storage == 'etcd':
+        # Loaded past the storage layer, so encoded here
+        codec = ValueCodec(args.encoding, min_bytes=config.value_encoding_min_bytes)
+        fake_etcd.install(etcd_client, latency=args.latency / 1000).load({key: codec.encode(value) for key, value in items.items()})
+    else:
+        from core_api.storage import storage
+        await storage.txn(success=[put_request(key, value) for key, value in items.items()])
+
+    from main import app
+    from core_api.etcd.informer import resource_informer
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        deadline = time.monotonic() + 120
+        while not (app.state.ready and (resource_informer.ready or not config.read_cache_enabled)):
+            if time.monotonic() > deadline:
+                raise RuntimeError('The app did not become ready within 120s')
+            await asyncio.sleep(0.05)
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark', timeout=None) as client:
+            for name, (request, iterations) in scenarios(args).items():
+                if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                    continue
+                result = await run_scenario(client, request, iterations, args.concurrency)
+                results[name] = result
+                print(
+                    f'{name:<24} {result["throughput"]:>10.1f} req/s'
+                    f'  p50 {result["p50_ms"]:>8.3f} ms  p99 {result["p99_ms"]:>8.3f} ms'
+                )
+
+    regressed = False
+    if args.compare:
+        if args.baseline.exists():
+            regressed = compare(results, json.loads(args.baseline.read_text()), args.threshold)
+        else:
+            print(f'\nno baseline at {args.baseline}, run with --save first')
+
+    if args.save:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps({
+            'commit': git_commit(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'arguments': {
+                'iterations': args.iterations,
+                'concurrency': args.concurrency,
+                'latency_ms': args.latency,
+                'storage': args.storage,
+                'encoding': args.encoding
+            },
+            'results': results
+        }, indent=2))
+        print(f'\nsaved baseline to {args.baseline}')
+
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(asyncio.run(main()))
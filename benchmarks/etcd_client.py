@@ -0,0 +1,57 @@
+"""
+Compares the pooled etcd client against the etcdctl subprocess path.
+
+Needs a running etcd on config.etcd_host, e.g. from docker-compose.yaml:
+
+    docker compose up -d
+    python -m benchmarks.etcd_client --iterations 500
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from core_api.etcd.client import etcd_client
+from core_api.etcd.command import run_command
+
+KEY_PREFIX = '/benchmark/etcd-client'
+
+
+async def measure(name: str, func, iterations: int):
+    timings = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        result = func(i)
+        if asyncio.iscoroutine(result):
+            await result
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    total = sum(timings)
+    print(
+        f'{name:<24} {iterations / total:>10.1f} ops/s'
+        f'  p50 {statistics.median(timings) * 1000:>7.3f} ms'
+        f'  p99 {timings[int(len(timings) * 0.99) - 1] * 1000:>7.3f} ms'
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    value = json.dumps({'apiVersion': 'catcode.io/v1alpha1', 'kind': 'System',
+                        'metadata': {'name': 'benchmark'}, 'spec': {'owner': 'benchmark'}})
+
+    await measure('etcdctl put', lambda i: run_command(['put', f'{KEY_PREFIX}/{i}', value]), args.iterations)
+    await measure('etcdctl get', lambda i: run_command(['get', f'{KEY_PREFIX}/{i}', '--print-value-only']), args.iterations)
+    await measure('etcd_client put', lambda i: etcd_client.put(f'{KEY_PREFIX}/{i}', value), args.iterations)
+    await measure('etcd_client get', lambda i: etcd_client.get(f'{KEY_PREFIX}/{i}'), args.iterations)
+
+    await etcd_client.delete(KEY_PREFIX, prefix=True)
+    await etcd_client.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
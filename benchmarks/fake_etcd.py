@@ -0,0 +1,388 @@
+"""
+An in-process stand-in for the etcd v3 JSON gateway, used as the transport of EtcdClient
+so the endpoints can be benchmarked without a running etcd.
+
+It keeps a multi version key space with revisions, ranged and pinned reads, limits,
+count_only, keys_only, sorting, puts, deletes, transactions with compares, compaction and
+watches, which is what the client uses. Every request can be delayed by a fixed latency to
+stand in for the network and disk of a real cluster.
+
+Run as a module it serves a FakeEtcd over HTTP, so API processes started separately can share it:
+
+    python -m benchmarks.fake_etcd --port 2379 --sizes 1000
+"""
+import argparse
+import asyncio
+import base64
+import bisect
+import json
+from typing import Optional
+
+import httpx
+
+SORT_FIELDS = {'KEY': 'key', 'VERSION': 'version', 'CREATE': 'create_revision', 'MOD': 'mod_revision', 'VALUE': 'value'}
+COMPARE_FIELDS = {'VERSION': 'version', 'CREATE': 'create_revision', 'MOD': 'mod_revision'}
+
+
+def _encode(value: bytes) -> str:
+    return base64.b64encode(value).decode()
+
+
+def _decode(value: Optional[str]) -> bytes:
+    return base64.b64decode(value) if value else b''
+
+
+class FakeEtcdError(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+class FakeEtcd:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.revision = 1
+        self.compact_revision = 0
+        # Every version of every key, and the keys that currently exist, both sorted
+        self._history: dict[bytes, list[tuple[int, Optional[dict]]]] = {}
+        self._keys: list[bytes] = []
+        self._live: list[bytes] = []
+        self._events: list[tuple[int, str, dict, Optional[dict]]] = []
+        self._waiters: set[asyncio.Event] = set()
+
+    def load(self, items: dict[str, str | bytes]):
+        """
+        Stores items in a single revision without going through the gateway, to seed large key spaces quickly.
+        """
+        self.revision += 1
+        events = []
+        for key, value in items.items():
+            self._put(key.encode(), value.encode() if isinstance(value, str) else value, self.revision, events)
+        self._commit(events)
+
+    def compact(self, revision: int):
+        self.compact_revision = revision
+
+    def _current(self, key: bytes, revision: int = 0) -> Optional[dict]:
+        history = self._history.get(key)
+        if not history:
+            return None
+        if not revision or revision >= self.revision:
+            return history[-1][1]
+        for mod_revision, kv in reversed(history):
+            if mod_revision <= revision:
+                return kv
+        return None
+
+    def _select(self, start: bytes, end: bytes, revision: int = 0, limit: int = 0) -> tuple[list[dict], int]:
+        """
+        Returns up to limit values in [start, end) as of revision, and how many there are in total.
+        """
+        if not end:
+            kv = self._current(start, revision)
+            return ([kv], 1) if kv else ([], 0)
+
+        historical = revision and revision < self.revision
+        keys = self._keys if historical else self._live
+        first = bisect.bisect_left(keys, start)
+        last = len(keys) if end == b'\0' else bisect.bisect_left(keys, end, lo=first)
+        if not historical:
+            selected = keys[first:last if not limit else min(last, first + limit)]
+            return [self._history[key][-1][1] for key in selected], last - first
+
+        kvs = [kv for kv in (self._current(key, revision) for key in keys[first:last]) if kv]
+        return (kvs[:limit] if limit else kvs), len(kvs)
+
+    def _header(self) -> dict:
+        return {'cluster_id': '1', 'member_id': '1', 'revision': str(self.revision), 'raft_term': '1'}
+
+    @staticmethod
+    def _kv_json(kv: dict, keys_only: bool = False) -> dict:
+        output = {
+            'key': _encode(kv['key']),
+            'create_revision': str(kv['create_revision']),
+            'mod_revision': str(kv['mod_revision']),
+            'version': str(kv['version'])
+        }
+        if not keys_only and kv['value']:
+            output['value'] = _encode(kv['value'])
+        return output
+
+    def range(self, request: dict) -> dict:
+        start, end = _decode(request.get('key')), _decode(request.get('range_end'))
+        revision = int(request.get('revision', 0))
+        if revision and revision < self.compact_revision:
+            raise FakeEtcdError('etcdserver: mvcc: required revision has been compacted')
+        if revision > self.revision:
+            raise FakeEtcdError('etcdserver: mvcc: required revision is a future revision')
+
+        limit = int(request.get('limit', 0))
+        sort_target = request.get('sort_target')
+        # Sorting needs every value, otherwise only the page is materialised
+        kvs, count = self._select(start, end, revision, limit + 1 if limit and not sort_target else 0)
+
+        output = {'header': self._header()}
+        if count:
+            output['count'] = str(count)
+        if request.get('count_only'):
+            return output
+        if sort_target:
+            field = SORT_FIELDS[sort_target]
+            kvs = sorted(kvs, key=lambda kv: kv[field], reverse=request.get('sort_order') == 'DESCEND')
+        if limit and len(kvs) > limit:
+            kvs = kvs[:limit]
+            output['more'] = True
+        if kvs:
+            output['kvs'] = [self._kv_json(kv, request.get('keys_only', False)) for kv in kvs]
+        return output
+
+    def _put(self, key: bytes, value: bytes, revision: int, events: list) -> Optional[dict]:
+        previous = self._current(key)
+        kv = {
+            'key': key,
+            'value': value,
+            'mod_revision': revision,
+            'create_revision': previous['create_revision'] if previous else revision,
+            'version': previous['version'] + 1 if previous else 1
+        }
+        if key not in self._history:
+            self._history[key] = []
+            bisect.insort(self._keys, key)
+        if previous is None:
+            bisect.insort(self._live, key)
+        self._history[key].append((revision, kv))
+        events.append((revision, 'PUT', kv, previous))
+        return previous
+
+    def _delete(self, start: bytes, end: bytes, revision: int, events: list, prev_kv: bool = False) -> dict:
+        kvs, _ = self._select(start, end)
+        for kv in kvs:
+            self._history[kv['key']].append((revision, None))
+            del self._live[bisect.bisect_left(self._live, kv['key'])]
+            deleted = {'key': kv['key'], 'value': b'', 'mod_revision': revision, 'create_revision': 0, 'version': 0}
+            events.append((revision, 'DELETE', deleted, kv))
+
+        output = {'header': self._header()}
+        if kvs:
+            output['deleted'] = str(len(kvs))
+        if prev_kv and kvs:
+            output['prev_kvs'] = [self._kv_json(kv) for kv in kvs]
+        return output
+
+    def _commit(self, events: list):
+        self._events.extend(events)
+        for waiter in self._waiters:
+            waiter.set()
+
+    def put(self, request: dict) -> dict:
+        events = []
+        self.revision += 1
+        previous = self._put(_decode(request['key']), _decode(request.get('value')), self.revision, events)
+        self._commit(events)
+        output = {'header': self._header()}
+        if request.get('prev_kv') and previous:
+            output['prev_kv'] = self._kv_json(previous)
+        return output
+
+    def delete_range(self, request: dict) -> dict:
+        start, end = _decode(request.get('key')), _decode(request.get('range_end'))
+        if not self._select(start, end)[1]:
+            return {'header': self._header()}
+        events = []
+        self.revision += 1
+        output = self._delete(start, end, self.revision, events, request.get('prev_kv', False))
+        output['header'] = self._header()
+        self._commit(events)
+        return output
+
+    def _compare(self, compare: dict) -> bool:
+        kv = self._current(_decode(compare['key']))
+        target = compare.get('target', 'VERSION')
+        if target == 'VALUE':
+            actual, expected = (kv['value'] if kv else b''), _decode(compare.get('value'))
+        else:
+            field = COMPARE_FIELDS[target]
+            actual, expected = (kv[field] if kv else 0), int(compare.get(field, 0))
+        return {
+            'EQUAL': actual == expected,
+            'NOT_EQUAL': actual != expected,
+            'GREATER': actual > expected,
+            'LESS': actual < expected
+        }[compare.get('result', 'EQUAL')]
+
+    def txn(self, request: dict) -> dict:
+        succeeded = all(self._compare(compare) for compare in request.get('compare', []))
+        operations = request.get('success' if succeeded else 'failure', [])
+        writes = any('request_put' in operation or 'request_delete_range' in operation for operation in operations)
+        revision = self.revision + 1 if writes else self.revision
+
+        events, responses = [], []
+        for operation in operations:
+            if 'request_range' in operation:
+                responses.append({'response_range': self.range(operation['request_range'])})
+            elif 'request_put' in operation:
+                put = operation['request_put']
+                previous = self._put(_decode(put['key']), _decode(put.get('value')), revision, events)
+                response = {'header': {}}
+                if put.get('prev_kv') and previous:
+                    response['prev_kv'] = self._kv_json(previous)
+                responses.append({'response_put': response})
+            elif 'request_delete_range' in operation:
+                delete = operation['request_delete_range']
+                responses.append({'response_delete_range': self._delete(
+                    _decode(delete.get('key')), _decode(delete.get('range_end')), revision, events, delete.get('prev_kv', False)
+                )})
+
+        if writes:
+            self.revision = revision
+            self._commit(events)
+        output = {'header': self._header(), 'responses': responses}
+        if succeeded:
+            output['succeeded'] = True
+        return output
+
+    @staticmethod
+    def _in_range(key: bytes, start: bytes, end: bytes) -> bool:
+        if not end:
+            return key == start
+        return key >= start and (end == b'\0' or key < end)
+
+    async def watch(self, request: dict):
+        create = request['create_request']
+        start, end = _decode(create.get('key')), _decode(create.get('range_end'))
+        start_revision = int(create.get('start_revision', 0)) or self.revision + 1
+
+        yield {'result': {'header': self._header(), 'created': True}}
+        if start_revision < self.compact_revision:
+            yield {'result': {'header': self._header(), 'compact_revision': str(self.compact_revision), 'canceled': True}}
+            return
+
+        # Events are appended in revision order, so a watch from the past starts at the first one it wants
+        position = bisect.bisect_left(self._events, start_revision, key=lambda event: event[0])
+        waiter = asyncio.Event()
+        self._waiters.add(waiter)
+        try:
+            while True:
+                batch = []
+                while position < len(self._events):
+                    revision, event_type, kv, previous = self._events[position]
+                    position += 1
+                    if not self._in_range(kv['key'], start, end):
+                        continue
+                    event = {'kv': self._kv_json(kv)}
+                    if event_type == 'DELETE':
+                        event['type'] = 'DELETE'
+                    if create.get('prev_kv') and previous:
+                        event['prev_kv'] = self._kv_json(previous)
+                    batch.append(event)
+                if batch:
+                    yield {'result': {'header': self._header(), 'events': batch}}
+                waiter.clear()
+                await waiter.wait()
+        finally:
+            self._waiters.discard(waiter)
+
+
+ROUTES = {'/v3/kv/range': 'range', '/v3/kv/put': 'put', '/v3/kv/deleterange': 'delete_range', '/v3/kv/txn': 'txn'}
+
+
+class _WatchStream(httpx.AsyncByteStream):
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def __aiter__(self):
+        async for message in self.messages:
+            yield json.dumps(message).encode() + b'\n'
+
+    async def aclose(self):
+        await self.messages.aclose()
+
+
+class FakeEtcdTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport answering the gateway paths EtcdClient posts to from a FakeEtcd.
+    """
+    def __init__(self, etcd: FakeEtcd):
+        self.etcd = etcd
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.etcd.latency:
+            await asyncio.sleep(self.etcd.latency)
+        body = json.loads(await request.aread() or b'{}')
+
+        if request.url.path == '/v3/watch':
+            return httpx.Response(200, stream=_WatchStream(self.etcd.watch(body)))
+        try:
+            output = getattr(self.etcd, ROUTES[request.url.path])(body)
+        except FakeEtcdError as e:
+            return httpx.Response(400, json={'error': e.message, 'message': e.message, 'code': 11})
+        return httpx.Response(200, json=output)
+
+
+def install(etcd_client, latency: float = 0.0) -> FakeEtcd:
+    """
+    Points etcd_client at a new FakeEtcd and returns it.
+    """
+    etcd = FakeEtcd(latency)
+    etcd_client._client = httpx.AsyncClient(base_url='http://fake-etcd', transport=FakeEtcdTransport(etcd))
+    return etcd
+
+
+class FakeEtcdGateway:
+    """
+    ASGI app answering the gateway paths from a FakeEtcd, the HTTP counterpart of FakeEtcdTransport.
+    """
+    def __init__(self, etcd: FakeEtcd):
+        self.transport = FakeEtcdTransport(etcd)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        body, more = b'', True
+        while more:
+            message = await receive()
+            body += message.get('body', b'')
+            more = message.get('more_body', False)
+
+        response = await self.transport.handle_async_request(
+            httpx.Request(scope['method'], f'http://fake-etcd{scope["path"]}', content=body)
+        )
+
+        async def stream():
+            await send({'type': 'http.response.start', 'status': response.status_code, 'headers': [(b'content-type', b'application/json')]})
+            async for chunk in response.stream:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        async def disconnected():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        # A watch only ends when its client goes away, which the server would otherwise wait for on shutdown
+        tasks = [asyncio.ensure_future(stream()), asyncio.ensure_future(disconnected())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await response.aclose()
+
+
+def main():
+    import uvicorn
+    from benchmarks.endpoints import seed_items
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=2379)
+    parser.add_argument('--latency', type=float, default=0.0, help='Milliseconds added to every request')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[], help='Seed the resources of benchmarks.endpoints with these list sizes')
+    args = parser.parse_args()
+
+    etcd = FakeEtcd(args.latency / 1000)
+    etcd.load(seed_items(args.sizes))
+    uvicorn.run(FakeEtcdGateway(etcd), host='127.0.0.1', port=args.port, lifespan='off', log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Compares jsonschema.validate, which checks the schema and builds a validator on every
+call, with the validators compiled and cached by ResourceDefinitionCache.
+
+    python -m benchmarks.validation --iterations 2000
+"""
+import argparse
+import time
+
+import jsonschema
+
+from core_api.etcd.cache import ResourceDefinitionCache
+from core_api.etcd.validate import ResourceValidator
+
+RESOURCE_DEFINITION = {
+    'apiVersion': 'api.catcode.io/v1alpha1',
+    'kind': 'ResourceDefinition',
+    'metadata': {'name': 'ComponentResourceDefinition'},
+    'spec': {
+        'group': 'catcode.io',
+        'names': {'plural': 'components', 'singular': 'component', 'kind': 'Component'},
+        'versions': [{
+            'name': 'v1alpha1',
+            'schemaVersion': 'openAPISchemaV3',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'owner': {'type': 'string'},
+                    'lifecycle': {'type': 'string', 'enum': ['Development', 'Production', 'Deprecated']},
+                    'system': {'type': 'string'},
+                    'tags': {'type': 'array', 'items': {'type': 'string', 'pattern': '^[a-z0-9-]+$'}},
+                    'links': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {'title': {'type': 'string'}, 'url': {'type': 'string'}},
+                            'required': ['title', 'url']
+                        }
+                    }
+                },
+                'required': ['owner', 'lifecycle']
+            }
+        }]
+    }
+}
+
+RESOURCE = {
+    'apiVersion': 'catcode.io/v1alpha1',
+    'kind': 'Component',
+    'metadata': {'name': 'core-api', 'labels': {'team': 'platform'}, 'annotations': {}},
+    'spec': {
+        'owner': 'mw',
+        'lifecycle': 'Development',
+        'system': 'catcode',
+        'tags': ['python', 'core-api', 'backend'],
+        'links': [{'title': 'Telemetry', 'url': 'http://grafana.mw.local'}]
+    }
+}
+
+
+def measure(name: str, func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f'{name:<32} {iterations / elapsed:>10.1f} ops/s  {elapsed / iterations * 1e6:>8.1f} us/op')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    cache = ResourceDefinitionCache()
+    cache.add_resource(RESOURCE_DEFINITION)
+    validator = ResourceValidator(cache)
+
+    base_schema = validator.base_schemas['base-schema']
+    spec_schema = RESOURCE_DEFINITION['spec']['versions'][0]['schema']
+
+    def uncached():
+        jsonschema.validate(RESOURCE, base_schema)
+        jsonschema.validate(RESOURCE['spec'], spec_schema)
+
+    def cached():
+        validator.base_validation(RESOURCE)
+        validator.validate(RESOURCE)
+
+    before = measure('jsonschema.validate', uncached, args.iterations)
+    after = measure('compiled validators', cached, args.iterations)
+    print(f'speed up: {before / after:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
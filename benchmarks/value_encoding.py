@@ -0,0 +1,81 @@
+"""
+Compares the stored size of resources and the time to encode and decode them with every
+available value encoding, for resources of a few typical sizes.
+
+    python -m benchmarks.value_encoding
+    python -m benchmarks.value_encoding --iterations 5000
+
+For the effect on the endpoints run benchmarks.endpoints with --encoding, e.g.
+
+    python -m benchmarks.endpoints --latency 1 --encoding zlib
+"""
+import argparse
+import json
+import statistics
+import time
+
+from core_api.storage.codec import ENCODINGS, ValueCodec, zstandard
+
+
+def catalog_resource(name: str, links: int, description_words: int) -> dict:
+    """
+    A catalog entity like the ones stored in practice: labels, annotations, a description, links and dependencies.
+    """
+    return {
+        'apiVersion': 'catcode.io/v1alpha1',
+        'kind': 'Component',
+        'metadata': {
+            'name': name,
+            'labels': {'team': 'platform', 'tier': 'backend', 'lifecycle': 'production'},
+            'annotations': {'catcode.io/source-location': f'https://github.com/catcode/{name}', 'catcode.io/techdocs-ref': 'dir:.'}
+        },
+        'spec': {
+            'owner': 'platform-team',
+            'type': 'service',
+            'lifecycle': 'production',
+            'description': ' '.join(f'word{i * 7919 % 1000}' for i in range(description_words)),
+            'tags': ['python', 'fastapi', 'etcd', 'backend'],
+            'links': [{'url': f'https://dashboards.catcode.io/{name}/{i}', 'title': f'Dashboard {i}', 'icon': 'dashboard'} for i in range(links)],
+            'dependsOn': [f'component:default/dependency-{i}' for i in range(links)]
+        }
+    }
+
+
+SAMPLES = {
+    'small': catalog_resource('small-service', links=1, description_words=10),
+    'medium': catalog_resource('medium-service', links=10, description_words=200),
+    'large': catalog_resource('large-service', links=100, description_words=2000),
+}
+
+
+def measure(func, value, iterations: int) -> float:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func(value)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--min-bytes', type=int, default=512)
+    args = parser.parse_args()
+
+    encodings = [encoding for encoding in ENCODINGS if encoding != 'zstd' or zstandard is not None]
+    print(f'{"sample":<8} {"encoding":<6} {"bytes":>8} {"ratio":>7} {"encode us":>10} {"decode us":>10}')
+    for name, resource in SAMPLES.items():
+        value = json.dumps(resource).encode()
+        for encoding in encodings:
+            codec = ValueCodec(encoding, min_bytes=args.min_bytes)
+            encoded = codec.encode(value)
+            assert codec.decode(encoded) == value
+            print(
+                f'{name:<8} {encoding:<6} {len(encoded):>8} {len(encoded) / len(value):>7.1%}'
+                f' {measure(codec.encode, value, args.iterations):>10.2f} {measure(codec.decode, encoded, args.iterations):>10.2f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Measures how throughput scales with the number of API worker processes. Serves benchmarks.fake_etcd
+over HTTP in a process of its own, starts the API under uvicorn with each --workers count against it,
+and loads it from --clients processes for --duration seconds per scenario.
+
+    python -m benchmarks.workers
+    python -m benchmarks.workers --workers 1 2 4 8 --clients 8 --duration 10
+
+Gets and lists are answered from the informer of every worker, so they should scale with the
+cores until the clients or the cores run out. For every worker count it also reports how long a
+definition posted through one worker takes until every worker serves its type.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from settings import BASE_DIR, config
+
+
+def __getattr__(name: str):
+    # uvicorn imports benchmarks.workers:app in every worker, which then serves the API on the gateway started for it
+    if name == 'app':
+        config.etcd_host = os.environ['BENCHMARK_ETCD']
+        config.events_enabled = False
+        from main import app
+        return app
+    raise AttributeError(name)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start(arguments: list[str], env: dict = None) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, '-m', *arguments], cwd=BASE_DIR, env={**os.environ, **(env or {})})
+
+
+def wait_until_ready(url: str, timeout: float = 120):
+    # Every worker must be ready, and which one answers is up to the kernel, so several in a row have to be
+    deadline, in_a_row = time.monotonic() + timeout, 0
+    while in_a_row < 50:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f'{url} did not become ready within {timeout}s')
+        try:
+            in_a_row = in_a_row + 1 if httpx.get(f'{url}/health/ready').status_code == 200 else 0
+        except httpx.TransportError:
+            in_a_row = 0
+        if not in_a_row:
+            time.sleep(0.1)
+
+
+async def load(url: str, path: str, concurrency: int, duration: float) -> list[float]:
+    timings = []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=None) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker(offset: int):
+            i = offset
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.get(path.format(i=i % 1000))
+                timings.append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    raise RuntimeError(f'GET {path} answered {response.status_code}: {response.text[:200]}')
+                i += concurrency
+
+        await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+    return timings
+
+
+def client(url: str, path: str, concurrency: int, duration: float) -> list[float]:
+    return asyncio.run(load(url, path, concurrency, duration))
+
+
+def run_scenario(url: str, path: str, clients: int, concurrency: int, duration: float) -> dict:
+    with multiprocessing.get_context('spawn').Pool(clients) as pool:
+        results = pool.starmap(client, [(url, path, concurrency, duration)] * clients)
+    timings = sorted(timing for result in results for timing in result)
+    return {
+        'throughput': len(timings) / duration,
+        'p50_ms': statistics.median(timings) * 1000,
+        'p99_ms': timings[max(0, int(len(timings) * 0.99) - 1)] * 1000,
+    }
+
+
+def definition_propagation(url: str, kind: str, timeout: float = 30) -> float:
+    """
+    Posts a definition and returns the seconds until 50 requests in a row found its type.
+    """
+    # Not imported at the top, the etcd client it brings along must be built after the workers set etcd_host
+    from benchmarks.endpoints import resource_definition
+
+    plural = f'{kind.lower()}s'
+    start = time.perf_counter()
+    response = httpx.post(f'{url}/resource/v1/', json=resource_definition(kind, plural, kind.lower()))
+    response.raise_for_status()
+
+    seen, in_a_row = None, 0
+    while in_a_row < 50:
+        if time.perf_counter() - start > timeout:
+            raise RuntimeError(f'{plural} was not served by every worker within {timeout}s')
+        if httpx.get(f'{url}/resource/v1/{plural}?count=true').status_code == 200:
+            seen = seen or time.perf_counter()
+            in_a_row += 1
+        else:
+            seen, in_a_row = None, 0
+    return seen - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='*', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=os.cpu_count(), help='Load generating processes')
+    parser.add_argument('--concurrency', type=int, default=16, help='Requests in flight per client')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per scenario')
+    parser.add_argument('--size', type=int, default=100, help='Resources in the listed collection')
+    parser.add_argument('--only', nargs='*', help='Only run scenarios whose name starts with one of these')
+    args = parser.parse_args()
+
+    scenarios = {
+        'get': '/resource/v1/component/component-{i}',
+        f'list {args.size}': f'/resource/v1/list{args.size}s',
+        f'list {args.size} keys': f'/resource/v1/list{args.size}s?keysOnly=true',
+    }
+    etcd_port = free_port()
+    etcd = start(['benchmarks.fake_etcd', '--port', str(etcd_port), '--sizes', str(args.size)])
+    baseline = {}
+    try:
+        for workers in args.workers:
+            port = free_port()
+            url = f'http://127.0.0.1:{port}'
+            api = start(
+                ['uvicorn', 'benchmarks.workers:app', '--port', str(port), '--workers', str(workers), '--log-level', 'warning'],
+                env={'BENCHMARK_ETCD': f'http://127.0.0.1:{etcd_port}'}
+            )
+            try:
+                wait_until_ready(url)
+                for name, path in scenarios.items():
+                    if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                        continue
+                    result = run_scenario(url, path, args.clients, args.concurrency, args.duration)
+                    scaling = result['throughput'] / baseline.setdefault(name, result['throughput'])
+                    print(
+                        f'{workers:>2} workers  {name:<16} {result["throughput"]:>10.1f} req/s  {scaling:>5.2f}x'
+                        f'  p50 {result["p50_ms"]:>8.3f} ms  p99 {result["p99_ms"]:>8.3f} ms'
+                    )
+                propagation = definition_propagation(url, f'Probe{workers}')
+                print(f'{workers:>2} workers  definition served by every worker after {propagation * 1000:.1f} ms')
+            finally:
+                api.terminate()
+                api.wait()
+    finally:
+        etcd.terminate()
+        etcd.wait()
+
+
+if __name__ == '__main__':
+    main()
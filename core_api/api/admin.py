@@ -0,0 +1,57 @@
+import hmac
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, Query, Response
+from fastapi.exceptions import HTTPException
+
+from core_api.profiling import profiler, slow_requests
+from settings import config
+
+
+def require_admin(authorization: Optional[str] = Header(None)):
+    """
+    Admits requests carrying "Authorization: Bearer <admin_token>". Without an admin_token configured
+    the admin endpoints do not exist.
+    """
+    if not config.admin_token:
+        raise HTTPException(status_code=404, detail='Not Found')
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.encode(), config.admin_token.encode()):
+        raise HTTPException(status_code=401, detail='Invalid admin token', headers={'WWW-Authenticate': 'Bearer'})
+
+
+router = APIRouter(prefix='/admin', dependencies=[Depends(require_admin)])
+
+
+@router.get('/profile')
+async def profile(
+        seconds: float = Query(10.0, gt=0, le=config.profile_max_seconds),
+        interval: float = Query(0.005, ge=0.001, le=1.0),
+        all_threads: bool = False
+):
+    """
+    Samples this worker for seconds and returns collapsed stacks, ready for flamegraph.pl or speedscope.
+
+    Only the event loop thread is sampled, where requests are served, unless all_threads is set,
+    which adds the validation pool and other threads. Every sample of an idle loop ends in select.
+    """
+    stacks = await profiler.profile(seconds, interval, all_threads)
+    return Response(stacks, media_type='text/plain')
+
+
+@router.get('/slow-requests')
+async def get_slow_requests():
+    """
+    The last requests slower than slow_request_threshold, with the time each stage of them took.
+    """
+    return {
+        'threshold': slow_requests.threshold,
+        'enabled': slow_requests.enabled,
+        'requests': list(slow_requests.requests)
+    }
+
+
+@router.delete('/slow-requests')
+async def clear_slow_requests():
+    slow_requests.clear()
+    return {'status': 'cleared'}
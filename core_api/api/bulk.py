@@ -0,0 +1,225 @@
+import json
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+import yaml
+from fastapi import APIRouter, Request
+from fastapi.exceptions import HTTPException
+
+from core_api.api.singleflight import read_flight
+from core_api.etcd.cache import resource_definition_cache
+from core_api.etcd.client import compare_mod_revision, put_request, request_size
+from core_api.etcd.informer import resource_informer
+from core_api.etcd.keys import key_builder
+from core_api.etcd.validate import resource_validator, run_validation
+from core_api.event.publisher import event_publisher
+from core_api.metrics import metrics
+from core_api.storage import storage
+from core_api.storage.admission import storage_priority
+from core_api.resource.version import pop_resource_version
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix='/resource/v1')
+
+YAML_CONTENT_TYPES = ('application/yaml', 'application/x-yaml', 'text/yaml')
+
+
+@dataclass
+class BulkItem:
+    resource: dict
+    key: Optional[str] = None
+    value: Optional[str] = None
+    request: Optional[dict] = None
+    error: Optional[HTTPException] = None
+    revision: int = 0
+    # metadata.resourceVersion the stored resource must still be at, if given
+    expected: Optional[int] = None
+
+    def result(self, applied: bool = True) -> dict:
+        if self.error:
+            return {"key": self.key, "status": "failed", "status_code": self.error.status_code, "detail": self.error.detail}
+        if not applied:
+            return {"key": self.key, "status": "not_applied"}
+        return {"key": self.key, "status": "created_or_updated", "revision": self.revision}
+
+
+def is_resource_definition(resource: dict) -> bool:
+    return 'api.catcode.io' in str(resource.get('apiVersion', ''))
+
+
+async def read_resources(request: Request) -> list[dict]:
+    """
+    Reads a JSON list of resources, or a multi document YAML stream when the content type is YAML.
+    """
+    body = await request.body()
+    content_type = request.headers.get('content-type', '').split(';')[0].strip()
+    try:
+        if content_type in YAML_CONTENT_TYPES:
+            documents = [document for document in yaml.safe_load_all(body) if document is not None]
+            # A single YAML document may itself hold the list
+            if len(documents) == 1 and isinstance(documents[0], list):
+                documents = documents[0]
+        else:
+            documents = json.loads(body)
+    except (ValueError, yaml.YAMLError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse request body: {e}")
+
+    if not isinstance(documents, list) or not all(isinstance(document, dict) for document in documents):
+        raise HTTPException(status_code=400, detail="Expected a list of resources")
+    return documents
+
+
+def validate_items(items: list[BulkItem], definitions: bool):
+    """
+    Validates a whole batch in one executor call, recording the error of each invalid item.
+    """
+    for item in items:
+        if item.error or is_resource_definition(item.resource) != definitions:
+            continue
+        try:
+            resource_validator.base_validation(item.resource)
+            if definitions:
+                resource_validator.base_resource_validation(item.resource)
+            else:
+                resource_validator.validate(item.resource)
+        except HTTPException as e:
+            item.error = e
+        except (KeyError, ValueError, AttributeError) as e:
+            item.error = HTTPException(status_code=400, detail=f"Invalid resource: {e}")
+
+
+def chunk_items(items: list[BulkItem]) -> list[list[BulkItem]]:
+    """
+    Splits the writes into as few transactions as etcds operation and request size limits allow.
+    """
+    chunks, current, size = [], [], 0
+    for item in items:
+        item_size = request_size(item.request)
+        if current and (len(current) == config.etcd_max_txn_ops or size + item_size > config.etcd_max_request_bytes):
+            chunks.append(current)
+            current, size = [], 0
+        current.append(item)
+        size += item_size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def restore_definitions(previous: list[tuple[BulkItem, Optional[dict]]]):
+    # Undo cache changes for definitions that did not get written
+    for item, old in reversed(previous):
+        if old is not None:
+            resource_definition_cache.add_resource(old)
+        else:
+            resource_definition_cache.remove(item.resource)
+
+
+@router.post('/bulk')
+async def bulk_apply(request: Request, atomic: bool = True):
+    """
+    Creates or updates a list of resources, given as a JSON list or a multi document YAML stream.
+
+    Resources are validated as one batch and written with as few etcd transactions as the
+    request limits allow. ResourceDefinitions in the batch are applied before the resources using them.
+
+    atomic=true (default) writes everything in a single transaction or nothing at all, and fails
+    with 400 if any resource is invalid or 413 if the batch does not fit one transaction.
+    atomic=false writes every valid resource and reports a result per resource.
+
+    Resources carrying metadata.resourceVersion are only written if they are still at that version,
+    a stale one fails the whole batch with 409. Such preconditions need atomic=true.
+    """
+    # Queued storage calls of a bulk apply go after the reads and writes of every other request
+    storage_priority.set('bulk')
+    items = [BulkItem(resource=resource) for resource in await read_resources(request)]
+    for item in items:
+        try:
+            item.expected = pop_resource_version(item.resource)
+        except HTTPException as e:
+            item.error = e
+            continue
+        if item.expected is not None and not atomic:
+            item.error = HTTPException(status_code=400, detail="metadata.resourceVersion requires atomic=true")
+
+    # Definitions go first, so resources in the same batch validate against them
+    await run_validation(validate_items, items, True)
+    previous = []
+    for item in items:
+        if item.error or not is_resource_definition(item.resource):
+            continue
+        spec = item.resource['spec']
+        old = resource_definition_cache.get_definition(spec['group'], spec['names']['singular'])
+        try:
+            resource_definition_cache.add_resource(item.resource)
+            previous.append((item, old))
+        except HTTPException as e:
+            item.error = e
+
+    await run_validation(validate_items, items, False)
+
+    seen = set()
+    for item in items:
+        if item.error:
+            continue
+        try:
+            item.key = key_builder.from_resource(item.resource)
+        except HTTPException as e:
+            item.error = e
+            continue
+        if item.key in seen:
+            item.error = HTTPException(status_code=400, detail=f"Resource {item.key} appears more than once")
+            continue
+        seen.add(item.key)
+        with metrics.timed(metrics.serialization_seconds, 'serialization', 'write'):
+            item.value = json.dumps(item.resource)
+        item.request = put_request(item.key, item.value, prev_kv=True)
+
+    valid = [item for item in items if not item.error]
+    chunks = chunk_items(valid)
+
+    if not atomic:
+        restore_definitions([(item, old) for item, old in previous if item.error])
+        previous = [(item, old) for item, old in previous if not item.error]
+
+    if atomic:
+        if len(valid) != len(items):
+            restore_definitions(previous)
+            raise HTTPException(status_code=400, detail=[item.result(applied=False) for item in items])
+        if len(chunks) > 1:
+            restore_definitions(previous)
+            raise HTTPException(
+                status_code=413,
+                detail=f"{len(items)} resources do not fit one transaction, "
+                       f"use atomic=false or split the request"
+            )
+
+    revision = 0
+    for chunk in chunks:
+        compare = [compare_mod_revision(item.key, item.expected) for item in chunk if item.expected is not None]
+        try:
+            output = await storage.txn(compare=compare, success=[item.request for item in chunk])
+            if not output.succeeded:
+                raise HTTPException(status_code=409, detail="A resource was modified since its metadata.resourceVersion")
+        except HTTPException as e:
+            if atomic:
+                restore_definitions(previous)
+                raise
+            logger.error(f'Bulk write of {len(chunk)} resources failed: {e.detail}')
+            for item in chunk:
+                item.error = e
+            restore_definitions([(item, old) for item, old in previous if item.error is e])
+            continue
+        revision = output.revision
+        for item, response in zip(chunk, output.responses):
+            item.revision = output.revision
+            event_publisher.emit_write(item.key, output.revision, item.value, response.prev_kv)
+
+    read_flight.invalidate()
+    await resource_informer.wait_for_revision(revision)
+
+    applied = sum(1 for item in items if not item.error)
+    logger.debug(f'Bulk applied {applied} of {len(items)} resources in {len(chunks)} transactions')
+    return {"count": applied, "revision": revision, "results": [item.result() for item in items]}
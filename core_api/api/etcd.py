@@ -1,50 +1,366 @@
+import asyncio
 import logging
 
 from core_api.resource.initializer import set_metadata_fields
+from core_api.resource.version import pop_resource_version, set_resource_version
 
 logger = logging.getLogger(__name__)
+import base64
 import json
 from typing import Optional
 
 import yaml
-from fastapi import APIRouter, FastAPI, Depends, Request
+from fastapi import APIRouter, FastAPI, Depends, Header, Query, Request, Response
 from fastapi.exceptions import HTTPException
-
-from core_api.etcd.cache import resource_definition_cache
-from core_api.etcd.command import run_command
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.convertors import Convertor, register_url_convertor
+
+from core_api.api.responses import dumps, json_response, loads, raw_json
+from core_api.api.singleflight import read_flight
+from core_api.etcd.cache import DEFINITION_GROUP, resource_definition_cache
+from core_api.etcd.client import (
+    EtcdCompactedError, KeyValue, compare_mod_revision, delete_request, prefix_range_end, put_request, range_request
+)
+from core_api.etcd.informer import resource_informer
 from core_api.etcd.keys import key_builder
-from core_api.etcd.validate import resource_validator
+from core_api.etcd.selectors import Projection, Selector
+from core_api.etcd.validate import resource_validator, run_validation
+from core_api.etcd.watch import ADDED, ResourceEvent, watch_manager
+from core_api.event.events import Events
+from core_api.event.publisher import event_publisher
+from core_api.metrics import metrics
+from core_api.storage import storage
 from settings import config, BASE_DIR
 
+
+
+class VersionConvertor(Convertor):
+    """
+    Matches a version path segment, so <type>/<version> can be told apart from <type>/<name> by its shape.
+    """
+    regex = r'v\d+(?:(?:alpha|beta)\d+)?'
+
+    def convert(self, value: str) -> str:
+        return value
+
+    def to_string(self, value: str) -> str:
+        return value
+
+
+register_url_convertor('version', VersionConvertor())
+
 router = APIRouter(prefix='/resource/v1')
 
 
+async def read_key(path: str, consistent: bool = False) -> tuple[Optional[KeyValue], int]:
+    """
+    Reads a key from the informer cache, or from etcd with a quorum read when consistent is set
+    or the cache is not synced. Returns the value together with the revision it reflects.
+    """
+    hit = resource_informer.ready and not consistent
+    metrics.cache('read', hit)
+    if hit:
+        return resource_informer.get(path), resource_informer.revision
+    output = await storage.get_range(path)
+    return (output.kvs[0] if output.kvs else None), output.revision
+
+
+async def read_prefix(
+        path_prefix: str,
+        consistent: bool = False,
+        start: Optional[str] = None,
+        limit: int = 0,
+        revision: int = 0,
+        selector: Optional[Selector] = None,
+        keys_only: bool = False
+) -> tuple[list[KeyValue], int, bool]:
+    """
+    Reads up to limit values below path_prefix matching selector, beginning at start, as of revision.
+    Returns the values, the revision they reflect and whether there are more. With keys_only the
+    values may be left empty, etcd then does not send them unless the selector needs them.
+
+    The informer answers when it is synced and, for a pinned revision, still at that revision.
+    Otherwise etcd answers, at the pinned revision if there is one, and selectors are applied to each page read.
+    """
+    hit = resource_informer.ready and not consistent and revision in (0, resource_informer.revision)
+    metrics.cache('read', hit)
+    if hit:
+        if selector:
+            kvs, more = resource_informer.select(path_prefix, selector, start=start, limit=limit)
+        else:
+            kvs, more = resource_informer.list_prefix(path_prefix, start=start, limit=limit)
+        return kvs, resource_informer.revision, more
+
+    kvs, key, more = [], start or path_prefix, True
+    while more and (not limit or len(kvs) < limit):
+        try:
+            output = await storage.get_range(
+                key,
+                range_end=prefix_range_end(path_prefix),
+                limit=config.list_page_size if selector else limit,
+                revision=revision,
+                keys_only=keys_only and not selector
+            )
+        except EtcdCompactedError:
+            raise HTTPException(status_code=410, detail=f'Revision {revision} has been compacted, restart the list without continue')
+
+        # Later pages are read at the revision of the first
+        revision = revision or output.revision
+        more = output.more
+        if output.kvs:
+            key = output.kvs[-1].key + '\0'
+        kvs.extend(kv for kv in output.kvs if selector is None or selector.matches(json.loads(kv.value)))
+
+    if limit and len(kvs) > limit:
+        kvs, more = kvs[:limit], True
+    return kvs, revision, more
+
+
+async def count_prefix(path_prefix: str, consistent: bool = False, selector: Optional[Selector] = None) -> tuple[int, int]:
+    """
+    Counts the values below path_prefix matching selector, and returns the count with the revision it reflects.
+    Without a selector no value is read, with one every value is, to be matched.
+    """
+    if selector:
+        kvs, revision, _ = await read_prefix(path_prefix, consistent, selector=selector)
+        return len(kvs), revision
+
+    hit = resource_informer.ready and not consistent
+    metrics.cache('read', hit)
+    if hit:
+        return resource_informer.count_prefix(path_prefix), resource_informer.revision
+    output = await storage.get_range(path_prefix, range_end=prefix_range_end(path_prefix), count_only=True)
+    return output.count, output.revision
+
+
+def informer_revision(consistent: bool) -> Optional[int]:
+    """
+    The revision the informer answers reads at, or None when it does not answer them. Single flight keys
+    include it, so a read only shares results with reads of the same revision.
+    """
+    return resource_informer.revision if resource_informer.ready and not consistent else None
+
+
+def encode_continue(revision: int, start: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps({'revision': revision, 'start': start}).encode()).decode()
+
+
+def decode_continue(token: str, path_prefix: str) -> tuple[int, str]:
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(token.encode()))
+        revision, start = int(decoded['revision']), str(decoded['start'])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail='Invalid continue token')
+
+    if not start.startswith(path_prefix):
+        raise HTTPException(status_code=400, detail='Continue token does not belong to this resource type')
+    return revision, start
+
+
+def revision_etag(revision: int | str) -> str:
+    # Weak, as one tag covers the identity, gzip and zstd encodings of a body, which differ byte for byte
+    return f'W/"{revision}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in tags or etag.removeprefix('W/') in tags
+
+
+async def key_etag(path: str, consistent: bool = False) -> Optional[str]:
+    """
+    ETag of the resource at path, its mod_revision. Only revision metadata is read, never the value.
+    """
+    hit = resource_informer.ready and not consistent
+    metrics.cache('read', hit)
+    if hit:
+        kv = resource_informer.get(path)
+    else:
+        output = await storage.get_range(path, keys_only=True)
+        kv = output.kvs[0] if output.kvs else None
+    return revision_etag(kv.mod_revision) if kv else None
+
+
+async def prefix_etag(path_prefix: str, consistent: bool = False) -> str:
+    """
+    ETag of the resources below path_prefix. From the informer it is the revision of the last change
+    below the prefix. From etcd it is the highest mod_revision together with the number of keys,
+    as a delete does not leave a revision behind but always lowers the count.
+    """
+    hit = resource_informer.ready and not consistent
+    metrics.cache('read', hit)
+    if hit:
+        return revision_etag(resource_informer.prefix_revision(path_prefix))
+    output = await storage.get_range(
+        path_prefix, range_end=prefix_range_end(path_prefix), limit=1, keys_only=True, sort_target='MOD', sort_order='DESCEND'
+    )
+    return revision_etag(f'{output.kvs[0].mod_revision if output.kvs else 0}.{output.count}')
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={'ETag': etag})
+
+
+def decode_resource(kv: KeyValue) -> dict:
+    return set_resource_version(loads(kv.value), kv.mod_revision)
+
+
+async def stream_resources(
+        path_prefix: str,
+        start: str,
+        revision: int,
+        consistent: bool,
+        selector: Optional[Selector],
+        projection: Optional[Projection] = None
+) -> StreamingResponse:
+    """
+    Streams the values below path_prefix as newline delimited JSON, one page of etcd reads at a time,
+    so memory use does not grow with the number of resources. Every page is pinned to the same revision.
+    """
+    kvs, revision, more = await read_prefix(
+        path_prefix, consistent, start=start, limit=config.list_page_size, revision=revision, selector=selector
+    )
+    if not kvs and selector is None:
+        raise HTTPException(status_code=404, detail=f"No resources found for {path_prefix}")
+
+    async def generate(kvs: list[KeyValue], more: bool):
+        while True:
+            for kv in kvs:
+                resource = decode_resource(kv)
+                yield dumps(projection.apply(resource) if projection else resource) + b'\n'
+            if not more:
+                return
+            kvs, _, more = await read_prefix(
+                path_prefix, consistent, start=kvs[-1].key + '\0', limit=config.list_page_size, revision=revision,
+                selector=selector
+            )
+
+    return StreamingResponse(generate(kvs, more), media_type='application/x-ndjson', headers={'X-Revision': str(revision)})
+
+
+def parse_resource_version(resource_version: Optional[str]) -> Optional[int]:
+    if resource_version is None or resource_version == '':
+        return None
+    try:
+        return int(resource_version)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f'Invalid resourceVersion: {resource_version}')
+
+
+def server_sent_event(event_type: str, data: bytes, revision: Optional[int] = None) -> bytes:
+    # Events with an id let EventSource clients resume with Last-Event-ID after reconnecting
+    event_id = f'id: {revision}\n'.encode() if revision is not None else b''
+    return f'event: {event_type}\n'.encode() + event_id + b'data: ' + data + b'\n\n'
+
+
+async def watch_resources(
+        path_prefix: str,
+        resource_version: Optional[int],
+        consistent: bool,
+        selector: Optional[Selector]
+) -> StreamingResponse:
+    """
+    Streams changes below path_prefix as server sent events, ADDED, MODIFIED and DELETED,
+    carrying {"type": ..., "object": ...}. The id of an event is its resourceVersion.
+
+    Without a resourceVersion the current resources are sent as ADDED first, followed by a
+    BOOKMARK with the revision they were listed at, and then every change after it.
+    """
+    initial = []
+    if resource_version is None:
+        initial, resource_version, _ = await read_prefix(path_prefix, consistent, selector=selector)
+
+    hub, subscriber = watch_manager.subscribe(path_prefix, resource_version + 1)
+
+    async def generate():
+        for kv in initial:
+            yield server_sent_event(ADDED, ResourceEvent(ADDED, kv.mod_revision, decode_resource(kv)).data)
+        if initial:
+            yield server_sent_event('BOOKMARK', json.dumps({'type': 'BOOKMARK', 'revision': resource_version}).encode(), resource_version)
+
+        while True:
+            try:
+                event = await subscriber.next(config.watch_heartbeat_seconds)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle stream
+                yield b': heartbeat\n\n'
+                continue
+            except HTTPException as e:
+                error = {'type': 'ERROR', 'object': {'code': e.status_code, 'message': e.detail}}
+                yield server_sent_event('ERROR', json.dumps(error).encode())
+                return
+
+            if selector is None or selector.matches(event.object):
+                yield server_sent_event(event.type, event.data, event.revision)
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Revision': str(resource_version)},
+        # Runs however the stream ends, also when the client goes away
+        background=BackgroundTask(watch_manager.unsubscribe, hub, subscriber)
+    )
+
+
+def is_definition(resource: dict) -> bool:
+    return 'api.catcode.io' in resource['apiVersion']
+
+
+async def stage_resource(resource: dict) -> tuple[dict, Optional[dict]]:
+    """
+    Validates resource before it is written. A ResourceDefinition goes into the definition cache
+    straight away, the definition it replaces is returned so unstage_resource can put it back.
+    """
+    if is_definition(resource):
+        await run_validation(resource_validator.base_resource_validation, resource)
+        previous_definition = resource_definition_cache.get_definition(resource['spec']['group'], resource['spec']['names']['singular'])
+        resource_definition_cache.add_resource(resource)
+        return resource, previous_definition
+    return await run_validation(resource_validator, resource), None
+
+
+def unstage_resource(resource: dict, previous_definition: Optional[dict]):
+    # The definition was not stored, so the cache must not keep it
+    if is_definition(resource):
+        if previous_definition is not None:
+            resource_definition_cache.add_resource(previous_definition)
+        else:
+            resource_definition_cache.remove(resource)
+
 
 @router.post("/")
-def post_resource(resource: dict):
+async def post_resource(resource: dict):
 
-    resource_validator.base_validation(resource)
+    await run_validation(resource_validator.base_validation, resource)
 
+    pop_resource_version(resource)
     resource = set_metadata_fields(resource)
 
-    resource_validator.base_validation(resource)# just to be safe
+    await run_validation(resource_validator.base_validation, resource)# just to be safe
 
     path = key_builder.from_resource(resource)
-    if 'api.catcode.io' in resource['apiVersion']:
-        resource_validator.base_resource_validation(resource)
-        resource_definition_cache.add_resource(resource)
-    else:
-        resource = resource_validator(resource)
-
-    command = ['put', path, json.dumps(resource)]
-    run_command(command)
+    resource, previous_definition = await stage_resource(resource)
 
-    command = ['get', path, '--print-value-only']
+    try:
+        with metrics.timed(metrics.serialization_seconds, 'serialization', 'write'):
+            value = json.dumps(resource)
+        written = await storage.put(path, value, prev_kv=True)
+    except Exception as e:
+        unstage_resource(resource, previous_definition)
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=f"Error creating resource: {str(e)}")
+    event_publisher.emit_write(path, written.revision, value, written.prev_kv)
+    read_flight.invalidate()
+    await resource_informer.wait_for_revision(written.revision)
 
-    output = run_command(command)
+    output = await storage.get(path)
 
     if output:
-        res = json.loads(output.strip())
+        res = decode_resource(output)
         logger.debug(f'Successfully postet to key {path} with value resource {res}')
         return {"key": path, "resource": res, 'exists': True}
 
@@ -52,7 +368,26 @@ def post_resource(resource: dict):
 
 
 @router.get('/{type}')
-def get_resources(type: str = ''):
+@router.get('/{type}/{version:version}')
+async def get_resources(
+        request: Request,
+        type: str = '',
+        version: Optional[str] = None,
+        consistent: bool = False,
+        limit: int = Query(0, ge=0),
+        continue_token: Optional[str] = Query(None, alias='continue'),
+        stream: bool = False,
+        label_selector: Optional[str] = Query(None, alias='labelSelector'),
+        field_selector: Optional[str] = Query(None, alias='fieldSelector'),
+        watch: bool = False,
+        resource_version: Optional[str] = Query(None, alias='resourceVersion'),
+        last_event_id: Optional[str] = Header(None),
+        if_none_match: Optional[str] = Header(None),
+        raw: bool = False,
+        count: bool = False,
+        keys_only: bool = Query(False, alias='keysOnly'),
+        fields: Optional[str] = None
+):
     """
     Should be able to handle resource on the following formats:
 
@@ -69,36 +404,123 @@ def get_resources(type: str = ''):
 
     If the api group is not added, it should try to look it up itself.
     If the version is not added, it should use the newest.
+
+    A version is sent as its own path segment, /components.catcode.io/v1alpha1. When type is singular
+    the segment is the name of a resource that looks like a version, and that resource is returned.
+
+    Resources are served from the informer cache unless consistent=true, which forces a quorum read.
+
+    limit returns at most that many resources together with a continue token for the next page.
+    Every page of a list is read at the revision of its first page.
+    stream=true returns newline delimited JSON, written out as the resources are read.
+
+    labelSelector filters on metadata.labels, e.g. `team=platform,tier in (api,web),!deprecated`.
+    fieldSelector filters on any field with =, == and !=, e.g. `metadata.name=core-api,spec.owner=mw`.
+
+    watch=true streams changes as server sent events instead, starting after resourceVersion,
+    or after the Last-Event-ID of a reconnecting EventSource. Without either it starts with the
+    current resources. Watchers of the same type share one etcd watch.
+
+    Lists carry an ETag, a matching If-None-Match is answered with 304 from revision metadata alone.
+
+    raw=true sends the resources exactly as stored, without parsing them and so without
+    metadata.resourceVersion. Large lists are compressed with zstd or gzip as the client accepts.
+
+    count=true only returns how many resources there are, or match the selectors. keysOnly=true returns
+    the names of the resources instead of the resources, paginated like them. Neither reads a value
+    unless there are selectors to match. fields returns only the given fields of every resource,
+    e.g. `fields=metadata.name,spec.owner`.
     """
+    if version is not None:
+        names = resource_definition_cache.resolve(type)
+        if names is not None and not names.is_plural:
+            return await get_resource(
+                request, type=type, name=version, consistent=consistent, if_none_match=if_none_match, raw=raw
+            )
+        type = f'{type}/{version}'
+
     # Check if the resource type exists and is plural
-    if not resource_definition_cache.exists(type):
+    names = resource_definition_cache.resolve(type)
+    if names is None:
         raise HTTPException(status_code=404, detail=f"Resource {type} does not exist. Choose between {resource_definition_cache.plural_names()}")
 
-    if not resource_definition_cache.is_plural(type):
+    if not names.is_plural:
         raise HTTPException(status_code=400, detail=f"Please use plural names when requesting multiple resources.")
 
     # Build the key prefix path for etcd
     path_prefix = key_builder.from_request(type)
+    # The trailing slash keeps e.g. systems from also matching systemgroups
+    list_prefix = path_prefix + '/'
 
-    logger.debug(f'Fetching resources with path {path_prefix}')
-
-    # Use etcdctl to get all resources with the matching prefix
-    command = ['get', path_prefix, '--prefix', '--print-value-only']
+    selector = Selector.parse(label_selector, field_selector)
+    projection = Projection.parse(fields)
+    if projection and raw:
+        raise HTTPException(status_code=400, detail='fields cannot be combined with raw=true')
 
-    try:
-        output = run_command(command)
-
-        # Check if the output contains any results
-        if output:
-            # Split the output by lines (assuming one resource per line)
-            resources = output.strip().splitlines()
+    start, revision = list_prefix, 0
+    if continue_token:
+        revision, start = decode_continue(continue_token, list_prefix)
 
-            # Parse each resource (assuming the values are JSON objects)
-            resource_list = [json.loads(resource) for resource in resources]
+    logger.debug(f'Fetching resources with path {path_prefix}')
 
-            return {"key_prefix": path_prefix, "resources": resource_list, "count": len(resource_list)}
-        else:
-            raise HTTPException(status_code=404, detail=f"No resources found for {path_prefix}")
+    try:
+        if watch:
+            return await watch_resources(
+                list_prefix, parse_resource_version(resource_version or last_event_id), consistent, selector
+            )
+
+        if stream:
+            return await stream_resources(list_prefix, start, revision, consistent, selector, projection)
+
+        # Taken before the read, so it is never newer than the resources it is sent with
+        etag = await read_flight.do(
+            ('etag', list_prefix, consistent, informer_revision(consistent)),
+            lambda: prefix_etag(list_prefix, consistent),
+            fresh=consistent
+        )
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+        async def read_count() -> bytes:
+            total, read_revision = await count_prefix(list_prefix, consistent, selector)
+            return dumps({"key_prefix": path_prefix, "count": total, "revision": read_revision})
+
+        async def read_list() -> bytes:
+            # Get the resources with the matching prefix
+            kvs, read_revision, more = await read_prefix(
+                list_prefix, consistent, start=start, limit=limit, revision=revision, selector=selector, keys_only=keys_only
+            )
+
+            # Check if the output contains any results, an empty selection is still a valid answer
+            if not (kvs or continue_token or selector):
+                raise HTTPException(status_code=404, detail=f"No resources found for {path_prefix}")
+
+            envelope = {
+                "key_prefix": path_prefix,
+                "count": len(kvs),
+                "revision": read_revision,
+                "continue": encode_continue(read_revision, kvs[-1].key + '\0') if more else None
+            }
+            with metrics.timed(metrics.serialization_seconds, 'serialization', 'list'):
+                if keys_only:
+                    return dumps({**envelope, "names": [kv.key[len(list_prefix):] for kv in kvs]})
+                if projection:
+                    return dumps({**envelope, "resources": [projection.apply(decode_resource(kv)) for kv in kvs]})
+                if raw:
+                    # The stored values are JSON objects already, so they are copied into the body as they are
+                    return raw_json(envelope, {"resources": [kv.value for kv in kvs]})
+                return dumps({**envelope, "resources": [decode_resource(kv) for kv in kvs]})
+
+        # Identical concurrent lists share one read and one encoded body
+        body = await read_flight.do(
+            (
+                'list', list_prefix, consistent, start, limit, revision, label_selector, field_selector,
+                raw, count, keys_only, fields, informer_revision(consistent)
+            ),
+            read_count if count else read_list,
+            fresh=consistent
+        )
+        return await json_response(request, body, headers={'ETag': etag})
 
     except HTTPException as e:
         raise e
@@ -106,7 +528,16 @@ def get_resources(type: str = ''):
         raise HTTPException(status_code=500, detail=f"Error retrieving resources: {str(e)}")
 
 @router.get('/{type}/{name}')
-def get_resource(type: str, name: str = ''):
+@router.get('/{type}/{version:version}/{name}')
+async def get_resource(
+        request: Request,
+        type: str,
+        name: str = '',
+        consistent: bool = False,
+        if_none_match: Optional[str] = Header(None),
+        raw: bool = False,
+        version: Optional[str] = None
+):
     """
     Should be able to handle resource on the following formats
 
@@ -125,111 +556,327 @@ def get_resource(type: str, name: str = ''):
     If api group is not added it should "try" to look it up it self.
     If version is not added it should use the newest.
 
+    The resource is served from the informer cache unless consistent=true, which forces a quorum read.
+    Its ETag is its resourceVersion, a matching If-None-Match is answered with 304 without reading the value.
+    raw=true sends the resource exactly as stored, without metadata.resourceVersion.
     """
-    if not resource_definition_cache.exists(type) and type != 'resourcedefinition':
+    if version is not None:
+        type = f'{type}/{version}'
+
+    names = resource_definition_cache.resolve(type)
+    if names is None:
         raise HTTPException(status_code=404, detail=f'Resource {type} does not exists.')
 
-    if not resource_definition_cache.is_singular(type) and type != 'resourcedefinition':
+    if names.is_plural:
         raise HTTPException(status_code=400, detail=f'Please use singular names when requesting specific resources')
 
     path = key_builder.from_request(type, name)
 
+    try:
+        if if_none_match:
+            etag = await key_etag(path, consistent)
+            if etag and etag_matches(if_none_match, etag):
+                return not_modified(etag)
+
+        async def read_resource() -> tuple[bytes, int]:
+            output, revision = await read_key(path, consistent)
+            if not output:
+                raise HTTPException(status_code=404, detail=f"Resource {path} does not exists")
+
+            envelope = {"key": path, 'exists': True, "revision": revision}
+            with metrics.timed(metrics.serialization_seconds, 'serialization', 'get'):
+                if raw:
+                    return raw_json(envelope, {"resource": output.value}), output.mod_revision
+                return dumps({**envelope, "resource": decode_resource(output)}), output.mod_revision
+
+        body, mod_revision = await read_flight.do(
+            ('get', path, consistent, raw, informer_revision(consistent)), read_resource, fresh=consistent
+        )
+        return await json_response(request, body, headers={'ETag': revision_etag(mod_revision)})
+    except HTTPException as e:
+        raise e
 
-    command = ['get', path, '--print-value-only']
 
-    try:
-        output = run_command(command)
 
-        if output:
-            return {"key": path, "resource": json.loads(output.strip()), 'exists': True}
+def publish_deleted(prev_kvs: list[KeyValue], revision: int):
+    """
+    Emits an event for every deleted value and drops deleted ResourceDefinitions from the definition
+    cache, taking their names, validators and stored definition with them.
+    """
+    definition_prefix = key_builder.resource_definition_prefix()
+    for kv in prev_kvs:
+        event_publisher.emit(Events.COMPONENT_DELETED, kv.key, revision, kv.value)
+        if kv.key.startswith(definition_prefix):
+            resource_definition_cache.remove(json.loads(kv.value))
+
+
+def delete_operations(kv: KeyValue, cascade: bool) -> list[dict]:
+    """
+    The transaction operations deleting kv, and with cascade every resource of the type kv defines, if it is a ResourceDefinition.
+    """
+    operations = [delete_request(kv.key, prev_kv=True)]
+    if cascade and kv.key.startswith(key_builder.resource_definition_prefix()):
+        spec = json.loads(kv.value)['spec']
+        operations.append(delete_request(
+            key_builder.instance_prefix(spec['group'], spec['names']['singular']), prefix=True, prev_kv=True
+        ))
+    return operations
+
+
+async def delete_matching(kvs: list[KeyValue], cascade: bool) -> tuple[int, int, int]:
+    """
+    Deletes kvs in as few transactions as the operation limit allows, skipping any modified since it was read,
+    as it may no longer match. Returns how many values were deleted, how many skipped and the last revision.
+    """
+    chunks, chunk, size = [], [], 0
+    for kv in kvs:
+        operations = delete_operations(kv, cascade)
+        if chunk and size + len(operations) > config.etcd_max_txn_ops:
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append((kv, operations))
+        size += len(operations)
+    if chunk:
+        chunks.append(chunk)
+
+    deleted = skipped = revision = 0
+    for chunk in chunks:
+        output = await storage.txn(
+            compare=[compare_mod_revision(kv.key, kv.mod_revision) for kv, _ in chunk],
+            success=[operation for _, operations in chunk for operation in operations]
+        )
+        if not output.succeeded:
+            # One modified value fails the whole chunk, so the rest are deleted one at a time
+            outputs = []
+            for kv, operations in chunk:
+                output = await storage.txn(compare=[compare_mod_revision(kv.key, kv.mod_revision)], success=operations)
+                skipped += not output.succeeded
+                outputs.append(output)
         else:
-            raise HTTPException(status_code=404, detail=f"Resource {path} does not exists")
+            outputs = [output]
+        for output in outputs:
+            if output.succeeded:
+                prev_kvs = [kv for response in output.responses for kv in response.prev_kvs]
+                publish_deleted(prev_kvs, output.revision)
+                deleted += len(prev_kvs)
+                revision = output.revision
+    return deleted, skipped, revision
+
+
+@router.delete('/{type}')
+@router.delete('/{type}/{version:version}')
+async def delete_collection(
+        type: str,
+        version: Optional[str] = None,
+        label_selector: Optional[str] = Query(None, alias='labelSelector'),
+        field_selector: Optional[str] = Query(None, alias='fieldSelector'),
+        cascade: bool = False
+):
+    """
+    Deletes every resource of a type, or those matching labelSelector and fieldSelector. Without
+    selectors that is a single ranged delete, with them the matching resources are deleted in chunked
+    transactions, skipping any modified after it matched.
+
+    Deleting ResourceDefinitions removes their types from the API. cascade=true also deletes all
+    resources of those types in the same transaction. Takes the same type names as listing.
+    count is the number of values deleted, cascaded resources included.
+    """
+    if version is not None:
+        names = resource_definition_cache.resolve(type)
+        if names is not None and not names.is_plural:
+            return await delete_resources(type=type, name=version, cascade=cascade)
+        type = f'{type}/{version}'
+
+    names = key_builder.resolve(type)
+    if not names.is_plural:
+        raise HTTPException(status_code=400, detail=f"Please use plural names when deleting multiple resources.")
+
+    path_prefix = key_builder.from_request(type)
+    list_prefix = path_prefix + '/'
+    selector = Selector.parse(label_selector, field_selector)
+
+    try:
+        if selector or names.group == DEFINITION_GROUP:
+            # Definitions are read first, to know the types to remove and the resources to cascade to
+            kvs, _, _ = await read_prefix(list_prefix, consistent=True, selector=selector)
+            deleted, skipped, revision = await delete_matching(kvs, cascade)
+        else:
+            output = await storage.delete(list_prefix, prefix=True, prev_kv=True)
+            publish_deleted(output.prev_kvs, output.revision)
+            deleted, skipped, revision = output.deleted, 0, output.revision
+
+        if deleted:
+            read_flight.invalidate()
+            await resource_informer.wait_for_revision(revision)
+        return {"key_prefix": path_prefix, "status": "deleted", "count": deleted, "skipped": skipped, "revision": revision}
     except HTTPException as e:
         raise e
-
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting resources: {str(e)}")
 
 
 @router.delete('/{type}/{name}')
-def delete_resources(type: str, name: str = ''):
+@router.delete('/{type}/{version:version}/{name}')
+async def delete_resources(type: str, name: str = '', version: Optional[str] = None, cascade: bool = False):
+    """
+    Deletes a resource. Deleting a ResourceDefinition removes its type from the API, and with
+    cascade=true deletes every resource of that type in the same transaction.
+    """
+    if version is not None:
+        type = f'{type}/{version}'
 
     path = key_builder.from_request(type, name)
 
-    command = ['del', path]
     try:
-        output = run_command(command)
-        if "1" in output.lower():
-            return {"key": path, "status": "deleted"}
-        else:
+        operations = [delete_request(path, prev_kv=True)]
+        if cascade and key_builder.resolve(type).group == DEFINITION_GROUP:
+            defined = key_builder.resolve(name)
+            operations.append(delete_request(key_builder.instance_prefix(defined.group, defined.singular), prefix=True, prev_kv=True))
+
+        # Only deletes, and so only cascades, if the resource is still there, another worker may have deleted it
+        output = await storage.txn(compare=[compare_mod_revision(path, 0, 'GREATER')], success=operations)
+        if not output.succeeded:
             raise HTTPException(status_code=404, detail="Resource not found")
+
+        publish_deleted([kv for response in output.responses for kv in response.prev_kvs], output.revision)
+        read_flight.invalidate()
+        await resource_informer.wait_for_revision(output.revision)
+        return {"key": path, "status": "deleted"}
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting resource: {str(e)}")
 
+def conflict(path: str, current: Optional[KeyValue]) -> HTTPException:
+    if current is None:
+        return HTTPException(status_code=409, detail=f"Resource {path} was modified, it no longer exists")
+    return HTTPException(
+        status_code=409,
+        detail=f"Resource {path} was modified, the current resourceVersion is {current.mod_revision}"
+    )
+
+
 @router.put('/')
-def put_resource(resource: dict):
-    resource_validator.base_validation(resource)
+async def put_resource(resource: dict):
+    """
+    Creates or replaces a resource. If metadata.resourceVersion is set the write only happens
+    when the stored resource is still at that version, otherwise it fails with 409.
+    A resourceVersion of 0 only creates the resource if it does not exist.
+    """
+    await run_validation(resource_validator.base_validation, resource)
 
-    if 'api.catcode.io' in resource['apiVersion']:
-        resource_validator.base_resource_validation(resource)
-        resource_definition_cache.add_resource(resource)
-    else:
-        resource = resource_validator(resource)
+    expected = pop_resource_version(resource)
+    resource, previous_definition = await stage_resource(resource)
 
     path = key_builder.from_resource(resource)
 
-    command = ['put', path, json.dumps(resource)]
     try:
-        output = run_command(command)
-        return {"key": path, "status": "created_or_updated"}
+        with metrics.timed(metrics.serialization_seconds, 'serialization', 'write'):
+            value = json.dumps(resource)
+        if expected is None:
+            written = await storage.put(path, value, prev_kv=True)
+        else:
+            # Compare and swap on the mod_revision, in a single round trip
+            output = await storage.txn(
+                compare=[compare_mod_revision(path, expected)],
+                success=[put_request(path, value, prev_kv=True)],
+                failure=[range_request(path)]
+            )
+            if not output.succeeded:
+                kvs = output.responses[0].kvs
+                raise conflict(path, kvs[0] if kvs else None)
+            written = output.responses[0]
+
+        revision = written.revision
+        event_publisher.emit_write(path, revision, value, written.prev_kv)
+        read_flight.invalidate()
+        await resource_informer.wait_for_revision(revision)
+        return {"key": path, "status": "created_or_updated", "resourceVersion": str(revision)}
     except Exception as e:
+        unstage_resource(resource, previous_definition)
+        if isinstance(e, HTTPException):
+            raise e
         raise HTTPException(status_code=500, detail=f"Error updating resource: {str(e)}")
 
 
 @router.patch('/{type}/{name}')
-def patch_resources(item: dict, type: str, name: str):
+@router.patch('/{type}/{version:version}/{name}')
+async def patch_resources(item: dict, type: str, name: str, version: Optional[str] = None):
+    """
+    Merges item into the existing fields of the resource.
+
+    The merged resource is written with a compare and swap on the mod_revision it was read at.
+    If another write got there first the merge is retried on the new version, up to patch_max_retries times.
+    If item has metadata.resourceVersion the patch is not retried, and fails with 409 when the resource has changed.
+    """
+    if version is not None:
+        type = f'{type}/{version}'
+
     # Build the path for the resource in etcd
     path = key_builder.from_request(type, name)
 
-    # Command to get the current resource from etcd
-    get_command = ['get', path, '--print-value-only']
+    expected = pop_resource_version(item)
+
+    # Function to recursively update only existing fields
+    def update_existing_fields(original: dict, updates: dict) -> dict:
+        for key, value in updates.items():
+            if key in original:
+                # If the value is a nested dictionary, recursively update it
+                if isinstance(value, dict) and isinstance(original[key], dict):
+                    original[key] = update_existing_fields(original[key], value)
+                else:
+                    # Only update if the key exists in the original data
+                    original[key] = value
+        return original
 
     try:
         # Retrieve the existing resource from etcd
-        existing_resource = run_command(get_command)
+        existing_resource = await storage.get(path)
 
         if not existing_resource:
             raise HTTPException(status_code=404, detail="Resource not found")
 
-        # Convert the existing resource from JSON string to a Python dictionary
-        existing_data = json.loads(existing_resource.strip())
-
-
-        # Function to recursively update only existing fields
-        def update_existing_fields(original: dict, updates: dict) -> dict:
-            for key, value in updates.items():
-                if key in original:
-                    # If the value is a nested dictionary, recursively update it
-                    if isinstance(value, dict) and isinstance(original[key], dict):
-                        original[key] = update_existing_fields(original[key], value)
-                    else:
-                        # Only update if the key exists in the original data
-                        original[key] = value
-            return original
-
-        # Update only the existing fields in the resource
-        updated_data = update_existing_fields(existing_data, item)
-
-        # Convert the updated resource back to JSON string
-        updated_data = json.dumps(updated_data)
-
-        # Command to put the updated resource back into etcd
-        put_command = ['put', path, updated_data]
-
-        # Run the command to update the resource in etcd
-        run_command(put_command)
-
-        return {"key": path, "status": "updated", "resource": existing_data}
+        for _ in range(config.patch_max_retries + 1):
+            if expected is not None and expected != existing_resource.mod_revision:
+                raise conflict(path, existing_resource)
+
+            # Convert the existing resource from JSON string to a Python dictionary
+            existing_data = json.loads(existing_resource.value)
+
+            # Update only the existing fields in the resource
+            existing_data = update_existing_fields(existing_data, item)
+
+            # The merged resource is validated like a PUT of it would be
+            await run_validation(resource_validator.base_validation, existing_data)
+            existing_data, previous_definition = await stage_resource(existing_data)
+
+            # Put the updated resource back into etcd, unless it changed since it was read
+            try:
+                with metrics.timed(metrics.serialization_seconds, 'serialization', 'write'):
+                    value = json.dumps(existing_data)
+                output = await storage.txn(
+                    compare=[compare_mod_revision(path, existing_resource.mod_revision)],
+                    success=[put_request(path, value)],
+                    failure=[range_request(path)]
+                )
+            except Exception:
+                unstage_resource(existing_data, previous_definition)
+                raise
+
+            if output.succeeded:
+                event_publisher.emit(Events.COMPONENT_UPDATED, path, output.revision, value)
+                read_flight.invalidate()
+                await resource_informer.wait_for_revision(output.revision)
+                return {"key": path, "status": "updated", "resource": set_resource_version(existing_data, output.revision)}
+
+            # Somebody else wrote in between, merge again on top of their version
+            unstage_resource(existing_data, previous_definition)
+            kvs = output.responses[0].kvs
+            if not kvs:
+                raise HTTPException(status_code=404, detail="Resource not found")
+            existing_resource = kvs[0]
+
+        raise conflict(path, existing_resource)
 
     except HTTPException as e:
         raise e
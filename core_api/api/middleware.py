@@ -0,0 +1,58 @@
+import time
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from core_api.metrics import Metrics, metrics, request_timings
+from core_api.profiling import SlowRequestLog, slow_requests
+
+
+def server_timing(timings: dict, total: float) -> str:
+    """
+    Formats the time spent per part of a request, in milliseconds, as a Server-Timing header.
+    """
+    parts = [f'{name};dur={seconds * 1000:.3f}' for name, seconds in timings.items()]
+    parts.append(f'total;dur={total * 1000:.3f}')
+    return ', '.join(parts)
+
+
+class MetricsMiddleware:
+    """
+    Records the duration and body sizes of every request by route, and sends a Server-Timing header
+    breaking it down into the storage, validation, serialization and compression time measured for it.
+    Requests slower than the threshold of slow_requests are kept there with that breakdown.
+    """
+    def __init__(self, app, metrics: Metrics = metrics, slow_requests: SlowRequestLog = slow_requests):
+        self.app = app
+        self.metrics = metrics
+        self.slow_requests = slow_requests
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings = {}
+        token = request_timings.set(timings)
+
+        async def send_measured(message):
+            if message['type'] == 'http.response.start':
+                elapsed = time.perf_counter() - start
+                route = scope['route'].path if 'route' in scope else 'unmatched'
+                self.metrics.request_seconds.observe(elapsed, scope['method'], route, str(message['status']))
+
+                request_size = Headers(scope=scope).get('content-length')
+                if request_size:
+                    self.metrics.payload_bytes.observe(int(request_size), 'request', route)
+                headers = MutableHeaders(scope=message)
+                if 'content-length' in headers:
+                    self.metrics.payload_bytes.observe(int(headers['content-length']), 'response', route)
+                if self.metrics.server_timing:
+                    headers.append('Server-Timing', server_timing(timings, elapsed))
+                self.slow_requests.record(scope['method'], scope['path'], route, message['status'], elapsed, timings)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_measured)
+        finally:
+            request_timings.reset(token)
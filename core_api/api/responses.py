@@ -0,0 +1,85 @@
+import asyncio
+import gzip
+import time
+from typing import Optional
+
+import orjson
+from fastapi import Request, Response
+
+from core_api.metrics import metrics
+from settings import config
+
+try:
+    import zstandard
+except ImportError:
+    # zstd is only offered when zstandard is installed, gzip always is
+    zstandard = None
+
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content)
+
+
+def loads(value: bytes | str):
+    return orjson.loads(value)
+
+
+def raw_json(fields: dict, raw: dict[str, bytes | list[bytes]]) -> bytes:
+    """
+    Encodes fields as a JSON object and adds the members of raw, which are already encoded JSON
+    values or lists of them, byte for byte, so stored resources reach the client without being parsed.
+    """
+    parts = [dumps(fields)[:-1]]
+    for name, value in raw.items():
+        if isinstance(value, list):
+            value = b'[' + b','.join(value) + b']'
+        parts.append(b',' + dumps(name) + b':' + (value or b'null'))
+    return b''.join(parts) + b'}'
+
+
+def accepted_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Picks zstd or gzip from an Accept-Encoding header, preferring zstd and honouring q=0.
+    """
+    accepted = set()
+    for coding in accept_encoding.lower().split(','):
+        name, _, params = coding.strip().partition(';')
+        quality = params.strip().removeprefix('q=')
+        try:
+            if params and float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(name.strip())
+
+    if zstandard is not None and 'zstd' in accepted:
+        return 'zstd'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(encoding: str, body: bytes) -> bytes:
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+async def json_response(request: Request, body: bytes, headers: Optional[dict] = None, status_code: int = 200) -> Response:
+    """
+    Sends an encoded JSON body, compressed with the encoding the client prefers once it is
+    at least compression_min_bytes. Compression runs off the event loop.
+    """
+    headers = dict(headers or {})
+    if len(body) >= config.compression_min_bytes:
+        headers['Vary'] = 'Accept-Encoding'
+        encoding = accepted_encoding(request.headers.get('accept-encoding', ''))
+        if encoding:
+            start = time.perf_counter()
+            body = await asyncio.get_running_loop().run_in_executor(None, compress, encoding, body)
+            metrics.add_timing('compression', time.perf_counter() - start)
+            headers['Content-Encoding'] = encoding
+    return Response(body, status_code=status_code, headers=headers, media_type='application/json')
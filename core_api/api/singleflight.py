@@ -0,0 +1,68 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Hashable
+
+from core_api.metrics import metrics
+from settings import config
+
+
+class SingleFlight:
+    """
+    Lets identical concurrent reads share one call. The first caller of a key starts func, every
+    caller of that key until it finishes awaits the same result, and for window seconds after it
+    finished later callers get that result as well. A caller asking for a fresh result never shares.
+
+    The call runs as its own task, so a caller that goes away does not cancel it for the others.
+    Every write bumps generation, which is part of every key, so a read never shares a call that
+    started before a write this instance made. Writes through other workers or replicas bump nothing,
+    so reads that must see every acknowledged write, consistent=true, ask for a fresh result.
+    """
+    def __init__(self, window: float = 0.0, enabled: bool = True):
+        self.window = window
+        self.enabled = enabled
+        self.generation = 0
+        self._in_flight: dict[tuple, asyncio.Task] = {}
+        self._results: dict[tuple, tuple[float, object]] = {}
+
+    def invalidate(self):
+        self.generation += 1
+        self._results.clear()
+
+    def _expire(self, now: float):
+        for key in [key for key, (expires, _) in self._results.items() if expires <= now]:
+            del self._results[key]
+
+    def _finished(self, key: tuple, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        # A write may have happened while the call ran, its result then belongs to an old generation
+        if self.window and key[0] == self.generation:
+            self._results[key] = (time.monotonic() + self.window, task.result())
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable], fresh: bool = False):
+        """
+        Returns the result of func, or of the call already made for key. With fresh set func is always
+        called, as a call in flight may have started before a write made elsewhere that the caller saw.
+        """
+        if not self.enabled or fresh:
+            return await func()
+
+        key = (self.generation, key)
+        if self._results:
+            now = time.monotonic()
+            self._expire(now)
+            if key in self._results:
+                metrics.cache('coalesced', True)
+                return self._results[key][1]
+
+        task = self._in_flight.get(key)
+        metrics.cache('coalesced', task is not None)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda task: self._finished(key, task))
+        return await asyncio.shield(task)
+
+
+read_flight = SingleFlight(window=config.read_coalesce_window, enabled=config.read_coalescing_enabled)
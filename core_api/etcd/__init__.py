@@ -1 +1,2 @@
-from .command import run_command
\ No newline at end of file
+from .command import run_command
+from .client import etcd_client
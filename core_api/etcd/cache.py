@@ -1,10 +1,76 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+import jsonschema
+from fastapi import HTTPException
+
+from core_api.metrics import metrics
+
+
+DEFINITION_GROUP = 'api.catcode.io'
+DEFINITION_VERSIONS = ['v1alpha1']
+
+VERSION_PATTERN = re.compile(r'^v(\d+)(?:(alpha|beta)(\d+))?$')
+STABILITY = {'alpha': 1, 'beta': 2, None: 3}
+
+
+def version_priority(version: str) -> tuple:
+    """
+    Sort key ordering versions like Kubernetes does, newest last: stable versions above beta above
+    alpha, each by major then minor number, and names not of the form v1, v1beta1 or v1alpha1 below all.
+    """
+    match = VERSION_PATTERN.match(version)
+    if match is None:
+        return 0, 0, 0, version
+    major, stability, minor = match.groups()
+    return STABILITY[stability], int(major), int(minor or 0), version
+
+
+@dataclass(frozen=True)
+class TypeName:
+    """
+    What a type name in a request resolves to. version is the one it names, or the newest one.
+    """
+    group: str
+    kind: str
+    singular: str
+    plural: str
+    version: str
+    is_plural: bool
+
+
+def compile_schema(schema: dict):
+    """
+    Checks schema once and returns a reusable validator for it, instead of letting
+    jsonschema.validate check the schema and build a new validator on every call.
+    """
+    validator_class = jsonschema.validators.validator_for(schema)
+    try:
+        validator_class.check_schema(schema)
+    except jsonschema.SchemaError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid schema: {e.message}")
+    return validator_class(schema)
 
 
 class ResourceDefinitionCache:
     def __init__(self):
+        # Bare names, used when a request does not include the group
         self._singular_name = {}
         self._plural_name = {}
         self._resources = {}
+        self._validators = {}
+
+        # Group qualified indexes, so lookups are a single dict access and names from
+        # different groups, or a kind equal to another definitions plural, never collide
+        self._kind_index = {}
+        self._singular_index = {}
+        self._plural_index = {}
+        self._versions = {}
+
+        # Every accepted spelling of every type name, see spellings
+        self._type_names: dict[str, TypeName] = {}
+        self._add_type_names(DEFINITION_GROUP, 'ResourceDefinition', 'resourcedefinition', 'resourcedefinitions', DEFINITION_VERSIONS)
 
     def add_resource(self, resource):
         singular = self._get_singular_name(resource)
@@ -13,6 +79,8 @@ class ResourceDefinitionCache:
         group = resource['spec']['group']
         kind = resource['spec']['names']['kind']
 
+        # Compile before touching the cache, so an invalid definition leaves the old one in place
+        validators = self._compile_validators(group, kind, resource)
 
         resource_data = {
             'group': group,
@@ -21,14 +89,114 @@ class ResourceDefinitionCache:
             'singular': singular
         }
 
+        # The definition may have been renamed, so drop whatever the previous version indexed, found by
+        # its singular name or, when that is what changed, by its kind
+        if (group, singular) in self._singular_index:
+            self.remove(self._resources[f'{group}/{singular}'])
+        previous = self._kind_index.get((group, kind))
+        if previous is not None:
+            self.remove(self._resources[f'{group}/{previous["singular"]}'])
+
+        self._validators.update(validators)
+
         self._singular_name[singular] = resource_data
         self._plural_name[plural] = resource_data
         self._resources[f'{group}/{singular}'] = resource
 
+        self._kind_index[(group, kind)] = resource_data
+        self._singular_index[(group, singular)] = resource_data
+        self._plural_index[(group, plural)] = resource_data
+        self._versions[(group, singular)] = [version['name'] for version in resource['spec']['versions']]
+        self._add_type_names(group, kind, singular, plural, self._versions[(group, singular)])
+
     def remove(self, resource):
+        group = resource['spec']['group']
+        kind = resource['spec']['names']['kind']
+        singular = self._get_singular_name(resource)
+        plural = self._get_plural_name(resource)
+
+        def owned(names: Optional[dict]) -> bool:
+            # A definition renamed since may have taken over the kind or plural, those entries are its own now
+            return names is not None and names['group'] == group and names['singular'] == singular
+
+        if owned(self._kind_index.get((group, kind))):
+            for version in self._versions.get((group, singular), []):
+                self._validators.pop((group, kind, version), None)
+            del self._kind_index[(group, kind)]
+        self._remove_type_names(group, singular, plural, self._versions.get((group, singular), []))
 
-        del self._singular_name[self._get_singular_name(resource)]
-        del self._plural_name[self._get_plural_name(resource)]
+        # Only drop bare names that still point at this definition
+        if owned(self._singular_name.get(singular)):
+            del self._singular_name[singular]
+        if owned(self._plural_name.get(plural)):
+            del self._plural_name[plural]
+
+        self._singular_index.pop((group, singular), None)
+        if owned(self._plural_index.get((group, plural))):
+            del self._plural_index[(group, plural)]
+        self._versions.pop((group, singular), None)
+        self._resources.pop(f'{group}/{singular}', None)
+
+    @staticmethod
+    def spellings(group: str, singular: str, plural: str, versions: list[str]) -> list[tuple[str, bool, Optional[str]]]:
+        """
+        The names a type can be requested by, with whether they are plural and the version they name:
+        <name>.<group>/<version>, <name>.<group> and the bare <name>, for the singular and the plural name.
+        """
+        output = []
+        for name, is_plural in ((singular, False), (plural, True)):
+            output.extend((f'{name}.{group}/{version}', is_plural, version) for version in versions)
+            output.append((f'{name}.{group}', is_plural, None))
+            output.append((name, is_plural, None))
+        return output
+
+    def _add_type_names(self, group: str, kind: str, singular: str, plural: str, versions: list[str]):
+        newest = max(versions, key=version_priority)
+        for spelling, is_plural, version in self.spellings(group, singular, plural, versions):
+            # A bare name used by several groups resolves to the definition registered last
+            self._type_names[spelling] = TypeName(group, kind, singular, plural, version or newest, is_plural)
+
+    def _remove_type_names(self, group: str, singular: str, plural: str, versions: list[str]):
+        for spelling, _, _ in self.spellings(group, singular, plural, versions):
+            names = self._type_names.get(spelling)
+            if names is not None and names.group == group and names.singular == singular:
+                del self._type_names[spelling]
+
+        # Bare names this definition held fall back to another group defining them
+        for bare in (singular, plural):
+            if bare in self._type_names:
+                continue
+            for (other_group, _), names in self._singular_index.items():
+                if other_group != group and bare in (names['singular'], names['plural']):
+                    self._type_names[bare] = self._type_names[f'{bare}.{other_group}']
+                    break
+
+    def resolve(self, type: str) -> Optional[TypeName]:
+        """
+        Resolves any spelling of a type name with a single lookup, None if no definition has it.
+        """
+        names = self._type_names.get(type)
+        metrics.cache('definition', names is not None)
+        return names
+
+    @staticmethod
+    def _compile_validators(group: str, kind: str, resource: dict) -> dict:
+        validators = {}
+        for version in resource['spec']['versions']:
+            if version.get('schemaVersion') != 'openAPISchemaV3':
+                raise HTTPException(status_code=400, detail=f'Invalid schema version: {version.get("schemaVersion")}')
+
+            key = (group, kind, version['name'])
+            if key in validators:
+                raise HTTPException(status_code=400, detail=f'Multiple schemas found for version {version["name"]} of {kind}')
+
+            validators[key] = compile_schema(version['schema'])
+        return validators
+
+    def get_validator(self, group: str, kind: str, version: str):
+        validator = self._validators.get((group, kind, version))
+        metrics.cache('definition', validator is not None)
+        return validator
 
     @staticmethod
     def _get_singular_name(resource):
@@ -38,32 +206,46 @@ class ResourceDefinitionCache:
     def _get_plural_name(resource):
         return resource['spec']['names']['plural']
 
+    def get_names(self, group: str, kind: str) -> Optional[dict]:
+        names = self._kind_index.get((group, kind))
+        metrics.cache('definition', names is not None)
+        return names
+
     def get_singular_name(self, resource):
+        group, _ = resource['apiVersion'].split('/')
+        names = self._kind_index.get((group, resource['kind']))
+        return names['singular'] if names else None
+
+    def get_definition(self, group: str, singular: str) -> Optional[dict]:
+        return self._resources.get(f'{group}/{singular}')
 
-        for singular_name, values in self._singular_name.items():
-            if resource['kind'] in values.values():
-                return singular_name
-        return None
     def get_resource_definition(self, resource: dict):
         group, _ = resource['apiVersion'].split('/')
         return self._resources[f'{group}/{self.get_singular_name(resource)}']
 
-    def is_singular(self, name: str):
+    def versions(self, group: str, singular: str) -> list[str]:
+        return self._versions.get((group, singular), [])
+
+    def is_singular(self, name: str, group: Optional[str] = None):
+        if group is not None:
+            return (group, name) in self._singular_index
         if name in self._singular_name.keys():
             return True
         return False
 
-    def is_plural(self, name: str):
+    def is_plural(self, name: str, group: Optional[str] = None):
+        if group is not None:
+            return (group, name) in self._plural_index
         if name in self._plural_name.keys():
             return True
         return False
 
-    def exists(self, name: str):
-        return self.is_singular(name) or self.is_plural(name)
+    def exists(self, name: str, group: Optional[str] = None):
+        return self.is_singular(name, group) or self.is_plural(name, group)
 
     def plural_names(self):
         return list(self._plural_name.keys())
 
 
 
-resource_definition_cache = ResourceDefinitionCache()
\ No newline at end of file
+resource_definition_cache = ResourceDefinitionCache()
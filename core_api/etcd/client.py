@@ -0,0 +1,372 @@
+import base64
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(value: str | bytes) -> str:
+    if isinstance(value, str):
+        value = value.encode()
+    return base64.b64encode(value).decode()
+
+
+def _decode(value: Optional[str]) -> bytes:
+    return base64.b64decode(value) if value else b''
+
+
+def prefix_range_end(prefix: str | bytes) -> bytes:
+    """
+    Returns the range end covering every key starting with prefix, the same way etcdctl does for --prefix.
+    """
+    if isinstance(prefix, str):
+        prefix = prefix.encode()
+    end = bytearray(prefix)
+    for i in range(len(end) - 1, -1, -1):
+        if end[i] < 0xff:
+            end[i] += 1
+            return bytes(end[:i + 1])
+    # The prefix is all 0xff, so the range runs to the end of the keyspace
+    return b'\0'
+
+
+class EtcdCompactedError(HTTPException):
+    """
+    Raised when a read or watch asks for a revision etcd has already compacted.
+    """
+    def __init__(self, detail: str, compact_revision: int = 0):
+        super().__init__(status_code=410, detail=detail)
+        self.compact_revision = compact_revision
+
+
+@dataclass
+class KeyValue:
+    key: str
+    value: bytes
+    mod_revision: int
+    create_revision: int = 0
+    version: int = 0
+
+    @classmethod
+    def from_json(cls, kv: dict) -> 'KeyValue':
+        return cls(
+            key=_decode(kv.get('key')).decode(),
+            value=_decode(kv.get('value')),
+            mod_revision=int(kv.get('mod_revision', 0)),
+            create_revision=int(kv.get('create_revision', 0)),
+            version=int(kv.get('version', 0)),
+        )
+
+
+@dataclass
+class RangeResponse:
+    kvs: list[KeyValue] = field(default_factory=list)
+    count: int = 0
+    revision: int = 0
+    more: bool = False
+
+
+@dataclass
+class PutResponse:
+    revision: int
+    prev_kv: Optional[KeyValue] = None
+
+
+@dataclass
+class DeleteResponse:
+    deleted: int = 0
+    revision: int = 0
+    prev_kvs: list[KeyValue] = field(default_factory=list)
+
+
+@dataclass
+class TxnResponse:
+    succeeded: bool
+    revision: int
+    # One entry per operation of the branch that ran
+    responses: list[RangeResponse | PutResponse | DeleteResponse] = field(default_factory=list)
+
+
+@dataclass
+class WatchEvent:
+    type: str
+    kv: KeyValue
+    prev_kv: Optional[KeyValue] = None
+
+
+@dataclass
+class WatchResponse:
+    revision: int
+    events: list[WatchEvent] = field(default_factory=list)
+    created: bool = False
+
+
+def put_request(key: str, value: str | bytes, prev_kv: bool = False) -> dict:
+    request = {'key': _encode(key), 'value': _encode(value)}
+    if prev_kv:
+        request['prev_kv'] = True
+    return {'request_put': request}
+
+
+def delete_request(key: str, prefix: bool = False, prev_kv: bool = False) -> dict:
+    request = {'key': _encode(key)}
+    if prefix:
+        request['range_end'] = _encode(prefix_range_end(key))
+    if prev_kv:
+        request['prev_kv'] = True
+    return {'request_delete_range': request}
+
+
+def range_request(key: str) -> dict:
+    return {'request_range': {'key': _encode(key)}}
+
+
+def compare_mod_revision(key: str, mod_revision: int, result: str = 'EQUAL') -> dict:
+    """
+    Compares the mod_revision of key, a mod_revision of 0 means the key does not exist.
+    """
+    return {'key': _encode(key), 'target': 'MOD', 'result': result, 'mod_revision': mod_revision}
+
+
+def request_size(request: dict) -> int:
+    """
+    Approximate size of a txn operation as etcd counts it against --max-request-bytes.
+    """
+    operation = next(iter(request.values()))
+    return sum(len(value) for value in operation.values() if isinstance(value, str)) * 3 // 4 + 16
+
+
+def _range_response(output: dict, revision: int = 0) -> RangeResponse:
+    return RangeResponse(
+        kvs=[KeyValue.from_json(kv) for kv in output.get('kvs', [])],
+        count=int(output.get('count', 0)),
+        # Responses nested in a txn may come without a header, those use the revision of the txn
+        revision=int(output.get('header', {}).get('revision', revision)),
+        more=output.get('more', False)
+    )
+
+
+class EtcdClient:
+    """
+    Talks to etcd over the v3 JSON gateway using a pooled keep-alive async http client,
+    so a request does not pay for process start up and connection set up, and does not
+    hold a worker thread while waiting for etcd.
+
+    Requests beyond max_connections wait up to pool_timeout for a free connection.
+    """
+    def __init__(
+            self,
+            endpoint: str,
+            max_connections: int = 100,
+            timeout: float = 5.0,
+            pool_timeout: float = 30.0,
+            transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self.endpoint = endpoint
+        self._timeout = timeout
+        self._client = httpx.AsyncClient(
+            base_url=endpoint,
+            timeout=httpx.Timeout(timeout, pool=pool_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport
+        )
+
+    async def _post(self, path: str, body: dict) -> dict:
+        try:
+            response = await self._client.post(path, json=body)
+        except httpx.TransportError as e:
+            # Same mapping as run_command, connection failures are reported as 503
+            raise HTTPException(status_code=503, detail=f"ETCD cluster connection error: {e}")
+
+        if response.status_code != 200:
+            self._raise_error(response.text)
+        return response.json()
+
+    @staticmethod
+    def _raise_error(text: str):
+        try:
+            message = json.loads(text).get('message', text)
+        except ValueError:
+            message = text
+        if 'compacted' in message:
+            raise EtcdCompactedError(detail=f"ETCD error: {message.strip()}")
+        raise HTTPException(status_code=500, detail=f"ETCD error: {message.strip()}")
+
+    async def get(self, key: str) -> Optional[KeyValue]:
+        response = await self.get_range(key)
+        return response.kvs[0] if response.kvs else None
+
+    async def get_prefix(self, prefix: str, **kwargs) -> RangeResponse:
+        return await self.get_range(prefix, range_end=prefix_range_end(prefix), **kwargs)
+
+    async def get_range(
+            self,
+            key: str | bytes,
+            range_end: Optional[bytes] = None,
+            limit: int = 0,
+            revision: int = 0,
+            keys_only: bool = False,
+            count_only: bool = False,
+            serializable: bool = False,
+            sort_target: Optional[str] = None,
+            sort_order: str = 'ASCEND'
+    ) -> RangeResponse:
+        body = {'key': _encode(key)}
+        if range_end:
+            body['range_end'] = _encode(range_end)
+        if limit:
+            body['limit'] = limit
+        if revision:
+            body['revision'] = revision
+        if keys_only:
+            body['keys_only'] = True
+        if count_only:
+            body['count_only'] = True
+        if serializable:
+            body['serializable'] = True
+        if sort_target:
+            # KEY, VERSION, CREATE, MOD or VALUE
+            body['sort_target'] = sort_target
+            body['sort_order'] = sort_order
+
+        output = await self._post('/v3/kv/range', body)
+        return _range_response(output)
+
+    async def put(self, key: str, value: str | bytes, prev_kv: bool = False) -> PutResponse:
+        """
+        Stores value at key. The revision of the response is the new mod_revision of the key,
+        with prev_kv set the previous value is returned as well, None if the key was created.
+        """
+        body = {'key': _encode(key), 'value': _encode(value)}
+        if prev_kv:
+            body['prev_kv'] = True
+        output = await self._post('/v3/kv/put', body)
+        return PutResponse(
+            revision=int(output['header']['revision']),
+            prev_kv=KeyValue.from_json(output['prev_kv']) if 'prev_kv' in output else None
+        )
+
+    async def delete(self, key: str, prefix: bool = False, prev_kv: bool = False) -> DeleteResponse:
+        """
+        Deletes key, or every key below it when prefix is set.
+        """
+        body = {'key': _encode(key)}
+        if prefix:
+            body['range_end'] = _encode(prefix_range_end(key))
+        if prev_kv:
+            body['prev_kv'] = True
+        output = await self._post('/v3/kv/deleterange', body)
+        return DeleteResponse(
+            deleted=int(output.get('deleted', 0)),
+            revision=int(output['header']['revision']),
+            prev_kvs=[KeyValue.from_json(kv) for kv in output.get('prev_kvs', [])]
+        )
+
+    async def txn(self, compare: list[dict] = (), success: list[dict] = (), failure: list[dict] = ()) -> TxnResponse:
+        """
+        Runs success if every compare holds, failure otherwise, as one atomic etcd transaction.
+        """
+        output = await self._post('/v3/kv/txn', {'compare': list(compare), 'success': list(success), 'failure': list(failure)})
+
+        revision = int(output['header']['revision'])
+        responses = []
+        for response in output.get('responses', []):
+            if 'response_range' in response:
+                responses.append(_range_response(response['response_range'], revision))
+            elif 'response_delete_range' in response:
+                deleted = response['response_delete_range']
+                responses.append(DeleteResponse(
+                    deleted=int(deleted.get('deleted', 0)),
+                    revision=revision,
+                    prev_kvs=[KeyValue.from_json(kv) for kv in deleted.get('prev_kvs', [])]
+                ))
+            else:
+                put = response.get('response_put', {})
+                responses.append(PutResponse(
+                    revision=revision,
+                    prev_kv=KeyValue.from_json(put['prev_kv']) if 'prev_kv' in put else None
+                ))
+
+        return TxnResponse(succeeded=output.get('succeeded', False), revision=revision, responses=responses)
+
+    async def watch(
+            self,
+            key: str,
+            range_end: Optional[bytes] = None,
+            start_revision: int = 0,
+            prev_kv: bool = False,
+            progress_notify: bool = False
+    ) -> AsyncIterator[WatchResponse]:
+        """
+        Streams changes to key, or the range up to range_end, starting at start_revision.
+        Raises EtcdCompactedError if start_revision has been compacted.
+        """
+        request = {'key': _encode(key)}
+        if range_end:
+            request['range_end'] = _encode(range_end)
+        if start_revision:
+            request['start_revision'] = start_revision
+        if prev_kv:
+            request['prev_kv'] = True
+        if progress_notify:
+            request['progress_notify'] = True
+
+        try:
+            # A watch stays open for as long as it is consumed, so it must not time out between messages
+            async with self._client.stream(
+                    'POST', '/v3/watch',
+                    json={'create_request': request},
+                    timeout=httpx.Timeout(self._timeout, read=None)
+            ) as response:
+                if response.status_code != 200:
+                    self._raise_error((await response.aread()).decode())
+
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    message = json.loads(line)
+                    if 'error' in message:
+                        self._raise_error(json.dumps(message['error']))
+
+                    result = message['result']
+                    if result.get('canceled'):
+                        compact_revision = int(result.get('compact_revision', 0))
+                        if compact_revision:
+                            raise EtcdCompactedError(
+                                detail=f"ETCD watch start revision has been compacted, oldest is {compact_revision}",
+                                compact_revision=compact_revision
+                            )
+                        raise HTTPException(status_code=500, detail=f"ETCD watch canceled: {result.get('cancel_reason')}")
+
+                    yield WatchResponse(
+                        revision=int(result['header']['revision']),
+                        created=result.get('created', False),
+                        events=[
+                            WatchEvent(
+                                type=event.get('type', 'PUT'),
+                                kv=KeyValue.from_json(event['kv']),
+                                prev_kv=KeyValue.from_json(event['prev_kv']) if 'prev_kv' in event else None
+                            )
+                            for event in result.get('events', [])
+                        ]
+                    )
+        except httpx.TransportError as e:
+            raise HTTPException(status_code=503, detail=f"ETCD cluster connection error: {e}")
+
+    async def close(self):
+        await self._client.aclose()
+
+
+etcd_client = EtcdClient(
+    config.etcd_host,
+    max_connections=config.etcd_max_connections,
+    timeout=config.etcd_timeout,
+    pool_timeout=config.etcd_pool_timeout
+)
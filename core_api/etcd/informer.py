@@ -0,0 +1,287 @@
+import asyncio
+import bisect
+import json
+import logging
+from typing import Optional
+
+from fastapi import HTTPException
+
+from core_api.etcd.client import EtcdCompactedError, KeyValue, prefix_range_end
+from core_api.etcd.selectors import EQUALITY, Selector, label_values
+from core_api.storage import Storage, storage
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+# Rough per entry cost of the dict slot, the sorted key list and the KeyValue object
+ENTRY_OVERHEAD = 200
+# Rough cost of one label in the inverted index
+LABEL_OVERHEAD = 100
+
+
+def _labels(kv: KeyValue) -> dict:
+    try:
+        return label_values(json.loads(kv.value).get('metadata', {}).get('labels') or {})
+    except (ValueError, AttributeError):
+        return {}
+
+
+class ResourceInformer:
+    """
+    Keeps an in-memory copy of everything below prefix by listing it once and then following
+    an etcd watch from the listed revision. Reads served from it reflect self.revision.
+
+    Labels are kept in an inverted index from (key, value) pairs to etcd keys, so a label
+    selector costs time proportional to the keys it matches rather than to the collection.
+
+    If the copy grows beyond max_bytes the informer drops it and stays disabled, so reads
+    fall back to etcd instead of the process running out of memory.
+    """
+    def __init__(
+            self,
+            storage: Storage,
+            prefix: str = '/registry/',
+            max_bytes: int = 256 * 1024 * 1024,
+            page_size: int = 1000
+    ):
+        self.storage = storage
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.page_size = page_size
+
+        self.ready = False
+        self.disabled = False
+        self.revision = 0
+        self.size = 0
+
+        self._items: dict[str, KeyValue] = {}
+        self._keys: list[str] = []
+        self._labels: dict[str, dict] = {}
+        self._label_index: dict[tuple[str, str], set[str]] = {}
+        self._label_key_index: dict[str, set[str]] = {}
+        # Revision of the last change below each directory since the list, e.g. /registry/catcode.io/system/
+        self._directory_revisions: dict[str, int] = {}
+        self._list_revision = 0
+        self._advanced = asyncio.Event()
+
+    async def run(self):
+        delay = 1
+        while not self.disabled:
+            try:
+                await self._list()
+                if self.disabled:
+                    return
+                delay = 1
+                await self._watch()
+            except HTTPException as e:
+                if isinstance(e, EtcdCompactedError):
+                    # The watch fell behind the compaction window, start over from a fresh list
+                    logger.warning(f'Informer on {self.prefix} was compacted, resyncing in {delay}s: {e.detail}')
+                else:
+                    logger.error(f'Informer on {self.prefix} lost etcd, retrying in {delay}s: {e.detail}')
+                self.ready = False
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    async def _list(self):
+        self.ready = False
+        self._clear()
+
+        # Page through the prefix pinned to the revision of the first page
+        range_end = prefix_range_end(self.prefix)
+        key, revision = self.prefix, 0
+        while True:
+            output = await self.storage.get_range(key, range_end=range_end, limit=self.page_size, revision=revision)
+            revision = output.revision
+            for kv in output.kvs:
+                self._put(kv)
+            if self._overflowed() or not output.more:
+                break
+            key = output.kvs[-1].key + '\0'
+
+        self._list_revision = revision
+        self._advance(revision)
+        self.ready = not self.disabled
+        logger.info(f'Informer listed {len(self._items)} keys below {self.prefix} at revision {revision}')
+
+    async def _watch(self):
+        async for response in self.storage.watch(
+                self.prefix,
+                range_end=prefix_range_end(self.prefix),
+                start_revision=self.revision + 1,
+                progress_notify=True
+        ):
+            for event in response.events:
+                self._touch(event.kv.key, event.kv.mod_revision)
+                if event.type == 'DELETE':
+                    self._delete(event.kv.key)
+                else:
+                    self._put(event.kv)
+            if self._overflowed():
+                return
+            if response.events:
+                self._advance(response.events[-1].kv.mod_revision)
+            elif not response.created:
+                # Progress notification, every event up to this revision has been delivered
+                self._advance(response.revision)
+
+    def _clear(self):
+        self._items, self._keys, self.size = {}, [], 0
+        self._labels, self._label_index, self._label_key_index = {}, {}, {}
+        self._directory_revisions = {}
+
+    def _touch(self, key: str, revision: int):
+        # Puts and deletes both count, so the revision of a directory moves on whenever its listing changes
+        end = key.find('/', len(self.prefix))
+        while end != -1:
+            self._directory_revisions[key[:end + 1]] = revision
+            end = key.find('/', end + 1)
+
+    def _put(self, kv: KeyValue):
+        existing = self._items.get(kv.key)
+        if existing is None:
+            bisect.insort(self._keys, kv.key)
+            self.size += len(kv.key) + ENTRY_OVERHEAD
+        else:
+            self.size -= len(existing.value)
+            self._unindex(kv.key)
+        self._items[kv.key] = kv
+        self.size += len(kv.value)
+        self._index(kv.key, _labels(kv))
+
+    def _delete(self, key: str):
+        existing = self._items.pop(key, None)
+        if existing is None:
+            return
+        del self._keys[bisect.bisect_left(self._keys, key)]
+        self.size -= len(key) + ENTRY_OVERHEAD + len(existing.value)
+        self._unindex(key)
+
+    def _index(self, key: str, labels: dict):
+        if not labels:
+            return
+        self._labels[key] = labels
+        for label, value in labels.items():
+            self._label_index.setdefault((label, value), set()).add(key)
+            self._label_key_index.setdefault(label, set()).add(key)
+            self.size += len(label) + len(value) + LABEL_OVERHEAD
+
+    def _unindex(self, key: str):
+        for label, value in self._labels.pop(key, {}).items():
+            keys = self._label_index[(label, value)]
+            keys.discard(key)
+            if not keys:
+                del self._label_index[(label, value)]
+            keys = self._label_key_index[label]
+            keys.discard(key)
+            if not keys:
+                del self._label_key_index[label]
+            self.size -= len(label) + len(value) + LABEL_OVERHEAD
+
+    def _overflowed(self) -> bool:
+        if self.size <= self.max_bytes:
+            return False
+        logger.error(
+            f'Informer on {self.prefix} needs more than read_cache_max_bytes={self.max_bytes}, '
+            f'disabling it and serving reads from etcd'
+        )
+        self.disabled, self.ready = True, False
+        self._clear()
+        return True
+
+    def _advance(self, revision: int):
+        if revision > self.revision:
+            self.revision = revision
+            self._advanced.set()
+            self._advanced = asyncio.Event()
+
+    async def wait_for_revision(self, revision: int, timeout: float = 1.0):
+        """
+        Waits until the informer has seen revision, so a client reading after its own write sees that write.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.ready and self.revision < revision:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                logger.warning(f'Informer did not reach revision {revision} within {timeout}s, at {self.revision}')
+                return
+            try:
+                await asyncio.wait_for(self._advanced.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    def get(self, key: str) -> Optional[KeyValue]:
+        return self._items.get(key)
+
+    def prefix_revision(self, prefix: str) -> int:
+        """
+        Returns the revision of the last change below prefix, which must end at a directory boundary.
+        Changes before the last list are not tracked and count as made at the list revision.
+        """
+        return self._directory_revisions.get(prefix, self._list_revision)
+
+    def list_prefix(self, prefix: str, start: Optional[str] = None, limit: int = 0) -> tuple[list[KeyValue], bool]:
+        """
+        Returns the values below prefix in key order, beginning at start, and whether more than limit were left.
+        """
+        first = bisect.bisect_left(self._keys, max(prefix, start or prefix))
+        end = bisect.bisect_left(self._keys, prefix_range_end(prefix).decode(), lo=first)
+        if limit and end - first > limit:
+            return [self._items[key] for key in self._keys[first:first + limit]], True
+        return [self._items[key] for key in self._keys[first:end]], False
+
+    def count_prefix(self, prefix: str) -> int:
+        first = bisect.bisect_left(self._keys, prefix)
+        return bisect.bisect_left(self._keys, prefix_range_end(prefix).decode(), lo=first) - first
+
+    def _candidates(self, prefix: str, selector: Selector) -> Optional[set[str]]:
+        """
+        Intersects the index entries of every positive requirement, smallest first.
+        Returns None when the selector has no requirement the index can narrow on.
+        """
+        sets = []
+        if (name := selector.name()) is not None:
+            sets.append({prefix + name})
+        for requirement in selector.labels:
+            if requirement.operator in EQUALITY:
+                sets.append(self._label_index.get((requirement.key, requirement.values[0]), set()))
+            elif requirement.operator == 'in':
+                sets.append(set().union(*(self._label_index.get((requirement.key, value), set()) for value in requirement.values)))
+            elif requirement.operator == 'exists':
+                sets.append(self._label_key_index.get(requirement.key, set()))
+        if not sets:
+            return None
+
+        sets.sort(key=len)
+        candidates = set(sets[0])
+        for keys in sets[1:]:
+            candidates &= keys
+        return candidates
+
+    def select(self, prefix: str, selector: Selector, start: Optional[str] = None, limit: int = 0) -> tuple[list[KeyValue], bool]:
+        """
+        Same as list_prefix, but only returns values matching selector.
+        """
+        start = max(prefix, start or prefix)
+        candidates = self._candidates(prefix, selector)
+        if candidates is None:
+            kvs, _ = self.list_prefix(prefix, start=start)
+            keys = [kv.key for kv in kvs]
+        else:
+            keys = sorted(key for key in candidates if key.startswith(prefix) and key >= start and key in self._items)
+
+        selected = []
+        for key in keys:
+            if not selector.matches_labels(self._labels.get(key, {})):
+                continue
+            kv = self._items[key]
+            if selector.fields and not selector.matches_fields(json.loads(kv.value)):
+                continue
+            if limit and len(selected) == limit:
+                return selected, True
+            selected.append(kv)
+        return selected, False
+
+
+resource_informer = ResourceInformer(storage, max_bytes=config.read_cache_max_bytes)
@@ -2,7 +2,7 @@ from typing import Optional
 
 from fastapi import HTTPException
 
-from core_api.etcd.cache import ResourceDefinitionCache, resource_definition_cache
+from core_api.etcd.cache import DEFINITION_GROUP, ResourceDefinitionCache, TypeName, resource_definition_cache
 
 
 class KeyBuilder:
@@ -14,12 +14,27 @@ class KeyBuilder:
         self.resource_definition_cache = resource_definition_cache
         self.prefix = prefix
 
+    def resource_definition_prefix(self) -> str:
+        return self.prefix + f'/{DEFINITION_GROUP}/resourcedefinition/'
+
+    def instance_prefix(self, group: str, singular: str) -> str:
+        """
+        The prefix every resource of the type group/singular is stored below, whatever its version.
+        """
+        return self.prefix + f'/{group}/{singular}/'
+
+    def resolve(self, type: str) -> TypeName:
+        names = self.resource_definition_cache.resolve(type)
+        if names is None:
+            raise HTTPException(status_code=404, detail=f'Resource {type} does not exist')
+        return names
+
     def from_resource(self, resource: dict) -> str:
         group, version = resource['apiVersion'].split('/')
 
         if group == 'api.catcode.io':
             # Construct the key for a resource definition
-            return self.prefix + f'/api.catcode.io/resourcedefinition/{resource["spec"]["group"]}/{resource["spec"]["names"]["singular"]}'
+            return self.resource_definition_prefix() + f'{resource["spec"]["group"]}/{resource["spec"]["names"]["singular"]}'
         else:
             # Get the singular name from the cache
             singular_name = self.resource_definition_cache.get_singular_name(resource)
@@ -49,17 +64,20 @@ class KeyBuilder:
             If api group is not added it should "try" to look it up it self.
             If version is not added it should use the newest.s:
 
+            Every spelling is resolved with one lookup in the table the definition cache keeps,
+            an unknown one raises 404. A resource definition is named by any spelling of the type it defines.
         """
+        names = self.resolve(type)
 
-        if 'resourcedefinition' == type:
-            names = self.resource_definition_cache._singular_name[name]
-            path = f'/api.catcode.io/resourcedefinition/{names["group"]}/{names["singular"]}'
+        if names.group == DEFINITION_GROUP:
+            if not name:
+                return self.resource_definition_prefix()[:-1]
+            defined = self.resolve(name)
+            path = f'/{DEFINITION_GROUP}/resourcedefinition/{defined.group}/{defined.singular}'
         elif name:
-            names = self.resource_definition_cache._singular_name[type]
-            path = f"/{names['group']}/{type}/{name}"
+            path = f"/{names.group}/{names.singular}/{name}"
         else:
-            names = self.resource_definition_cache._plural_name[type]
-            path = f"/{names['group']}/{names['singular']}"
+            path = f"/{names.group}/{names.singular}"
         return self.prefix + path
 
 key_builder = KeyBuilder(resource_definition_cache)
\ No newline at end of file
@@ -0,0 +1,177 @@
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+from fastapi import HTTPException
+
+EQUALITY = ('=', '==')
+SET_OPERATORS = ('in', 'notin')
+
+_SET_TERM = re.compile(r'^\s*([^\s!=(),]+)\s+(in|notin)\s+\(([^()]*)\)\s*$')
+_EQUALITY_TERM = re.compile(r'^\s*([^\s!=(),]+)\s*(==|=|!=)\s*([^\s!=(),]*)\s*$')
+_EXISTS_TERM = re.compile(r'^\s*(!?)\s*([^\s!=(),]+)\s*$')
+
+
+@dataclass(frozen=True)
+class Requirement:
+    key: str
+    operator: str
+    values: tuple[str, ...] = ()
+
+    def matches(self, value: Optional[str], present: bool) -> bool:
+        if self.operator in EQUALITY:
+            return present and value == self.values[0]
+        if self.operator == '!=':
+            return not present or value != self.values[0]
+        if self.operator == 'in':
+            return present and value in self.values
+        if self.operator == 'notin':
+            return not present or value not in self.values
+        if self.operator == 'exists':
+            return present
+        return not present
+
+
+def _split_terms(selector: str) -> list[str]:
+    # Commas inside the parentheses of a set based term do not separate terms
+    terms, depth, current = [], 0, ''
+    for char in selector:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == ',' and depth == 0:
+            terms.append(current)
+            current = ''
+        else:
+            current += char
+    terms.append(current)
+    return [term for term in terms if term.strip()]
+
+
+def parse_label_selector(selector: Optional[str]) -> list[Requirement]:
+    """
+    Parses a Kubernetes style label selector, e.g. `team=platform,tier in (api,web),!deprecated`.
+    Supports =, ==, !=, in, notin, existence (`key`) and non-existence (`!key`).
+    """
+    requirements = []
+    for term in _split_terms(selector or ''):
+        if match := _SET_TERM.match(term):
+            key, operator, values = match.groups()
+            values = tuple(value.strip() for value in values.split(',') if value.strip())
+            requirements.append(Requirement(key, operator, values))
+        elif match := _EQUALITY_TERM.match(term):
+            key, operator, value = match.groups()
+            requirements.append(Requirement(key, operator, (value,)))
+        elif match := _EXISTS_TERM.match(term):
+            negated, key = match.groups()
+            requirements.append(Requirement(key, '!' if negated else 'exists'))
+        else:
+            raise HTTPException(status_code=400, detail=f'Invalid label selector term: {term.strip()}')
+    return requirements
+
+
+def parse_field_selector(selector: Optional[str]) -> list[Requirement]:
+    """
+    Parses a field selector such as `metadata.name=core-api,spec.owner!=mw`. Only =, == and != are supported.
+    """
+    requirements = []
+    for term in _split_terms(selector or ''):
+        match = _EQUALITY_TERM.match(term)
+        if not match:
+            raise HTTPException(status_code=400, detail=f'Invalid field selector term: {term.strip()}')
+        key, operator, value = match.groups()
+        requirements.append(Requirement(key, operator, (value,)))
+    return requirements
+
+
+def _text(value) -> str:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
+
+
+def _field_value(resource: dict, path: str) -> tuple[Optional[str], bool]:
+    value = resource
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None, False
+        value = value[part]
+    return _text(value), True
+
+
+def label_values(labels: dict) -> dict[str, str]:
+    """
+    Returns labels with every value as the text a selector compares against, e.g. `tier: 1` as '1'.
+    Selecting from etcd and from the informer index both go through here, so both find the same resources.
+    """
+    return {label: _text(value) for label, value in labels.items()}
+
+
+@dataclass
+class Selector:
+    labels: list[Requirement] = field(default_factory=list)
+    fields: list[Requirement] = field(default_factory=list)
+
+    @classmethod
+    def parse(cls, label_selector: Optional[str], field_selector: Optional[str]) -> Optional['Selector']:
+        selector = cls(parse_label_selector(label_selector), parse_field_selector(field_selector))
+        return selector if selector.labels or selector.fields else None
+
+    def matches_labels(self, labels: dict) -> bool:
+        return all(r.matches(labels.get(r.key), r.key in labels) for r in self.labels)
+
+    def matches_fields(self, resource: dict) -> bool:
+        return all(r.matches(*_field_value(resource, r.key)) for r in self.fields)
+
+    def matches(self, resource: dict) -> bool:
+        labels = label_values(resource.get('metadata', {}).get('labels') or {})
+        return self.matches_labels(labels) and self.matches_fields(resource)
+
+    def name(self) -> Optional[str]:
+        """
+        Returns the name required by a metadata.name equality term, which maps directly to a single key.
+        """
+        for requirement in self.fields:
+            if requirement.key == 'metadata.name' and requirement.operator in EQUALITY:
+                return requirement.values[0]
+        return None
+
+
+@dataclass
+class Projection:
+    """
+    The fields a list returns of every resource, e.g. `metadata.name,spec.owner`. Fields a resource
+    does not have are left out, the rest keep their place in the resource.
+    """
+    paths: list[tuple[str, ...]] = field(default_factory=list)
+
+    @classmethod
+    def parse(cls, fields: Optional[str]) -> Optional['Projection']:
+        paths = []
+        for term in (fields or '').split(','):
+            if not term.strip():
+                continue
+            path = tuple(term.strip().split('.'))
+            if not all(path):
+                raise HTTPException(status_code=400, detail=f'Invalid field: {term.strip()}')
+            paths.append(path)
+        return cls(paths) if paths else None
+
+    def apply(self, resource: dict) -> dict:
+        output = {}
+        for path in self.paths:
+            value = resource
+            for part in path:
+                if not isinstance(value, dict) or part not in value:
+                    break
+                value = value[part]
+            else:
+                target = output
+                for part in path[:-1]:
+                    target = target.setdefault(part, {})
+                target[path[-1]] = value
+        return output
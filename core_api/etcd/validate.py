@@ -1,9 +1,14 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import yaml
 from fastapi import HTTPException
 import jsonschema
 
-from core_api.etcd.cache import ResourceDefinitionCache, resource_definition_cache
-from settings import BASE_DIR
+from core_api.etcd.cache import ResourceDefinitionCache, compile_schema, resource_definition_cache
+from core_api.metrics import metrics
+from settings import BASE_DIR, config
 
 
 class ResourceValidator:
@@ -20,47 +25,56 @@ class ResourceValidator:
                 file = yaml.safe_load(f)
                 base_schemas[name] = file
         self.base_schemas = base_schemas
+        # Compiled once at start up and reused for every request
+        self.base_validators = {name: compile_schema(schema) for name, schema in base_schemas.items()}
 
     def __call__(self, resource: dict):
         return self.validate(resource)
 
-    def validate(self, resource: dict):
-        resource_definition = self.resource_definition_cache.get_resource_definition(resource)
+    @staticmethod
+    def _validate(validator, instance: dict):
+        try:
+            validator.validate(instance)
+        except jsonschema.ValidationError as e:
+            raise HTTPException(status_code=400, detail=f"Validation Error: {e.message}")
 
-        _, version = resource['apiVersion'].split('/')
+    def validate(self, resource: dict):
+        group, version = resource['apiVersion'].split('/')
 
-        schema_spec = [s for s in resource_definition['spec']['versions'] if s['name'] == version]
+        validator = self.resource_definition_cache.get_validator(group, resource['kind'], version)
 
-        if len(schema_spec) == 0:
+        if validator is None:
             raise HTTPException(status_code=400, detail=f'No resource schema found for resource: {resource}')
-        elif len(schema_spec) > 1:
-            raise HTTPException(status_code=400, detail=f'Multiple schemas found for resource: {resource}')
-
-        schema_spec = schema_spec[0]
-
-        # Validate the schema version
-        if 'schemaVersion' not in schema_spec or schema_spec['schemaVersion'] != 'openAPISchemaV3':
-            raise HTTPException(status_code=400, detail=f'Invalid schema version: {schema_spec.get("schemaVersion")}')
 
-        if schema_spec['schemaVersion'] != 'openAPISchemaV3':
-            raise HTTPException(status_code=400, detail=f'Invalid schema {schema_spec["schemaVersion"]}')
-
-        schema = schema_spec['schema']
         # TODO: Implemnt base validation also.
-        jsonschema.validate({'spec': resource['spec']}, schema)
+        with metrics.timed(metrics.validation_seconds, None, resource['kind'], version):
+            self._validate(validator, resource['spec'])
 
         return resource
 
     def base_validation(self, resource: dict):
-        try:
-            jsonschema.validate(resource, self.base_schemas['base-schema'])
-        except jsonschema.ValidationError as e:
-            raise HTTPException(status_code=400, detail=f"Validation Error: {e.message}")
+        self._validate(self.base_validators['base-schema'], resource)
         return resource
 
     def base_resource_validation(self, resource: dict):
-        jsonschema.validate(resource, self.base_schemas['base-resource-definition-schema'])
+        with metrics.timed(metrics.validation_seconds, None, resource['kind'], resource['apiVersion'].split('/')[-1]):
+            self._validate(self.base_validators['base-resource-definition-schema'], resource)
         return resource
 
 resource_validator = ResourceValidator(resource_definition_cache)
 
+# jsonschema validation is CPU bound, so it runs on a small dedicated pool instead of the event loop
+validation_executor = ThreadPoolExecutor(max_workers=config.validation_workers, thread_name_prefix='validation')
+
+
+async def run_validation(func, *args):
+    loop = asyncio.get_running_loop()
+    if not metrics.enabled:
+        return await loop.run_in_executor(validation_executor, func, *args)
+
+    # Measured here rather than in the pool, whose threads do not see the request context
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(validation_executor, func, *args)
+    finally:
+        metrics.add_timing('validation', time.perf_counter() - start)
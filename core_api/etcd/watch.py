@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Optional
+
+from fastapi import HTTPException
+
+from core_api.etcd.client import EtcdCompactedError, WatchEvent, prefix_range_end
+from core_api.resource.version import set_resource_version
+from core_api.storage import Storage, storage
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+ADDED = 'ADDED'
+MODIFIED = 'MODIFIED'
+DELETED = 'DELETED'
+
+
+@dataclass
+class ResourceEvent:
+    type: str
+    revision: int
+    object: dict
+
+    @classmethod
+    def from_watch_event(cls, event: WatchEvent) -> 'ResourceEvent':
+        revision = event.kv.mod_revision
+        if event.type == 'DELETE':
+            # A delete carries no value, the deleted resource is the previous one
+            value = event.prev_kv.value if event.prev_kv else b'{}'
+            return cls(DELETED, revision, set_resource_version(json.loads(value), revision))
+        event_type = ADDED if event.kv.create_revision == revision else MODIFIED
+        return cls(event_type, revision, set_resource_version(json.loads(event.kv.value), revision))
+
+    @cached_property
+    def data(self) -> bytes:
+        # Encoded once, however many subscribers the event goes to
+        return json.dumps({'type': self.type, 'object': self.object}).encode()
+
+
+@dataclass(eq=False)
+class Subscriber:
+    start_revision: int
+    queue: asyncio.Queue
+    backlog: deque = field(default_factory=deque)
+    error: Optional[HTTPException] = None
+
+    def close(self, error: HTTPException):
+        # Whatever is still queued is dropped, the client resumes from the last event it received
+        self.error = error
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def next(self, timeout: float) -> ResourceEvent:
+        """
+        Returns the next event, raises asyncio.TimeoutError if there was none within timeout
+        and the error the subscription was closed with once it is closed.
+        """
+        if self.backlog and self.error is None:
+            return self.backlog.popleft()
+        event = await asyncio.wait_for(self.queue.get(), timeout)
+        if event is None:
+            raise self.error
+        return event
+
+
+class WatchHub:
+    """
+    Follows one etcd watch on prefix and fans its events out to every subscriber.
+
+    The last history_size events are kept, so a subscriber starting at an earlier revision
+    is replayed from memory rather than opening its own etcd watch.
+    Each subscriber has a queue of queue_size events. A subscriber whose queue is full is
+    disconnected, so a slow client never holds events back from the others or grows memory.
+    """
+    def __init__(
+            self,
+            storage: Storage,
+            prefix: str,
+            start_revision: int,
+            history_size: int = 10000,
+            queue_size: int = 1000
+    ):
+        self.storage = storage
+        self.prefix = prefix
+        self.queue_size = queue_size
+        self.history: deque[ResourceEvent] = deque(maxlen=history_size)
+        # Every event from this revision on is in history or still to come
+        self.oldest = start_revision
+        self.revision = start_revision - 1
+        self.subscribers: set[Subscriber] = set()
+        self.closed = False
+        self._task = asyncio.create_task(self._run())
+
+    def subscribe(self, start_revision: int) -> Optional[Subscriber]:
+        """
+        Returns a subscriber receiving every event from start_revision on,
+        or None if events that old are no longer kept.
+        """
+        if self.closed or start_revision < self.oldest:
+            return None
+        subscriber = Subscriber(
+            start_revision,
+            asyncio.Queue(self.queue_size),
+            deque(event for event in self.history if event.revision >= start_revision)
+        )
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def stop(self):
+        self.closed = True
+        self._task.cancel()
+
+    async def _run(self):
+        delay = 1
+        while True:
+            try:
+                async for response in self.storage.watch(
+                        self.prefix,
+                        range_end=prefix_range_end(self.prefix),
+                        start_revision=self.revision + 1,
+                        prev_kv=True
+                ):
+                    delay = 1
+                    for event in response.events:
+                        self._publish(ResourceEvent.from_watch_event(event))
+            except EtcdCompactedError as e:
+                logger.warning(f'Watch on {self.prefix} was compacted at revision {self.revision}: {e.detail}')
+                self._close(HTTPException(
+                    status_code=410,
+                    detail=f'Revision {self.revision + 1} has been compacted, list again and watch from its revision'
+                ))
+                return
+            except HTTPException as e:
+                logger.error(f'Watch on {self.prefix} lost etcd, retrying in {delay}s: {e.detail}')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+            except Exception as e:
+                # Retrying would most likely fail the same way, the watchers reconnect to a new watch instead
+                logger.exception(f'Watch on {self.prefix} failed at revision {self.revision}: {e}')
+                self._close(HTTPException(
+                    status_code=500,
+                    detail=f'Watch failed after revision {self.revision}, resume from the last resourceVersion received'
+                ))
+                return
+
+    def _publish(self, event: ResourceEvent):
+        if len(self.history) == self.history.maxlen:
+            self.oldest = max(self.oldest, self.history[0].revision + 1)
+        self.history.append(event)
+        self.revision = event.revision
+
+        for subscriber in list(self.subscribers):
+            if event.revision < subscriber.start_revision:
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                logger.warning(f'Disconnecting a watcher on {self.prefix} more than {self.queue_size} events behind')
+                self.subscribers.discard(subscriber)
+                subscriber.close(HTTPException(
+                    status_code=429,
+                    detail=f'Watcher fell more than {self.queue_size} events behind, resume from the last resourceVersion received'
+                ))
+
+    def _close(self, error: HTTPException):
+        self.closed = True
+        for subscriber in self.subscribers:
+            subscriber.close(error)
+        self.subscribers.clear()
+
+
+class WatchManager:
+    """
+    Shares one WatchHub per prefix between every watcher of it, and stops it when the last one leaves.
+    """
+    def __init__(self, storage: Storage, history_size: int = 10000, queue_size: int = 1000):
+        self.storage = storage
+        self.history_size = history_size
+        self.queue_size = queue_size
+        self._hubs: dict[str, WatchHub] = {}
+
+    def _hub(self, prefix: str, start_revision: int) -> WatchHub:
+        return WatchHub(self.storage, prefix, start_revision, self.history_size, self.queue_size)
+
+    def subscribe(self, prefix: str, start_revision: int) -> tuple[WatchHub, Subscriber]:
+        hub = self._hubs.get(prefix)
+        if hub is None or hub.closed:
+            hub = self._hubs[prefix] = self._hub(prefix, start_revision)
+
+        subscriber = hub.subscribe(start_revision)
+        if subscriber is None:
+            # The shared watch does not reach back to start_revision, so this watcher gets its own
+            logger.debug(f'Watching {prefix} from {start_revision} on a separate etcd watch, shared one starts at {hub.oldest}')
+            hub = self._hub(prefix, start_revision)
+            subscriber = hub.subscribe(start_revision)
+        return hub, subscriber
+
+    def unsubscribe(self, hub: WatchHub, subscriber: Subscriber):
+        hub.unsubscribe(subscriber)
+        if not hub.subscribers:
+            hub.stop()
+            if self._hubs.get(hub.prefix) is hub:
+                del self._hubs[hub.prefix]
+
+    def close(self):
+        for hub in self._hubs.values():
+            hub.stop()
+        self._hubs.clear()
+
+
+watch_manager = WatchManager(storage, history_size=config.watch_history_size, queue_size=config.watch_queue_size)
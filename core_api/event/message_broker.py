@@ -1,9 +1,8 @@
 from extensions.rabbitmq import AsyncRabbitMQProducer, AsyncRabbitMQConsumer
 from messaging_tools import EventBus, Message
 
-from settings import config
+from core_api.event.publisher import event_publisher
 
-async def produce_message(message):
-
-    async with AsyncRabbitMQProducer(url=config.rabbitmq_url) as producer:
-        await producer.publish('events', message.model_dump_json(by_alias=True))
\ No newline at end of file
+async def produce_message(message) -> bool:
+    # Goes out over the long lived connection of the event publisher instead of a connection per message
+    return event_publisher.publish(message.model_dump_json(by_alias=True))
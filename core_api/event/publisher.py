@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Optional
+
+from extensions.rabbitmq import AsyncRabbitMQProducer
+
+from core_api.etcd.client import KeyValue
+from core_api.event.events import Events
+from core_api.metrics import Metrics, metrics
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+
+class EventPublisher:
+    """
+    Publishes events to RabbitMQ from a background task over one long lived producer connection.
+
+    Requests only put the event on a bounded in-memory queue, so they never wait for the broker.
+    The task takes up to batch_size events at a time, waiting at most linger seconds for a batch
+    to fill, and publishes them concurrently so the broker confirms of a batch are awaited together.
+    Events not confirmed are retried on a new connection. When the queue is full new events are
+    dropped and counted, rather than slowing requests down or growing memory. The queue depth and
+    the dropped events are exported as metrics as well as in stats().
+    """
+    def __init__(
+            self,
+            url: str,
+            exchange: str = 'events',
+            max_queue: int = 10000,
+            batch_size: int = 100,
+            linger: float = 0.005,
+            producer_factory=AsyncRabbitMQProducer,
+            metrics: Metrics = metrics
+    ):
+        self.url = url
+        self.exchange = exchange
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.linger = linger
+        self.producer_factory = producer_factory
+        self.metrics = metrics
+
+        self.queue: Optional[asyncio.Queue] = None
+        self.published = 0
+        self.dropped = 0
+        self.failures = 0
+        self.batches = 0
+        self.last_batch_seconds = 0.0
+        self._pending: list = []
+        self._in_flight = 0
+
+    def start(self) -> asyncio.Task:
+        # The queue belongs to the event loop of the app, so it is made when the app starts
+        self.queue = asyncio.Queue(self.max_queue)
+        return asyncio.create_task(self.run())
+
+    def publish(self, message) -> bool:
+        """
+        Queues message, an already encoded body or an (event, key, revision, value) tuple,
+        and returns whether there was room for it.
+        """
+        if self.queue is None:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            self._record_depth()
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.metrics.enabled:
+                self.metrics.events_dropped.inc()
+            if self.dropped % 1000 == 1:
+                logger.warning(f'Event queue is full at {self.max_queue} events, {self.dropped} events dropped so far')
+            return False
+
+    def emit(self, event: Events, key: str, revision: int, value: str | bytes):
+        """
+        Emits event for the resource stored at key, value is the stored JSON and is only
+        wrapped in the message body by the background task.
+        """
+        self.publish((event, key, revision, value))
+
+    def emit_write(self, key: str, revision: int, value: str | bytes, prev_kv: Optional[KeyValue]):
+        self.emit(Events.COMPONENT_UPDATED if prev_kv else Events.COMPONENT_CREATED, key, revision, value)
+
+    @staticmethod
+    def encode(message) -> str:
+        if isinstance(message, str):
+            return message
+        event, key, revision, value = message
+        if isinstance(value, bytes):
+            value = value.decode()
+        return (
+            f'{{"event": {json.dumps(event)}, "key": {json.dumps(key)}, '
+            f'"resourceVersion": "{revision}", "resource": {value or "null"}}}'
+        )
+
+    def _record_depth(self):
+        if self.metrics.enabled:
+            self.metrics.event_queue_depth.set(self.queue.qsize())
+
+    async def _next_batch(self) -> list:
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        self._record_depth()
+        return batch
+
+    async def _publish(self, producer, batch: list):
+        start = time.perf_counter()
+        self._in_flight = len(batch)
+        try:
+            results = await asyncio.gather(
+                *(producer.publish(self.exchange, self.encode(message)) for message in batch),
+                return_exceptions=True
+            )
+        finally:
+            self._in_flight = 0
+        self._pending = [message for message, result in zip(batch, results) if isinstance(result, BaseException)]
+        self.published += len(batch) - len(self._pending)
+        self.batches += 1
+        self.last_batch_seconds = time.perf_counter() - start
+        if self._pending:
+            raise next(result for result in results if isinstance(result, BaseException))
+
+    async def run(self):
+        delay = 1
+        while True:
+            try:
+                async with self.producer_factory(url=self.url) as producer:
+                    logger.info(f'Event publisher connected, publishing to {self.exchange}')
+                    if self._pending:
+                        await self._publish(producer, self._pending)
+                    delay = 1
+                    while True:
+                        await self._publish(producer, await self._next_batch())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                logger.error(f'Publishing events failed, {len(self._pending)} events to retry in {delay}s: {e}')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    async def drain(self, timeout: float = 5.0):
+        """
+        Waits up to timeout for queued events to be published, used when shutting down.
+        """
+        deadline = time.monotonic() + timeout
+        while self.queue is not None and (not self.queue.empty() or self._pending or self._in_flight) \
+                and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.queue.qsize() if self.queue is not None else 0,
+            'max_queue': self.max_queue,
+            'published': self.published,
+            'dropped': self.dropped,
+            'failures': self.failures,
+            'batches': self.batches,
+            'last_batch_seconds': self.last_batch_seconds,
+        }
+
+
+event_publisher = EventPublisher(
+    config.rabbitmq_url,
+    max_queue=config.event_queue_size,
+    batch_size=config.event_batch_size,
+    linger=config.event_batch_linger
+)
@@ -0,0 +1,229 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+
+from settings import config
+
+try:
+    from opentelemetry import metrics as otel_metrics
+    from opentelemetry.metrics import Observation
+except ImportError:
+    # Without the OpenTelemetry API the metrics are only served on /metrics
+    otel_metrics = None
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(10))
+
+# Returned by timed when metrics are disabled, nullcontext can be entered any number of times
+DISABLED = nullcontext()
+
+# Durations of the current request by Server-Timing metric name, None outside a request
+request_timings: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar('request_timings', default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """
+    Cumulative histogram per label set, kept in process for /metrics and recorded to OpenTelemetry as well.
+    Observations may come from the validation threads, so they take a lock, as do counters.
+    """
+    def __init__(self, name: str, description: str, unit: str, buckets: tuple, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.labels = labels
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        self._otel = otel_metrics.get_meter('core_api').create_histogram(
+            name, unit=unit, description=description, explicit_bucket_boundaries_advisory=buckets
+        ) if otel_metrics else None
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # One count per bucket and +Inf, then the sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+        if self._otel:
+            self._otel.record(value, dict(zip(self.labels, labels)))
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                total += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labels, labels, le)} {total}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, labels)} {values[-1]}')
+            lines.append(f'{self.name}_count{_labels(self.labels, labels)} {total}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._series: dict[tuple, int] = {}
+        self._lock = threading.Lock()
+        self._otel = otel_metrics.get_meter('core_api').create_counter(
+            name, description=description
+        ) if otel_metrics else None
+
+    def inc(self, *labels: str, amount: int = 1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+        if self._otel:
+            self._otel.add(amount, dict(zip(self.labels, labels)))
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self._lock:
+            series = dict(self._series)
+        for labels, value in sorted(series.items()):
+            lines.append(f'{self.name}{_labels(self.labels, labels)} {value}')
+        return lines
+
+
+class Gauge:
+    """
+    The current value per label set, read by OpenTelemetry through a callback when it collects.
+    """
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._series: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        if otel_metrics:
+            otel_metrics.get_meter('core_api').create_observable_gauge(
+                name, callbacks=[self._observe], description=description
+            )
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._series[labels] = value
+
+    def _observe(self, options):
+        with self._lock:
+            series = dict(self._series)
+        return [Observation(value, dict(zip(self.labels, labels))) for labels, value in series.items()]
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} gauge']
+        with self._lock:
+            series = dict(self._series)
+        for labels, value in sorted(series.items()):
+            lines.append(f'{self.name}{_labels(self.labels, labels)} {value}')
+        return lines
+
+
+class Metrics:
+    """
+    The measurements taken on the request path. With enabled unset every helper returns before
+    touching an instrument, so a disabled deployment pays one attribute check per call site.
+    """
+    def __init__(self, enabled: bool = True, server_timing: bool = True):
+        self.enabled = enabled
+        self.server_timing = enabled and server_timing
+
+        self.request_seconds = Histogram(
+            'core_api_request_duration_seconds', 'Time to the response headers by route', 's', LATENCY_BUCKETS, ('method', 'route', 'status')
+        )
+        self.storage_seconds = Histogram(
+            'core_api_storage_duration_seconds', 'Storage call latency by operation', 's', LATENCY_BUCKETS, ('operation',)
+        )
+        self.validation_seconds = Histogram(
+            'core_api_validation_duration_seconds', 'jsonschema validation time by kind and version', 's', LATENCY_BUCKETS, ('kind', 'version')
+        )
+        self.serialization_seconds = Histogram(
+            'core_api_serialization_duration_seconds', 'Time spent encoding JSON by operation', 's', LATENCY_BUCKETS, ('operation',)
+        )
+        self.payload_bytes = Histogram(
+            'core_api_payload_bytes', 'Request and response body sizes by route', 'By', SIZE_BUCKETS, ('direction', 'route')
+        )
+        self.cache_requests = Counter(
+            'core_api_cache_requests_total', 'Definition cache and read cache lookups by result', ('cache', 'result')
+        )
+        self.storage_queue_seconds = Histogram(
+            'core_api_storage_queue_wait_seconds', 'Time storage calls that queued waited for a slot by priority', 's', LATENCY_BUCKETS, ('priority',)
+        )
+        self.storage_queue_depth = Gauge(
+            'core_api_storage_queue_depth', 'Storage calls waiting for a slot by priority', ('priority',)
+        )
+        self.storage_in_flight = Gauge(
+            'core_api_storage_in_flight', 'Storage calls holding a slot'
+        )
+        self.storage_shed = Counter(
+            'core_api_storage_shed_total', 'Storage calls turned away by priority and reason', ('priority', 'reason')
+        )
+        self.event_queue_depth = Gauge(
+            'core_api_event_queue_depth', 'Events waiting to be published'
+        )
+        self.events_dropped = Counter(
+            'core_api_events_dropped_total', 'Events dropped because the event queue was full'
+        )
+        self.instruments = [
+            self.request_seconds, self.storage_seconds, self.validation_seconds,
+            self.serialization_seconds, self.payload_bytes, self.cache_requests,
+            self.storage_queue_seconds, self.storage_queue_depth, self.storage_in_flight, self.storage_shed,
+            self.event_queue_depth, self.events_dropped
+        ]
+
+    def timed(self, histogram: Histogram, timing: Optional[str], *labels: str):
+        """
+        Measures a block into histogram and adds it to the Server-Timing metric timing of the current request.
+        """
+        if not self.enabled:
+            return DISABLED
+        return self._timed(histogram, timing, labels)
+
+    @contextmanager
+    def _timed(self, histogram: Histogram, timing: Optional[str], labels: tuple):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(histogram, timing, time.perf_counter() - start, *labels)
+
+    def observe(self, histogram: Histogram, timing: Optional[str], seconds: float, *labels: str):
+        histogram.observe(seconds, *labels)
+        if timing:
+            self.add_timing(timing, seconds)
+
+    @staticmethod
+    def add_timing(timing: str, seconds: float):
+        timings = request_timings.get()
+        if timings is not None:
+            timings[timing] = timings.get(timing, 0.0) + seconds
+
+    def cache(self, cache: str, hit: bool):
+        if self.enabled:
+            self.cache_requests.inc(cache, 'hit' if hit else 'miss')
+
+    def render(self) -> str:
+        lines = []
+        for instrument in self.instruments:
+            lines.extend(instrument.render())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics(enabled=config.metrics_enabled, server_timing=config.server_timing_enabled)
@@ -0,0 +1,103 @@
+import asyncio
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Optional
+
+from fastapi import HTTPException
+
+from settings import config
+
+
+class SamplingProfiler:
+    """
+    Samples the call stacks of the running process at a fixed interval and counts them in the
+    collapsed stack format of flamegraph.pl and speedscope, one "root;...;leaf count" line per stack.
+
+    Sampling runs on its own thread and only reads frames, so the event loop carries on serving
+    while it is profiled. One profile runs at a time.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._labels: dict = {}
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})'
+        return label
+
+    def _collapse(self, thread: str, frame) -> str:
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.append(thread)
+        return ';'.join(reversed(labels))
+
+    def sample(self, seconds: float, interval: float, thread_id: Optional[int] = None) -> Counter:
+        """
+        Samples the thread thread_id, or every other thread, for seconds and returns the count of every stack seen.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise HTTPException(status_code=409, detail='A profile is already running')
+        try:
+            own = threading.get_ident()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == own or (thread_id is not None and ident != thread_id):
+                        continue
+                    if ident not in names:
+                        names = {thread.ident: thread.name for thread in threading.enumerate()}
+                    stacks[self._collapse(names.get(ident, str(ident)), frame)] += 1
+                time.sleep(interval)
+            return stacks
+        finally:
+            self._lock.release()
+
+    async def profile(self, seconds: float, interval: float, all_threads: bool = False) -> str:
+        """
+        Profiles the event loop thread, or every thread, for seconds and returns collapsed stacks.
+        """
+        # Called on the event loop, so this is the thread serving requests
+        thread_id = None if all_threads else threading.get_ident()
+        stacks = await asyncio.to_thread(self.sample, seconds, interval, thread_id)
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+
+class SlowRequestLog:
+    """
+    Keeps the last size requests that took at least threshold seconds, with the time each stage of them took.
+    A threshold of 0 turns the log off.
+    """
+    def __init__(self, threshold: float = 0.0, size: int = 100):
+        self.threshold = threshold
+        self.requests = deque(maxlen=size)
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def record(self, method: str, path: str, route: str, status: int, duration: float, timings: dict):
+        if not self.enabled or duration < self.threshold:
+            return
+        self.requests.append({
+            'time': time.time(),
+            'method': method,
+            'path': path,
+            'route': route,
+            'status': status,
+            'durationMs': round(duration * 1000, 3),
+            'stagesMs': {name: round(seconds * 1000, 3) for name, seconds in timings.items()}
+        })
+
+    def clear(self):
+        self.requests.clear()
+
+
+profiler = SamplingProfiler()
+slow_requests = SlowRequestLog(threshold=config.slow_request_threshold, size=config.slow_request_log_size)
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Optional
+
+from fastapi import HTTPException
+
+from core_api.etcd.cache import ResourceDefinitionCache, resource_definition_cache
+from core_api.etcd.client import EtcdCompactedError, KeyValue, prefix_range_end
+from core_api.etcd.keys import KeyBuilder, key_builder
+from core_api.storage import Storage, storage
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+
+class DefinitionSync:
+    """
+    Keeps the resource definition cache of this process, and with it the compiled validators, in step
+    with the stored ResourceDefinitions, so definitions written through any worker or replica are
+    used by all of them. It loads every definition once and then follows an etcd watch on the
+    definition prefix from the revision loaded.
+
+    Every check_interval seconds a keys only read of the newest definition and the number of them
+    tells whether the watch has delivered every change. A watch still behind at the next check is
+    dropped and the cache rebuilt, so a stored change reaches the cache within two intervals plus
+    the time a rebuild takes, even if the watch stalls without an error.
+    """
+    def __init__(
+            self,
+            storage: Storage,
+            resource_definition_cache: ResourceDefinitionCache,
+            key_builder: KeyBuilder,
+            check_interval: float = 5.0
+    ):
+        self.storage = storage
+        self.resource_definition_cache = resource_definition_cache
+        self.key_builder = key_builder
+        self.check_interval = check_interval
+
+        self.revision = 0
+        self.stats: Optional[dict] = None
+        self.loaded = asyncio.Event()
+        # Every stored definition by key as it is cached, None for those that never loaded
+        self._definitions: dict[str, Optional[dict]] = {}
+
+    @property
+    def prefix(self) -> str:
+        return self.key_builder.resource_definition_prefix()
+
+    async def run(self):
+        delay = 1
+        while True:
+            try:
+                await self._load()
+                delay = 1
+                await self._follow()
+            except HTTPException as e:
+                if isinstance(e, EtcdCompactedError):
+                    logger.warning(f'Definition watch was compacted, reloading in {delay}s: {e.detail}')
+                else:
+                    logger.error(f'Failed to sync resource definitions, retrying in {delay}s: {e.detail}')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    async def _load(self):
+        start = time.perf_counter()
+        output = await self.storage.get_prefix(self.prefix)
+
+        # Definitions deleted while the watch was down
+        stored = {kv.key for kv in output.kvs}
+        for key in [key for key in self._definitions if key not in stored]:
+            self._delete(key)
+        for kv in output.kvs:
+            self._put(kv)
+            # Compiling schemas is CPU bound, let other tasks run between definitions
+            await asyncio.sleep(0)
+
+        self.revision = output.revision
+        self.stats = {
+            'count': sum(1 for definition in self._definitions.values() if definition is not None),
+            'revision': output.revision,
+            'duration_seconds': round(time.perf_counter() - start, 4),
+        }
+        self.loaded.set()
+        logger.info(
+            f'Loaded {self.stats["count"]} resource definitions at revision {output.revision} in {self.stats["duration_seconds"]}s'
+        )
+
+    async def _follow(self):
+        tasks = [asyncio.create_task(self._watch()), asyncio.create_task(self._check())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _watch(self):
+        async for response in self.storage.watch(
+                self.prefix, range_end=prefix_range_end(self.prefix), start_revision=self.revision + 1
+        ):
+            for event in response.events:
+                if event.type == 'DELETE':
+                    self._delete(event.kv.key)
+                else:
+                    self._put(event.kv)
+            if response.events:
+                self.revision = response.events[-1].kv.mod_revision
+
+    async def _check(self):
+        behind = False
+        while True:
+            await asyncio.sleep(self.check_interval)
+            if await self.in_sync():
+                behind = False
+            elif behind:
+                logger.warning(f'Definition watch is behind the store at revision {self.revision}, reloading')
+                return
+            else:
+                # Changes may still be on their way, the watch gets until the next check
+                behind = True
+
+    async def in_sync(self) -> bool:
+        """
+        Whether every stored change has been applied. Any change not applied either leaves a definition
+        newer than the revision applied or changes the number of definitions.
+        """
+        output = await self.storage.get_range(
+            self.prefix, range_end=prefix_range_end(self.prefix), limit=1, keys_only=True,
+            sort_target='MOD', sort_order='DESCEND'
+        )
+        newest = output.kvs[0].mod_revision if output.kvs else 0
+        return newest <= self.revision and output.count == len(self._definitions)
+
+    def _put(self, kv: KeyValue):
+        try:
+            definition = json.loads(kv.value)
+            # The worker that wrote it has applied it already, compiling its schemas again is wasted work
+            spec = definition['spec']
+            if self.resource_definition_cache.get_definition(spec['group'], spec['names']['singular']) != definition:
+                self.resource_definition_cache.add_resource(definition)
+        except (HTTPException, KeyError, ValueError) as e:
+            logger.error(f'Skipping invalid resource definition {kv.key}: {e}')
+            # The cache keeps the version before, if there is one
+            definition = self._definitions.get(kv.key)
+        self._definitions[kv.key] = definition
+
+    def _delete(self, key: str):
+        definition = self._definitions.pop(key, None)
+        if definition is not None:
+            self.resource_definition_cache.remove(definition)
+
+
+definition_sync = DefinitionSync(storage, resource_definition_cache, key_builder, check_interval=config.definition_sync_interval)
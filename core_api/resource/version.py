@@ -0,0 +1,25 @@
+from typing import Optional
+
+from fastapi import HTTPException
+
+
+def set_resource_version(resource: dict, mod_revision: int) -> dict:
+    """
+    metadata.resourceVersion is never stored, it is the mod_revision of the key the resource was read from.
+    """
+    resource.setdefault('metadata', {})['resourceVersion'] = str(mod_revision)
+    return resource
+
+
+def pop_resource_version(resource: dict) -> Optional[int]:
+    """
+    Removes metadata.resourceVersion before a resource is stored and returns it as the expected mod_revision.
+    """
+    metadata = resource.get('metadata')
+    if not isinstance(metadata, dict) or 'resourceVersion' not in metadata:
+        return None
+    resource_version = metadata.pop('resourceVersion')
+    try:
+        return int(resource_version)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f'Invalid resourceVersion: {resource_version}')
@@ -0,0 +1,32 @@
+from core_api.etcd.client import etcd_client
+from core_api.metrics import metrics
+from settings import config
+
+from .admission import AdmittedStorage, admission
+from .base import Storage
+from .codec import value_codec
+from .encoded import EncodedStorage
+from .measured import MeasuredStorage
+
+
+def create_storage(backend: str = config.storage_backend) -> Storage:
+    """
+    Returns the store named by backend: the etcd cluster the client is configured for, or an embedded SQLite database.
+    """
+    if backend == 'etcd':
+        return etcd_client
+    if backend == 'sqlite':
+        from .sqlite import SQLiteStorage
+        return SQLiteStorage(config.sqlite_path, history_revisions=config.sqlite_history_revisions)
+    raise ValueError(f'Unknown storage backend {backend}, expected etcd or sqlite')
+
+
+# The store as it is, with values the way they are stored
+backend = create_storage()
+# Values are always decoded, so encoded values stay readable after value_encoding is switched back to json
+storage = EncodedStorage(backend, value_codec)
+if metrics.enabled:
+    storage = MeasuredStorage(storage, metrics)
+# Outermost, so time spent queueing is not counted as storage latency
+if admission.enabled:
+    storage = AdmittedStorage(storage, admission)
@@ -0,0 +1,175 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import time
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException
+
+from core_api.etcd.client import DeleteResponse, KeyValue, PutResponse, RangeResponse, TxnResponse, WatchResponse
+from core_api.metrics import Metrics, metrics
+from settings import config
+
+from .base import Storage
+
+# Lower goes first. Reads come before writes, so a bulk import cannot starve the API of reads
+PRIORITIES = {'read': 0, 'write': 1, 'bulk': 2}
+
+# Set by a route to run all its storage calls at a lower priority than their operation has, None otherwise
+storage_priority: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('storage_priority', default=None)
+
+
+class AdmissionController:
+    """
+    Lets at most limit storage calls run at once. Calls over the limit wait in a queue ordered by
+    priority, then arrival. A call finding queue_size calls already waiting is turned away with a
+    429, one still waiting after timeout seconds with a 503, both with a Retry-After header, so an
+    overloaded store sheds load early instead of timing everything out together.
+
+    A limit of 0 admits every call.
+    """
+    def __init__(self, limit: int = 0, queue_size: int = 0, timeout: float = 1.0, metrics: Metrics = metrics):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.metrics = metrics
+        self.active = 0
+        self.shed = 0
+        self._waiting: list[tuple[int, int, asyncio.Future, str]] = []
+        self._depth = dict.fromkeys(PRIORITIES, 0)
+        self._order = itertools.count()
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    def _record(self, priority: str):
+        if self.metrics.enabled:
+            self.metrics.storage_queue_depth.set(self._depth[priority], priority)
+            self.metrics.storage_in_flight.set(self.active)
+
+    def _reject(self, status_code: int, reason: str, priority: str) -> HTTPException:
+        self.shed += 1
+        if self.metrics.enabled:
+            self.metrics.storage_shed.inc(priority, reason)
+        return HTTPException(
+            status_code=status_code,
+            detail=f'Storage is overloaded, {reason}',
+            headers={'Retry-After': str(max(1, math.ceil(self.timeout)))}
+        )
+
+    async def acquire(self, priority: str):
+        if self.active < self.limit and not self._waiting:
+            self.active += 1
+            self._record(priority)
+            return
+        if len(self._waiting) >= self.queue_size:
+            raise self._reject(429, 'queue full', priority)
+
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        entry = (PRIORITIES[priority], next(self._order), future, priority)
+        heapq.heappush(self._waiting, entry)
+        self._depth[priority] += 1
+        self._record(priority)
+        try:
+            await asyncio.wait_for(future, self.timeout)
+        except BaseException as error:
+            if future.done() and not future.cancelled():
+                # It was handed a slot as it gave up, the slot goes to the next in line
+                self.release()
+            elif entry in self._waiting:
+                # A release between the timeout and here has popped and counted it already
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._depth[priority] -= 1
+                self._record(priority)
+            if isinstance(error, asyncio.TimeoutError):
+                raise self._reject(503, 'queue timeout', priority)
+            raise
+        finally:
+            if self.metrics.enabled:
+                self.metrics.observe(self.metrics.storage_queue_seconds, 'queue', time.perf_counter() - start, priority)
+
+    def release(self):
+        # The slot is handed straight to the first waiter, so active only drops when nobody waits
+        while self._waiting:
+            _, _, future, priority = heapq.heappop(self._waiting)
+            self._depth[priority] -= 1
+            if not future.done():
+                future.set_result(None)
+                self._record(priority)
+                return
+        self.active -= 1
+        if self.metrics.enabled:
+            self.metrics.storage_in_flight.set(self.active)
+
+    def slot(self, priority: str) -> '_Slot':
+        return _Slot(self, storage_priority.get() or priority)
+
+    def stats(self) -> dict:
+        return {'limit': self.limit, 'active': self.active, 'waiting': dict(self._depth), 'shed': self.shed}
+
+
+class _Slot:
+    def __init__(self, controller: AdmissionController, priority: str):
+        self.controller = controller
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.controller.acquire(self.priority)
+
+    async def __aexit__(self, *exc):
+        self.controller.release()
+
+
+class AdmittedStorage:
+    """
+    Wraps a Storage and runs every call but watches through an AdmissionController. Watches are
+    long lived and would hold a slot for as long as they run.
+    """
+    def __init__(self, storage: Storage, admission: AdmissionController):
+        self.storage = storage
+        self.admission = admission
+
+    async def get(self, key: str) -> Optional[KeyValue]:
+        async with self.admission.slot('read'):
+            return await self.storage.get(key)
+
+    async def get_prefix(self, prefix: str, **kwargs) -> RangeResponse:
+        async with self.admission.slot('read'):
+            return await self.storage.get_prefix(prefix, **kwargs)
+
+    async def get_range(self, key: str | bytes, **kwargs) -> RangeResponse:
+        async with self.admission.slot('read'):
+            return await self.storage.get_range(key, **kwargs)
+
+    async def put(self, key: str, value: str | bytes, prev_kv: bool = False) -> PutResponse:
+        async with self.admission.slot('write'):
+            return await self.storage.put(key, value, prev_kv=prev_kv)
+
+    async def delete(self, key: str, prefix: bool = False, prev_kv: bool = False) -> DeleteResponse:
+        async with self.admission.slot('write'):
+            return await self.storage.delete(key, prefix=prefix, prev_kv=prev_kv)
+
+    async def txn(self, compare: list[dict] = (), success: list[dict] = (), failure: list[dict] = ()) -> TxnResponse:
+        async with self.admission.slot('write'):
+            return await self.storage.txn(compare=compare, success=success, failure=failure)
+
+    def watch(self, key: str, **kwargs) -> AsyncIterator[WatchResponse]:
+        return self.storage.watch(key, **kwargs)
+
+    async def close(self):
+        await self.storage.close()
+
+    def __getattr__(self, name: str):
+        return getattr(self.storage, name)
+
+
+admission = AdmissionController(
+    limit=config.storage_concurrency,
+    queue_size=config.storage_queue_size,
+    timeout=config.storage_queue_timeout
+)
@@ -0,0 +1,56 @@
+from typing import AsyncIterator, Optional, Protocol
+
+from core_api.etcd.client import DeleteResponse, KeyValue, PutResponse, RangeResponse, TxnResponse, WatchResponse
+
+
+class Storage(Protocol):
+    """
+    What the API needs from a key value store, modelled on etcd: a single revision counter
+    that every write moves on, the mod_revision, create_revision and version of every key,
+    reads pinned to a past revision and watches starting from one.
+
+    Transactions take the operation and compare dicts built by put_request, delete_request,
+    range_request and compare_mod_revision. A read or watch of a compacted revision raises
+    EtcdCompactedError.
+    """
+    async def get(self, key: str) -> Optional[KeyValue]:
+        ...
+
+    async def get_prefix(self, prefix: str, **kwargs) -> RangeResponse:
+        ...
+
+    async def get_range(
+            self,
+            key: str | bytes,
+            range_end: Optional[bytes] = None,
+            limit: int = 0,
+            revision: int = 0,
+            keys_only: bool = False,
+            count_only: bool = False,
+            serializable: bool = False,
+            sort_target: Optional[str] = None,
+            sort_order: str = 'ASCEND'
+    ) -> RangeResponse:
+        ...
+
+    async def put(self, key: str, value: str | bytes, prev_kv: bool = False) -> PutResponse:
+        ...
+
+    async def delete(self, key: str, prefix: bool = False, prev_kv: bool = False) -> DeleteResponse:
+        ...
+
+    async def txn(self, compare: list[dict] = (), success: list[dict] = (), failure: list[dict] = ()) -> TxnResponse:
+        ...
+
+    def watch(
+            self,
+            key: str,
+            range_end: Optional[bytes] = None,
+            start_revision: int = 0,
+            prev_kv: bool = False,
+            progress_notify: bool = False
+    ) -> AsyncIterator[WatchResponse]:
+        ...
+
+    async def close(self):
+        ...
@@ -0,0 +1,72 @@
+import zlib
+
+from settings import config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Leading byte of an encoded value. JSON text never starts with a control character,
+# so a value without one of these is plain JSON, as every value written before encoding was
+ZLIB = b'\x01'
+ZSTD = b'\x02'
+
+ENCODINGS = ('json', 'zlib', 'zstd')
+
+
+class ValueCodec:
+    """
+    Encodes stored values as zlib or zstd compressed JSON behind a header byte, and decodes
+    any stored value, encoded or plain, back to JSON bytes. Values shorter than min_bytes are
+    kept as plain JSON, the header and compression frame would make them bigger.
+    """
+    def __init__(self, encoding: str = 'json', min_bytes: int = 512, level: int = 3):
+        if encoding not in ENCODINGS:
+            raise ValueError(f'Unknown value encoding {encoding}, expected one of {", ".join(ENCODINGS)}')
+        if encoding == 'zstd' and zstandard is None:
+            raise ValueError('The zstd value encoding needs the zstandard package')
+        self.encoding = encoding
+        self.min_bytes = min_bytes
+        self.level = level
+        self._zstd_compressor = zstandard.ZstdCompressor(level=level) if zstandard else None
+        self._zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.encoding != 'json'
+
+    def _header(self, size: int) -> bytes:
+        if self.encoding == 'json' or size < self.min_bytes:
+            return b''
+        return ZSTD if self.encoding == 'zstd' else ZLIB
+
+    def encode(self, value: str | bytes) -> bytes:
+        if isinstance(value, str):
+            value = value.encode()
+        header = self._header(len(value))
+        if header == ZSTD:
+            return ZSTD + self._zstd_compressor.compress(value)
+        if header == ZLIB:
+            return ZLIB + zlib.compress(value, self.level)
+        return value
+
+    def decode(self, value: bytes) -> bytes:
+        header = value[:1]
+        if header == ZLIB:
+            return zlib.decompress(value[1:])
+        if header == ZSTD:
+            if self._zstd_decompressor is None:
+                raise ValueError('Found a zstd encoded value, but the zstandard package is not installed')
+            return self._zstd_decompressor.decompress(value[1:])
+        return value
+
+    def is_current(self, value: bytes) -> bool:
+        """
+        Whether value is stored the way encode would store it now, so a migration can skip it.
+        """
+        header = value[:1] if value[:1] in (ZLIB, ZSTD) else b''
+        return header == self._header(len(self.decode(value)))
+
+
+value_codec = ValueCodec(config.value_encoding, min_bytes=config.value_encoding_min_bytes)
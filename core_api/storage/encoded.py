@@ -0,0 +1,82 @@
+import base64
+from typing import AsyncIterator, Optional
+
+from core_api.etcd.client import (
+    DeleteResponse, KeyValue, PutResponse, RangeResponse, TxnResponse, WatchResponse
+)
+
+from .base import Storage
+from .codec import ValueCodec
+
+
+class EncodedStorage:
+    """
+    Wraps a Storage and encodes values on the way in and decodes them on the way out, so everything
+    above it handles JSON bytes whichever way the values are stored. Telling a plain value from an
+    encoded one takes a look at its first byte.
+    """
+    def __init__(self, storage: Storage, codec: ValueCodec):
+        self.storage = storage
+        self.codec = codec
+
+    def _decode(self, kv: Optional[KeyValue]) -> Optional[KeyValue]:
+        if kv is not None and kv.value:
+            kv.value = self.codec.decode(kv.value)
+        return kv
+
+    def _decode_response(self, response):
+        if isinstance(response, RangeResponse):
+            for kv in response.kvs:
+                self._decode(kv)
+        elif isinstance(response, PutResponse):
+            self._decode(response.prev_kv)
+        elif isinstance(response, DeleteResponse):
+            for kv in response.prev_kvs:
+                self._decode(kv)
+        return response
+
+    def _encode_operation(self, operation: dict) -> dict:
+        if not self.codec.enabled or 'request_put' not in operation:
+            return operation
+        request = dict(operation['request_put'])
+        value = base64.b64decode(request.get('value', ''))
+        request['value'] = base64.b64encode(self.codec.encode(value)).decode()
+        return {'request_put': request}
+
+    async def get(self, key: str) -> Optional[KeyValue]:
+        return self._decode(await self.storage.get(key))
+
+    async def get_prefix(self, prefix: str, **kwargs) -> RangeResponse:
+        return self._decode_response(await self.storage.get_prefix(prefix, **kwargs))
+
+    async def get_range(self, key: str | bytes, **kwargs) -> RangeResponse:
+        return self._decode_response(await self.storage.get_range(key, **kwargs))
+
+    async def put(self, key: str, value: str | bytes, prev_kv: bool = False) -> PutResponse:
+        return self._decode_response(await self.storage.put(key, self.codec.encode(value), prev_kv=prev_kv))
+
+    async def delete(self, key: str, prefix: bool = False, prev_kv: bool = False) -> DeleteResponse:
+        return self._decode_response(await self.storage.delete(key, prefix=prefix, prev_kv=prev_kv))
+
+    async def txn(self, compare: list[dict] = (), success: list[dict] = (), failure: list[dict] = ()) -> TxnResponse:
+        output = await self.storage.txn(
+            compare=compare,
+            success=[self._encode_operation(operation) for operation in success],
+            failure=[self._encode_operation(operation) for operation in failure]
+        )
+        for response in output.responses:
+            self._decode_response(response)
+        return output
+
+    async def watch(self, key: str, **kwargs) -> AsyncIterator[WatchResponse]:
+        async for response in self.storage.watch(key, **kwargs):
+            for event in response.events:
+                self._decode(event.kv)
+                self._decode(event.prev_kv)
+            yield response
+
+    async def close(self):
+        await self.storage.close()
+
+    def __getattr__(self, name: str):
+        return getattr(self.storage, name)
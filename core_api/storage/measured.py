@@ -0,0 +1,72 @@
+import time
+from typing import AsyncIterator, Optional
+
+from core_api.etcd.client import DeleteResponse, KeyValue, PutResponse, RangeResponse, TxnResponse, WatchResponse
+from core_api.metrics import Metrics
+
+from .base import Storage
+
+
+class MeasuredStorage:
+    """
+    Wraps a Storage and records the latency of every call by operation, and its share of the request in
+    Server-Timing. It is only put in front of the store when metrics are enabled.
+    """
+    def __init__(self, storage: Storage, metrics: Metrics):
+        self.storage = storage
+        self.metrics = metrics
+
+    def _observe(self, operation: str, start: float):
+        self.metrics.observe(self.metrics.storage_seconds, 'storage', time.perf_counter() - start, operation)
+
+    async def get(self, key: str) -> Optional[KeyValue]:
+        start = time.perf_counter()
+        try:
+            return await self.storage.get(key)
+        finally:
+            self._observe('get', start)
+
+    async def get_prefix(self, prefix: str, **kwargs) -> RangeResponse:
+        start = time.perf_counter()
+        try:
+            return await self.storage.get_prefix(prefix, **kwargs)
+        finally:
+            self._observe('range', start)
+
+    async def get_range(self, key: str | bytes, **kwargs) -> RangeResponse:
+        start = time.perf_counter()
+        try:
+            return await self.storage.get_range(key, **kwargs)
+        finally:
+            self._observe('range' if kwargs.get('range_end') else 'get', start)
+
+    async def put(self, key: str, value: str | bytes, prev_kv: bool = False) -> PutResponse:
+        start = time.perf_counter()
+        try:
+            return await self.storage.put(key, value, prev_kv=prev_kv)
+        finally:
+            self._observe('put', start)
+
+    async def delete(self, key: str, prefix: bool = False, prev_kv: bool = False) -> DeleteResponse:
+        start = time.perf_counter()
+        try:
+            return await self.storage.delete(key, prefix=prefix, prev_kv=prev_kv)
+        finally:
+            self._observe('delete', start)
+
+    async def txn(self, compare: list[dict] = (), success: list[dict] = (), failure: list[dict] = ()) -> TxnResponse:
+        start = time.perf_counter()
+        try:
+            return await self.storage.txn(compare=compare, success=success, failure=failure)
+        finally:
+            self._observe('txn', start)
+
+    def watch(self, key: str, **kwargs) -> AsyncIterator[WatchResponse]:
+        return self.storage.watch(key, **kwargs)
+
+    async def close(self):
+        await self.storage.close()
+
+    def __getattr__(self, name: str):
+        # Backend specific extras, like compact on SQLite
+        return getattr(self.storage, name)
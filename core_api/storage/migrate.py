@@ -0,0 +1,142 @@
+"""
+Re-encodes the stored values with a value encoding, in batches, while the API keeps serving.
+
+    python -m core_api.storage.migrate --encoding zlib
+    python -m core_api.storage.migrate --encoding json      # back to plain JSON
+    python -m core_api.storage.migrate --encoding zlib --dry-run
+
+Every batch is written in one transaction that only applies if none of its keys changed since
+they were read. When one did, the keys are retried one by one and those written by the API in
+the meantime are left alone, the API encodes them itself. Migrated values get a new
+resourceVersion, so watchers see them as MODIFIED.
+
+Run it with the API configured for the same encoding, otherwise the API keeps writing the old one.
+The SQLite backend allows a single process, so stop the API before migrating it.
+"""
+import argparse
+import asyncio
+import logging
+
+from core_api.etcd.client import compare_mod_revision, prefix_range_end, put_request, request_size
+from core_api.etcd.keys import key_builder
+from core_api.storage import backend
+from core_api.storage.base import Storage
+from core_api.storage.codec import ENCODINGS, ValueCodec
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+
+def chunk_batch(batch: list[tuple[str, int, bytes]]) -> list[list[tuple[str, int, bytes]]]:
+    """
+    Splits a batch so every transaction stays within the operation and request size limits of etcd.
+    """
+    chunks, chunk, size = [], [], 0
+    for item in batch:
+        item_size = request_size(put_request(item[0], item[2])) + 32
+        if chunk and (len(chunk) >= config.etcd_max_txn_ops or size + item_size > config.etcd_max_request_bytes):
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append(item)
+        size += item_size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+async def write_batch(storage: Storage, batch: list[tuple[str, int, bytes]]) -> tuple[int, int]:
+    """
+    Writes (key, mod_revision, value) items unless the key changed since mod_revision. Returns how many
+    were written and how many had changed.
+    """
+    written = changed = 0
+    for chunk in chunk_batch(batch):
+        output = await storage.txn(
+            compare=[compare_mod_revision(key, mod_revision) for key, mod_revision, _ in chunk],
+            success=[put_request(key, value) for key, _, value in chunk]
+        )
+        if output.succeeded:
+            written += len(chunk)
+            continue
+        for key, mod_revision, value in chunk:
+            output = await storage.txn(
+                compare=[compare_mod_revision(key, mod_revision)],
+                success=[put_request(key, value)]
+            )
+            written += output.succeeded
+            changed += not output.succeeded
+    return written, changed
+
+
+async def migrate(
+        storage: Storage,
+        codec: ValueCodec,
+        prefix: str,
+        batch_size: int = 500,
+        pause: float = 0.0,
+        dry_run: bool = False
+) -> dict:
+    """
+    Re-encodes every value below prefix that is not stored the way codec would store it,
+    reading batch_size keys at a time and waiting pause seconds between batches.
+    """
+    stats = {'scanned': 0, 'migrated': 0, 'current': 0, 'changed': 0, 'bytes_before': 0, 'bytes_after': 0}
+    key = prefix
+    while True:
+        page = await storage.get_range(key, range_end=prefix_range_end(prefix), limit=batch_size)
+
+        batch = []
+        for kv in page.kvs:
+            stats['scanned'] += 1
+            stats['bytes_before'] += len(kv.value)
+            if codec.is_current(kv.value):
+                stats['current'] += 1
+                stats['bytes_after'] += len(kv.value)
+                continue
+            value = codec.encode(codec.decode(kv.value))
+            stats['bytes_after'] += len(value)
+            batch.append((kv.key, kv.mod_revision, value))
+
+        if batch and not dry_run:
+            written, changed = await write_batch(storage, batch)
+            stats['migrated'] += written
+            stats['changed'] += changed
+        elif batch:
+            stats['migrated'] += len(batch)
+
+        logger.info(f'Migrated {stats["migrated"]} of {stats["scanned"]} values scanned so far')
+        if not page.more:
+            return stats
+        key = page.kvs[-1].key + '\0'
+        if pause:
+            await asyncio.sleep(pause)
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--encoding', choices=ENCODINGS, default=config.value_encoding)
+    parser.add_argument('--min-bytes', type=int, default=config.value_encoding_min_bytes, help='Smaller values stay plain JSON')
+    parser.add_argument('--prefix', default=key_builder.prefix + '/')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--pause', type=float, default=0.1, help='Seconds to wait between batches')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would be migrated')
+    args = parser.parse_args()
+
+    codec = ValueCodec(args.encoding, min_bytes=args.min_bytes)
+    # The store itself, not storage, which would decode the values on the way out
+    try:
+        stats = await migrate(backend, codec, args.prefix, args.batch_size, args.pause, args.dry_run)
+    finally:
+        await backend.close()
+
+    ratio = stats['bytes_after'] / stats['bytes_before'] if stats['bytes_before'] else 1
+    print(
+        f'{"Would migrate" if args.dry_run else "Migrated"} {stats["migrated"]} of {stats["scanned"]} values to {args.encoding}, '
+        f'{stats["current"]} were already current, {stats["changed"]} changed during the migration. '
+        f'Stored size {stats["bytes_before"]} -> {stats["bytes_after"]} bytes ({ratio:.1%})'
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(asyncio.run(main()))
@@ -0,0 +1,372 @@
+import asyncio
+import base64
+import logging
+import sqlite3
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException
+
+from core_api.etcd.client import (
+    DeleteResponse, EtcdCompactedError, KeyValue, PutResponse, RangeResponse, TxnResponse, WatchEvent, WatchResponse,
+    prefix_range_end
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    revision INTEGER NOT NULL,
+    compact_revision INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (id, revision, compact_revision) VALUES (0, 1, 0);
+
+CREATE TABLE IF NOT EXISTS kv (
+    key BLOB PRIMARY KEY,
+    value BLOB NOT NULL,
+    create_revision INTEGER NOT NULL,
+    mod_revision INTEGER NOT NULL,
+    version INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS history (
+    key BLOB NOT NULL,
+    mod_revision INTEGER NOT NULL,
+    deleted INTEGER NOT NULL,
+    value BLOB,
+    create_revision INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (key, mod_revision)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS history_mod_revision ON history (mod_revision);
+'''
+
+SORT_COLUMNS = {'KEY': 'key', 'VERSION': 'version', 'CREATE': 'create_revision', 'MOD': 'mod_revision', 'VALUE': 'value'}
+COMPARE_FIELDS = {'VERSION': 'version', 'CREATE': 'create_revision', 'MOD': 'mod_revision'}
+
+
+def _decode(value: Optional[str]) -> bytes:
+    return base64.b64decode(value) if value else b''
+
+
+def _key(key: str | bytes) -> bytes:
+    return key.encode() if isinstance(key, str) else key
+
+
+def _range_condition(key: bytes, range_end: Optional[bytes]) -> tuple[str, tuple]:
+    if not range_end:
+        return 'key = ?', (key,)
+    if range_end == b'\0':
+        return 'key >= ?', (key,)
+    return 'key >= ? AND key < ?', (key, range_end)
+
+
+def _key_value(row, keys_only: bool = False) -> KeyValue:
+    key, value, create_revision, mod_revision, version = row
+    return KeyValue(
+        key=key.decode(),
+        value=b'' if keys_only else value,
+        mod_revision=mod_revision,
+        create_revision=create_revision,
+        version=version
+    )
+
+
+class SQLiteStorage:
+    """
+    An embedded single node store with the revision semantics of etcd, for deployments and CI
+    without an etcd cluster.
+
+    kv holds the current value of every key and answers reads at the current revision.
+    history holds every put and delete, which serves reads pinned to a past revision and
+    watches, and is compacted to the last history_revisions revisions as it grows.
+
+    Statements run on the event loop thread. They take microseconds against a local file,
+    less than handing them to a thread would cost, and it makes every call atomic towards
+    the others without locks. Watchers are woken in process when a write commits, so only
+    one process may use the database file.
+    """
+    def __init__(self, path: str = ':memory:', history_revisions: int = 100000):
+        self.path = path
+        self.history_revisions = history_revisions
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute('PRAGMA synchronous = NORMAL')
+        self._db.executescript(SCHEMA)
+        self.revision, self.compact_revision = self._db.execute('SELECT revision, compact_revision FROM meta').fetchone()
+        self._changed = asyncio.Event()
+        logger.info(f'Using SQLite storage at {path}, revision {self.revision}')
+
+    # Reads
+
+    async def get(self, key: str) -> Optional[KeyValue]:
+        response = await self.get_range(key)
+        return response.kvs[0] if response.kvs else None
+
+    async def get_prefix(self, prefix: str, **kwargs) -> RangeResponse:
+        return await self.get_range(prefix, range_end=prefix_range_end(prefix), **kwargs)
+
+    async def get_range(
+            self,
+            key: str | bytes,
+            range_end: Optional[bytes] = None,
+            limit: int = 0,
+            revision: int = 0,
+            keys_only: bool = False,
+            count_only: bool = False,
+            serializable: bool = False,
+            sort_target: Optional[str] = None,
+            sort_order: str = 'ASCEND'
+    ) -> RangeResponse:
+        return self._range(_key(key), range_end, limit, revision, keys_only, count_only, sort_target, sort_order)
+
+    def _check_revision(self, revision: int):
+        if revision and revision < self.compact_revision:
+            raise EtcdCompactedError(detail=f'Storage error: required revision {revision} has been compacted')
+        if revision > self.revision:
+            raise HTTPException(status_code=500, detail=f'Storage error: required revision {revision} is a future revision')
+
+    def _range(
+            self,
+            key: bytes,
+            range_end: Optional[bytes] = None,
+            limit: int = 0,
+            revision: int = 0,
+            keys_only: bool = False,
+            count_only: bool = False,
+            sort_target: Optional[str] = None,
+            sort_order: str = 'ASCEND'
+    ) -> RangeResponse:
+        self._check_revision(revision)
+        condition, parameters = _range_condition(key, range_end)
+
+        if not revision or revision == self.revision:
+            source = 'kv'
+        else:
+            # The latest version of every key at revision, unless that version is a delete
+            source = (
+                'SELECT h.key, h.value, h.create_revision, h.mod_revision, h.version FROM history h '
+                f'WHERE h.{condition} AND h.deleted = 0 AND h.mod_revision = ('
+                '    SELECT MAX(l.mod_revision) FROM history l WHERE l.key = h.key AND l.mod_revision <= ?'
+                ')'
+            )
+            source, parameters, condition = f'({source})', parameters + (revision,), 'TRUE'
+
+        count = None
+        if count_only or limit:
+            count = self._db.execute(f'SELECT COUNT(*) FROM {source} WHERE {condition}', parameters).fetchone()[0]
+            if count_only:
+                return RangeResponse(count=count, revision=self.revision)
+
+        order = 'key'
+        if sort_target:
+            order = f'{SORT_COLUMNS[sort_target]} {"DESC" if sort_order == "DESCEND" else "ASC"}, key'
+        statement = f'SELECT key, value, create_revision, mod_revision, version FROM {source} WHERE {condition} ORDER BY {order}'
+        if limit:
+            statement += f' LIMIT {int(limit) + 1}'
+
+        rows = self._db.execute(statement, parameters).fetchall()
+        more = bool(limit) and len(rows) > limit
+        kvs = [_key_value(row, keys_only) for row in (rows[:limit] if limit else rows)]
+        return RangeResponse(kvs=kvs, count=len(rows) if count is None else count, revision=self.revision, more=more)
+
+    # Writes
+
+    def _current(self, key: bytes) -> Optional[KeyValue]:
+        row = self._db.execute(
+            'SELECT key, value, create_revision, mod_revision, version FROM kv WHERE key = ?', (key,)
+        ).fetchone()
+        return _key_value(row) if row else None
+
+    def _put(self, key: bytes, value: bytes, revision: int) -> Optional[KeyValue]:
+        previous = self._current(key)
+        create_revision = previous.create_revision if previous else revision
+        version = previous.version + 1 if previous else 1
+        self._db.execute(
+            'INSERT OR REPLACE INTO kv (key, value, create_revision, mod_revision, version) VALUES (?, ?, ?, ?, ?)',
+            (key, value, create_revision, revision, version)
+        )
+        self._db.execute(
+            'INSERT INTO history (key, mod_revision, deleted, value, create_revision, version) VALUES (?, ?, 0, ?, ?, ?)',
+            (key, revision, value, create_revision, version)
+        )
+        return previous
+
+    def _delete(self, key: bytes, range_end: Optional[bytes], revision: int) -> list[KeyValue]:
+        condition, parameters = _range_condition(key, range_end)
+        deleted = [_key_value(row) for row in self._db.execute(
+            f'SELECT key, value, create_revision, mod_revision, version FROM kv WHERE {condition}', parameters
+        ).fetchall()]
+        if deleted:
+            self._db.execute(f'DELETE FROM kv WHERE {condition}', parameters)
+            self._db.executemany(
+                'INSERT INTO history (key, mod_revision, deleted, value, create_revision, version) VALUES (?, ?, 1, NULL, 0, 0)',
+                [(kv.key.encode(), revision) for kv in deleted]
+            )
+        return deleted
+
+    def _write(self, apply):
+        """
+        Runs apply(revision) in one SQLite transaction. The revision only moves on if apply wrote something.
+        """
+        revision = self.revision + 1
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            result, wrote = apply(revision)
+            if wrote:
+                self._db.execute('UPDATE meta SET revision = ?', (revision,))
+            self._db.execute('COMMIT')
+        except sqlite3.IntegrityError as e:
+            self._db.execute('ROLLBACK')
+            raise HTTPException(status_code=500, detail=f'Storage error: duplicate key given in txn request: {e}')
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+
+        if wrote:
+            self.revision = revision
+            self._notify()
+            if self.revision - self.compact_revision > 2 * self.history_revisions:
+                self.compact(self.revision - self.history_revisions)
+        return result
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def put(self, key: str, value: str | bytes, prev_kv: bool = False) -> PutResponse:
+        def apply(revision: int):
+            previous = self._put(_key(key), _key(value), revision)
+            return PutResponse(revision=revision, prev_kv=previous if prev_kv else None), True
+        return self._write(apply)
+
+    async def delete(self, key: str, prefix: bool = False, prev_kv: bool = False) -> DeleteResponse:
+        def apply(revision: int):
+            deleted = self._delete(_key(key), prefix_range_end(key) if prefix else None, revision)
+            response = DeleteResponse(
+                deleted=len(deleted),
+                revision=revision if deleted else self.revision,
+                prev_kvs=deleted if prev_kv else []
+            )
+            return response, bool(deleted)
+        return self._write(apply)
+
+    def _compare(self, compare: dict) -> bool:
+        kv = self._current(_decode(compare['key']))
+        target = compare.get('target', 'VERSION')
+        if target == 'VALUE':
+            actual, expected = (kv.value if kv else b''), _decode(compare.get('value'))
+        else:
+            field = COMPARE_FIELDS[target]
+            actual, expected = (getattr(kv, field) if kv else 0), int(compare.get(field, 0))
+        return {
+            'EQUAL': actual == expected,
+            'NOT_EQUAL': actual != expected,
+            'GREATER': actual > expected,
+            'LESS': actual < expected
+        }[compare.get('result', 'EQUAL')]
+
+    async def txn(self, compare: list[dict] = (), success: list[dict] = (), failure: list[dict] = ()) -> TxnResponse:
+        def apply(revision: int):
+            succeeded = all(self._compare(condition) for condition in compare)
+            responses, wrote = [], False
+            for operation in (success if succeeded else failure):
+                if 'request_range' in operation:
+                    request = operation['request_range']
+                    # Reads inside a txn see the writes before them, at the revision the txn commits at
+                    responses.append(self._range(_decode(request['key']), _decode(request.get('range_end')) or None))
+                elif 'request_put' in operation:
+                    request = operation['request_put']
+                    previous = self._put(_decode(request['key']), _decode(request.get('value')), revision)
+                    responses.append(PutResponse(revision=revision, prev_kv=previous if request.get('prev_kv') else None))
+                    wrote = True
+                elif 'request_delete_range' in operation:
+                    request = operation['request_delete_range']
+                    deleted = self._delete(_decode(request['key']), _decode(request.get('range_end')) or None, revision)
+                    responses.append(DeleteResponse(
+                        deleted=len(deleted),
+                        revision=revision,
+                        prev_kvs=deleted if request.get('prev_kv') else []
+                    ))
+                    wrote = wrote or bool(deleted)
+            return TxnResponse(succeeded=succeeded, revision=revision if wrote else self.revision, responses=responses), wrote
+        return self._write(apply)
+
+    def compact(self, revision: int):
+        """
+        Drops the history before revision, except the versions reads at revision or later still need.
+        """
+        if revision <= self.compact_revision:
+            return
+        self._db.execute('BEGIN IMMEDIATE')
+        self._db.execute(
+            'DELETE FROM history WHERE mod_revision < :revision AND (deleted = 1 OR mod_revision < ('
+            '    SELECT MAX(l.mod_revision) FROM history l WHERE l.key = history.key AND l.mod_revision < :revision'
+            '))',
+            {'revision': revision}
+        )
+        self._db.execute('UPDATE meta SET compact_revision = ?', (revision,))
+        self._db.execute('COMMIT')
+        self.compact_revision = revision
+        logger.info(f'Compacted SQLite storage history to revision {revision}')
+
+    # Watch
+
+    def _events(self, key: bytes, range_end: Optional[bytes], start: int, prev_kv: bool) -> list[WatchEvent]:
+        condition, parameters = _range_condition(key, range_end)
+        rows = self._db.execute(
+            'SELECT key, value, create_revision, mod_revision, version, deleted FROM history '
+            f'WHERE mod_revision >= ? AND {condition} ORDER BY mod_revision, key',
+            (start,) + parameters
+        ).fetchall()
+
+        events = []
+        for *row, deleted in rows:
+            kv = _key_value(row)
+            previous = None
+            if prev_kv or deleted:
+                previous = self._db.execute(
+                    'SELECT key, value, create_revision, mod_revision, version FROM history '
+                    'WHERE key = ? AND mod_revision < ? AND deleted = 0 ORDER BY mod_revision DESC LIMIT 1',
+                    (row[0], kv.mod_revision)
+                ).fetchone()
+                previous = _key_value(previous) if previous and prev_kv else None
+            if deleted:
+                kv.value = b''
+            events.append(WatchEvent(type='DELETE' if deleted else 'PUT', kv=kv, prev_kv=previous))
+        return events
+
+    async def watch(
+            self,
+            key: str,
+            range_end: Optional[bytes] = None,
+            start_revision: int = 0,
+            prev_kv: bool = False,
+            progress_notify: bool = False
+    ) -> AsyncIterator[WatchResponse]:
+        """
+        Streams changes to key, or the range up to range_end, starting at start_revision.
+        With progress_notify every commit that has no event for this watch is reported as an empty response.
+        """
+        key, range_end = _key(key), range_end or None
+        start = start_revision or self.revision + 1
+        yield WatchResponse(revision=self.revision, created=True)
+
+        while True:
+            if start < self.compact_revision:
+                raise EtcdCompactedError(
+                    detail=f'Storage watch start revision has been compacted, oldest is {self.compact_revision}',
+                    compact_revision=self.compact_revision
+                )
+            changed = self._changed
+            if start <= self.revision:
+                events = self._events(key, range_end, start, prev_kv)
+                revision, start = self.revision, self.revision + 1
+                if events or progress_notify:
+                    yield WatchResponse(revision=revision, events=events)
+                continue
+            await changed.wait()
+
+    async def close(self):
+        self._db.close()
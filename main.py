@@ -5,26 +5,56 @@ from contextlib import asynccontextmanager
 
 import yaml
 
-from core_api.etcd import run_command
-from core_api.etcd.keys import key_builder
+from core_api.etcd.informer import resource_informer
+from core_api.etcd.watch import watch_manager
+from core_api.event.publisher import event_publisher
+from core_api.metrics import metrics
+from core_api.resource.definitions import definition_sync
+from core_api.storage import storage
+from core_api.storage.admission import admission
 from settings import BASE_DIR, config
 
 logger = logging.getLogger(__name__)
 
 
-from fastapi import FastAPI, Request, status
+from fastapi import FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 import uvicorn
 
+from core_api.api.admin import router as admin_router
+from core_api.api.bulk import router as bulk_router
 from core_api.api.etcd import router as etcd_router
+from core_api.api.middleware import MetricsMiddleware
+
+async def sync_resource_definition_cache(app: FastAPI):
+    # Keeps following the stored definitions after the first load, so this worker sees those written through others
+    sync = asyncio.create_task(definition_sync.run())
+    await definition_sync.loaded.wait()
+    app.state.ready = True
+    await sync
+
 
 @asynccontextmanager
 async def initialize_resource_definition_cache(app: FastAPI):
+    # Loading runs in the background so liveness is answered while the cache is rebuilt,
+    # readiness stays false until it is done
+    app.state.ready = False
+    tasks = [asyncio.create_task(sync_resource_definition_cache(app))]
+    if config.read_cache_enabled:
+        tasks.append(asyncio.create_task(resource_informer.run()))
+    if config.events_enabled:
+        tasks.append(event_publisher.start())
 
     yield
 
+    await event_publisher.drain()
+    for task in tasks:
+        task.cancel()
+    watch_manager.close()
+    await storage.close()
+
 app = FastAPI(
     root_path='/api/core-api',
     # openapi_url="/api/core-api/openapi.json",
@@ -48,11 +78,28 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 @app.get("/health/live")
 async def liveness_check():
     return JSONResponse(content={"status": "alive"}, status_code=200)
 
+@app.get("/health/ready")
+async def readiness_check():
+    if not app.state.ready:
+        return JSONResponse(content={"status": "starting"}, status_code=503)
+    return JSONResponse(
+        content={"status": "ready", "resourceDefinitions": definition_sync.stats, "events": event_publisher.stats(),
+                 "storage": admission.stats()},
+        status_code=200
+    )
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail='Metrics are disabled')
+    return Response(metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
 # @app.on_event("startup")
 # async def startup_event():
 #     await on_start_up()
@@ -61,6 +108,8 @@ async def liveness_check():
 
 #app.include_router(application_router)
 #app.include_router(stat_router)
+app.include_router(admin_router)
+app.include_router(bulk_router)
 app.include_router(etcd_router)
 if __name__ == '__main__':
     logging.getLogger("pika").setLevel(logging.ERROR)
@@ -71,4 +120,7 @@ if __name__ == '__main__':
 
     logger.info('CatCode core core_api starting up')
     logger.info(f'Connecting to etcd running on {config.etcd_host}')
-    uvicorn.run('main:app', host='0.0.0.0')
+    if config.workers > 1 and config.storage_backend == 'sqlite':
+        raise SystemExit('The sqlite storage backend can only be used by one process, set workers to 1')
+    logger.info(f'Running {config.workers} workers')
+    uvicorn.run('main:app', host='0.0.0.0', workers=config.workers)
@@ -17,6 +17,42 @@ class Config:
    logging_level: str
    etcd_host: str
    github_token: str = ''
+   etcd_max_connections: int = 100
+   etcd_timeout: float = 5.0
+   etcd_pool_timeout: float = 30.0
+   validation_workers: int = 4
+   read_cache_enabled: bool = True
+   read_cache_max_bytes: int = 256 * 1024 * 1024
+   list_page_size: int = 500
+   etcd_max_txn_ops: int = 128
+   etcd_max_request_bytes: int = 1536 * 1024
+   patch_max_retries: int = 5
+   watch_history_size: int = 10000
+   watch_queue_size: int = 1000
+   watch_heartbeat_seconds: float = 15.0
+   events_enabled: bool = True
+   event_queue_size: int = 10000
+   event_batch_size: int = 100
+   event_batch_linger: float = 0.005
+   compression_min_bytes: int = 64 * 1024
+   storage_backend: str = 'etcd'
+   sqlite_path: str = 'core_api.sqlite3'
+   sqlite_history_revisions: int = 100000
+   metrics_enabled: bool = True
+   server_timing_enabled: bool = True
+   admin_token: str = ''
+   profile_max_seconds: float = 60.0
+   slow_request_threshold: float = 0.0
+   slow_request_log_size: int = 100
+   value_encoding: str = 'json'
+   value_encoding_min_bytes: int = 512
+   read_coalescing_enabled: bool = True
+   read_coalesce_window: float = 0.0
+   storage_concurrency: int = 64
+   storage_queue_size: int = 1000
+   storage_queue_timeout: float = 2.0
+   workers: int = 1
+   definition_sync_interval: float = 5.0
 
 config = read_configs_to_dataclass(Config, BASE_DIR)
 
@@ -0,0 +1,46 @@
+import threading
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from core_api.api.admin import router
+from core_api.profiling import SamplingProfiler, SlowRequestLog
+from settings import config
+
+
+def test_admin_endpoints_require_the_token(monkeypatch):
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+
+    monkeypatch.setattr(config, 'admin_token', '')
+    assert client.get('/admin/slow-requests').status_code == 404
+
+    monkeypatch.setattr(config, 'admin_token', 'secret')
+    assert client.get('/admin/slow-requests', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get('/admin/slow-requests', headers={'Authorization': 'Bearer secret'}).status_code == 200
+
+
+def test_profiler_collapses_stacks_of_the_sampled_thread():
+    def busy_work(until: float):
+        while time.monotonic() < until:
+            pass
+
+    worker = threading.Thread(target=busy_work, args=(time.monotonic() + 0.5,), name='busy')
+    worker.start()
+    stacks = SamplingProfiler().sample(0.2, 0.005, worker.ident)
+    worker.join()
+
+    assert stacks
+    assert all(stack.startswith('busy;') and 'busy_work' in stack for stack in stacks)
+
+
+def test_slow_request_log_is_bounded():
+    log = SlowRequestLog(threshold=0.1, size=2)
+    for i in range(3):
+        log.record('GET', f'/{i}', '/{name}', 200, 0.2, {'storage': 0.15})
+    log.record('GET', '/fast', '/{name}', 200, 0.01, {})
+
+    assert [request['path'] for request in log.requests] == ['/1', '/2']
+    assert log.requests[-1]['stagesMs'] == {'storage': 150.0}
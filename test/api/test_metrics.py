@@ -0,0 +1,40 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from core_api.api.middleware import MetricsMiddleware
+from core_api.metrics import Metrics
+
+
+def test_server_timing_and_prometheus_text():
+    metrics = Metrics(enabled=True)
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+    @app.get('/items/{name}')
+    async def item(name: str):
+        with metrics.timed(metrics.storage_seconds, 'storage', 'get'):
+            pass
+        metrics.cache('read', False)
+        return {'name': name}
+
+    response = TestClient(app).get('/items/a')
+    assert [part.split(';')[0] for part in response.headers['server-timing'].split(', ')] == ['storage', 'total']
+
+    text = metrics.render()
+    assert 'core_api_storage_duration_seconds_count{operation="get"} 1' in text
+    assert 'core_api_storage_duration_seconds_bucket{operation="get",le="+Inf"} 1' in text
+    assert 'core_api_request_duration_seconds_count{method="GET",route="/items/{name}",status="200"} 1' in text
+    assert 'core_api_cache_requests_total{cache="read",result="miss"} 1' in text
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics(enabled=False)
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+    app.get('/')(lambda: {})
+
+    response = TestClient(app).get('/')
+    assert 'server-timing' not in response.headers
+    with metrics.timed(metrics.storage_seconds, 'storage', 'get'):
+        metrics.cache('read', True)
+    assert '_count' not in metrics.render()
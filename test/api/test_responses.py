@@ -0,0 +1,22 @@
+import json
+
+from core_api.api.responses import accepted_encoding, raw_json
+
+
+def test_raw_json_splices_stored_values():
+    stored = [json.dumps({'metadata': {'name': name}}).encode() for name in ('a', 'b')]
+
+    body = raw_json({'count': 2, 'continue': None}, {'resources': stored, 'empty': []})
+
+    assert json.loads(body) == {
+        'count': 2,
+        'continue': None,
+        'resources': [{'metadata': {'name': 'a'}}, {'metadata': {'name': 'b'}}],
+        'empty': []
+    }
+
+
+def test_accepted_encoding():
+    assert accepted_encoding('gzip, deflate, br') == 'gzip'
+    assert accepted_encoding('gzip;q=0, deflate') is None
+    assert accepted_encoding('identity') is None
@@ -0,0 +1,66 @@
+import asyncio
+
+from core_api.api.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_result():
+    async def run():
+        flight = SingleFlight(window=60)
+        calls = []
+
+        async def read():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        results = await asyncio.gather(*[flight.do('key', read) for _ in range(10)])
+        assert results == [1] * 10
+        # Within the window a finished result is shared, unless a fresh one is asked for
+        assert await flight.do('key', read) == 1
+        assert await flight.do('key', read, fresh=True) == 2
+
+        # A write starts a new generation, results from before it are never shared after it
+        flight.invalidate()
+        assert await flight.do('key', read) == 3
+
+    asyncio.run(run())
+
+
+def test_cancelled_caller_does_not_cancel_the_call():
+    async def run():
+        flight = SingleFlight()
+
+        async def read():
+            await asyncio.sleep(0.01)
+            return 'value'
+
+        first = asyncio.ensure_future(flight.do('key', read))
+        second = asyncio.ensure_future(flight.do('key', read))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == 'value'
+
+    asyncio.run(run())
+
+
+def test_fresh_read_does_not_share_a_call_started_before_it():
+    async def run():
+        flight = SingleFlight()
+        stored = ['old']
+        reading = asyncio.Event()
+
+        async def read():
+            value = stored[0]
+            reading.set()
+            await asyncio.sleep(0.01)
+            return value
+
+        started = asyncio.ensure_future(flight.do('key', read))
+        await reading.wait()
+        # Written through another worker, which does not invalidate this one
+        stored[0] = 'new'
+
+        assert await flight.do('key', read, fresh=True) == 'new'
+        assert await started == 'old'
+
+    asyncio.run(run())
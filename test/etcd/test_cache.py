@@ -0,0 +1,117 @@
+import pytest
+from fastapi.exceptions import HTTPException
+
+from core_api.etcd.cache import ResourceDefinitionCache
+
+
+def resource_definition(group='catcode.io', singular='system', plural='systems', kind='System', versions=('v1alpha1',)):
+    return {
+        "apiVersion": "api.catcode.io/v1alpha1",
+        "kind": "ResourceDefinition",
+        "metadata": {"name": f"{kind}ResourceDefinition"},
+        "spec": {
+            "group": group,
+            "names": {"plural": plural, "singular": singular, "kind": kind},
+            "versions": [
+                {
+                    "name": version,
+                    "schemaVersion": "openAPISchemaV3",
+                    "schema": {"type": "object", "properties": {"owner": {"type": "string"}}, "required": ["owner"]}
+                }
+                for version in versions
+            ]
+        }
+    }
+
+
+@pytest.fixture
+def cache():
+    return ResourceDefinitionCache()
+
+
+def test_lookup_by_group_and_kind(cache):
+    cache.add_resource(resource_definition())
+    cache.add_resource(resource_definition(group='templating.catcode.io'))
+
+    resource = {'apiVersion': 'templating.catcode.io/v1alpha1', 'kind': 'System'}
+    assert cache.get_singular_name(resource) == 'system'
+    assert cache.get_resource_definition(resource)['spec']['group'] == 'templating.catcode.io'
+    assert cache.is_plural('systems', group='catcode.io')
+    assert not cache.is_plural('systems', group='other.catcode.io')
+
+
+def test_kind_does_not_match_other_names(cache):
+    # The kind of one definition equals the plural name of another
+    cache.add_resource(resource_definition(singular='system', plural='systems', kind='System'))
+    cache.add_resource(resource_definition(singular='group', plural='System', kind='Group'))
+
+    assert cache.get_singular_name({'apiVersion': 'catcode.io/v1alpha1', 'kind': 'System'}) == 'system'
+    assert cache.get_singular_name({'apiVersion': 'catcode.io/v1alpha1', 'kind': 'Unknown'}) is None
+
+
+def test_validators_follow_definition(cache):
+    cache.add_resource(resource_definition(versions=('v1alpha1', 'v1')))
+    assert cache.get_validator('catcode.io', 'System', 'v1') is not None
+    assert cache.versions('catcode.io', 'system') == ['v1alpha1', 'v1']
+
+    cache.add_resource(resource_definition(versions=('v1alpha1',)))
+    assert cache.get_validator('catcode.io', 'System', 'v1') is None
+
+    cache.remove(resource_definition())
+    assert cache.get_validator('catcode.io', 'System', 'v1alpha1') is None
+    assert not cache.exists('system')
+    assert cache.get_definition('catcode.io', 'system') is None
+    assert cache.resolve('systems.catcode.io/v1alpha1') is None and cache.resolve('system') is None
+
+
+def test_invalid_schema_version_is_rejected(cache):
+    definition = resource_definition()
+    definition['spec']['versions'][0]['schemaVersion'] = 'openAPISchemaV2'
+
+    with pytest.raises(HTTPException) as e:
+        cache.add_resource(definition)
+    assert e.value.status_code == 400
+    assert not cache.exists('system')
+
+
+def test_every_spelling_resolves_to_the_newest_version(cache):
+    cache.add_resource(resource_definition(versions=('v1alpha1', 'v1', 'v1beta1')))
+
+    for spelling in ('system', 'system.catcode.io', 'systems', 'systems.catcode.io'):
+        names = cache.resolve(spelling)
+        assert (names.group, names.singular, names.version) == ('catcode.io', 'system', 'v1')
+        assert names.is_plural == spelling.startswith('systems')
+
+    assert cache.resolve('systems.catcode.io/v1alpha1').version == 'v1alpha1'
+    assert cache.resolve('systems.catcode.io/v2') is None
+    assert cache.resolve('unknown') is None
+
+
+def test_bare_names_fall_back_to_another_group(cache):
+    cache.add_resource(resource_definition())
+    cache.add_resource(resource_definition(group='templating.catcode.io'))
+    assert cache.resolve('systems').group == 'templating.catcode.io'
+
+    cache.remove(resource_definition(group='templating.catcode.io'))
+    assert cache.resolve('systems').group == 'catcode.io'
+    assert cache.resolve('system.templating.catcode.io') is None
+
+    cache.remove(resource_definition())
+    assert cache.resolve('system') is None
+    assert cache.resolve('resourcedefinitions').is_plural
+
+
+def test_renamed_definition_keeps_its_kind_when_the_old_one_is_removed(cache):
+    cache.add_resource(resource_definition(group='g.io', singular='thing', plural='things', kind='Thing'))
+    cache.add_resource(resource_definition(group='g.io', singular='widget', plural='things', kind='Thing'))
+
+    # The old definition is evicted by the new owner of its kind
+    assert cache.get_definition('g.io', 'thing') is None and cache.resolve('thing.g.io') is None
+    assert cache.resolve('things').singular == 'widget'
+
+    # Removing the old definition again, as deleting it from storage later does, leaves the new one whole
+    cache.remove(resource_definition(group='g.io', singular='thing', plural='things', kind='Thing'))
+    assert cache.get_singular_name({'apiVersion': 'g.io/v1alpha1', 'kind': 'Thing'}) == 'widget'
+    assert cache.get_validator('g.io', 'Thing', 'v1alpha1') is not None
+    assert cache.resolve('things.g.io').singular == 'widget' and cache.resolve('widget').group == 'g.io'
+    assert cache.is_plural('things', group='g.io')
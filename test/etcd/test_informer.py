@@ -0,0 +1,197 @@
+import asyncio
+import json
+
+from core_api.etcd.client import EtcdCompactedError
+from core_api.etcd.informer import ResourceInformer
+from core_api.etcd.selectors import Selector
+from core_api.storage.sqlite import SQLiteStorage
+
+
+class CompactedOnce:
+    """
+    A store whose first watch fails as if it had fallen behind the compaction window.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+        self.lists = 0
+        self.watches = 0
+
+    async def get_range(self, key, **kwargs):
+        if not kwargs.get('revision'):
+            self.lists += 1
+        return await self.storage.get_range(key, **kwargs)
+
+    async def watch(self, key, **kwargs):
+        self.watches += 1
+        if self.watches == 1:
+            raise EtcdCompactedError(detail='required revision has been compacted')
+        async for response in self.storage.watch(key, **kwargs):
+            yield response
+
+    def __getattr__(self, name: str):
+        return getattr(self.storage, name)
+
+
+async def eventually(condition, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+def resource(name: str, **labels) -> str:
+    return json.dumps({'metadata': {'name': name, 'labels': labels}})
+
+
+def keys(kvs) -> list[str]:
+    return [kv.key for kv in kvs]
+
+
+def test_paged_list_is_followed_by_the_watch():
+    async def run():
+        storage = SQLiteStorage(':memory:')
+        for name in 'abcde':
+            await storage.put(f'/registry/catcode.io/system/{name}', resource(name))
+        await storage.put('/registry/catcode.io/component/a', resource('a'))
+        informer = ResourceInformer(storage, page_size=2)
+        task = asyncio.create_task(informer.run())
+        await eventually(lambda: informer.ready)
+
+        listed = informer.revision
+        systems, more = informer.list_prefix('/registry/catcode.io/system/')
+        assert keys(systems) == [f'/registry/catcode.io/system/{name}' for name in 'abcde'] and not more
+        assert informer.list_prefix('/registry/catcode.io/system/', start='/registry/catcode.io/system/b', limit=2) == (systems[1:3], True)
+        assert informer.count_prefix('/registry/catcode.io/') == 6
+
+        written = await storage.put('/registry/catcode.io/system/f', resource('f'))
+        deleted = await storage.delete('/registry/catcode.io/system/a')
+        await informer.wait_for_revision(deleted.revision)
+        assert informer.revision == deleted.revision
+        assert informer.get('/registry/catcode.io/system/f').mod_revision == written.revision
+        assert informer.get('/registry/catcode.io/system/a') is None
+        assert informer.count_prefix('/registry/catcode.io/system/') == 5
+
+        # A delete moves the revision of the directories above the key on, those beside it keep the list revision
+        assert informer.prefix_revision('/registry/catcode.io/system/') == deleted.revision
+        assert informer.prefix_revision('/registry/catcode.io/') == deleted.revision
+        assert informer.prefix_revision('/registry/catcode.io/component/') == listed
+
+        task.cancel()
+
+    asyncio.run(run())
+
+
+def test_compacted_watch_resyncs_from_a_fresh_list():
+    async def run():
+        storage = CompactedOnce(SQLiteStorage(':memory:'))
+        await storage.put('/registry/catcode.io/system/a', resource('a'))
+        informer = ResourceInformer(storage)
+        task = asyncio.create_task(informer.run())
+
+        # Changed while the informer waits to resync
+        await eventually(lambda: storage.watches == 1 and not informer.ready)
+        await storage.delete('/registry/catcode.io/system/a')
+        await storage.put('/registry/catcode.io/system/b', resource('b'))
+
+        await eventually(lambda: informer.ready)
+        assert storage.lists == 2
+        assert keys(informer.list_prefix('/registry/')[0]) == ['/registry/catcode.io/system/b']
+        assert informer.revision == storage.revision
+
+        task.cancel()
+
+    asyncio.run(run())
+
+
+def test_progress_notifications_advance_the_revision():
+    async def run():
+        storage = SQLiteStorage(':memory:')
+        informer = ResourceInformer(storage)
+        task = asyncio.create_task(informer.run())
+        await eventually(lambda: informer.ready)
+
+        # Nothing below the prefix changes, the revision still moves on with the store
+        written = await storage.put('/other/key', 'value')
+        await informer.wait_for_revision(written.revision)
+        assert informer.revision == written.revision
+        assert informer.count_prefix('/registry/') == 0
+
+        task.cancel()
+
+    asyncio.run(run())
+
+
+def test_wait_for_revision_gives_up_after_the_timeout():
+    async def run():
+        storage = SQLiteStorage(':memory:')
+        informer = ResourceInformer(storage)
+        task = asyncio.create_task(informer.run())
+        await eventually(lambda: informer.ready)
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await informer.wait_for_revision(informer.revision + 10, timeout=0.1)
+        assert 0.1 <= loop.time() - start < 1
+        assert informer.revision == storage.revision
+
+        task.cancel()
+
+    asyncio.run(run())
+
+
+def test_informer_over_max_bytes_disables_itself():
+    async def run():
+        storage = SQLiteStorage(':memory:')
+        for name in 'abc':
+            await storage.put(f'/registry/catcode.io/system/{name}', resource(name, tier='backend'))
+        informer = ResourceInformer(storage, max_bytes=500, page_size=1)
+
+        # It stops for good, reads check ready and go to storage instead
+        await asyncio.wait_for(informer.run(), 1)
+        assert informer.disabled and not informer.ready
+        assert informer.size == 0 and informer.get('/registry/catcode.io/system/a') is None
+
+    asyncio.run(run())
+
+
+def test_select_intersects_the_label_index():
+    async def run():
+        storage = SQLiteStorage(':memory:')
+        prefix = '/registry/catcode.io/system/'
+        await storage.put(prefix + 'api', resource('api', team='platform', tier='api'))
+        await storage.put(prefix + 'web', resource('web', team='platform', tier='web', public='true'))
+        await storage.put(prefix + 'db', resource('db', team='data', tier='db'))
+        await storage.put(prefix + 'legacy', resource('legacy', tier=1))
+        informer = ResourceInformer(storage)
+        task = asyncio.create_task(informer.run())
+        await eventually(lambda: informer.ready)
+
+        def select(label_selector: str) -> list[str]:
+            kvs, _ = informer.select(prefix, Selector.parse(label_selector, None))
+            # Every path serves the same resources as matching them one by one does
+            assert kvs == [kv for kv in informer.list_prefix(prefix)[0] if Selector.parse(label_selector, None).matches(json.loads(kv.value))]
+            return [kv.key.removeprefix(prefix) for kv in kvs]
+
+        assert select('team=platform') == ['api', 'web']
+        assert select('team=platform,tier in (web,db)') == ['web']
+        assert select('tier in (api,db)') == ['api', 'db']
+        assert select('team,public') == ['web']
+        assert select('team=platform,!public') == ['api']
+        assert select('team=platform,tier=db') == []
+        # Values that are not strings are selected by their text, like etcd reads do
+        assert select('tier=1') == ['legacy']
+        assert select('tier,!team') == ['legacy']
+        assert informer.select(prefix, Selector.parse('team=platform', None), limit=1) == ([informer.get(prefix + 'api')], True)
+
+        # A changed label moves the key between index entries
+        await storage.put(prefix + 'api', resource('api', team='data', tier='api'))
+        deleted = await storage.delete(prefix + 'db')
+        await informer.wait_for_revision(deleted.revision)
+        assert select('team=platform') == ['web']
+        assert select('team=data') == ['api']
+        assert select('tier in (api,db)') == ['api']
+        assert ('tier', 'db') not in informer._label_index
+
+        task.cancel()
+
+    asyncio.run(run())
@@ -0,0 +1,51 @@
+import pytest
+from fastapi.exceptions import HTTPException
+
+from core_api.etcd.selectors import Projection, Requirement, Selector, parse_label_selector
+
+
+def test_parse_label_selector():
+    requirements = parse_label_selector('team=platform,tier in (api, web),!deprecated,app.catcode.io/name,env!=prod')
+
+    assert requirements == [
+        Requirement('team', '=', ('platform',)),
+        Requirement('tier', 'in', ('api', 'web')),
+        Requirement('deprecated', '!'),
+        Requirement('app.catcode.io/name', 'exists'),
+        Requirement('env', '!=', ('prod',)),
+    ]
+
+
+def test_invalid_label_selector():
+    with pytest.raises(HTTPException) as e:
+        parse_label_selector('tier in (api')
+    assert e.value.status_code == 400
+
+
+def test_selector_matches():
+    resource = {
+        'metadata': {'name': 'core-api', 'labels': {'team': 'platform', 'tier': 'api'}},
+        'spec': {'owner': 'mw', 'replicas': 2}
+    }
+
+    assert Selector.parse('team=platform,tier notin (web)', 'spec.owner=mw').matches(resource)
+    assert Selector.parse(None, 'spec.replicas=2,metadata.name!=other').matches(resource)
+    assert not Selector.parse('!tier', None).matches(resource)
+    assert not Selector.parse(None, 'spec.missing=x').matches(resource)
+    assert Selector.parse(None, 'metadata.name=core-api').name() == 'core-api'
+    assert Selector.parse('', '') is None
+
+
+def test_projection():
+    resource = {
+        'metadata': {'name': 'core-api', 'labels': {'team': 'platform'}},
+        'spec': {'owner': 'mw', 'replicas': 2}
+    }
+
+    projection = Projection.parse('metadata.name, spec.owner,spec.missing,kind')
+    assert projection.apply(resource) == {'metadata': {'name': 'core-api'}, 'spec': {'owner': 'mw'}}
+    assert Projection.parse('') is None
+
+    with pytest.raises(HTTPException) as e:
+        Projection.parse('metadata..name')
+    assert e.value.status_code == 400
@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+from fastapi.exceptions import HTTPException
+
+from core_api.etcd.client import KeyValue, WatchEvent, WatchResponse
+from core_api.etcd.watch import WatchManager
+
+
+class QueueWatchClient:
+    """
+    Hands out the watch responses put on its queue, in place of etcd.
+    """
+    def __init__(self):
+        self.responses = asyncio.Queue()
+        self.watches = 0
+
+    async def watch(self, key, range_end=None, start_revision=0, prev_kv=False, progress_notify=False):
+        self.watches += 1
+        while True:
+            response = await self.responses.get()
+            if isinstance(response, Exception):
+                raise response
+            yield response
+
+    def put(self, key: str, revision: int, created: bool = False):
+        kv = KeyValue(key, json.dumps({'metadata': {'name': key}}).encode(), revision, revision if created else 1)
+        self.responses.put_nowait(WatchResponse(revision, [WatchEvent('PUT', kv)]))
+
+
+def test_watchers_share_one_watch_and_slow_watchers_are_disconnected():
+    async def run():
+        client = QueueWatchClient()
+        manager = WatchManager(client, history_size=10, queue_size=2)
+
+        hub, fast = manager.subscribe('/registry/', 1)
+        _, slow = manager.subscribe('/registry/', 1)
+
+        for revision in range(1, 4):
+            client.put(f'/registry/{revision}', revision, created=revision == 1)
+            await asyncio.sleep(0)
+            event = await fast.next(1)
+            assert (event.type, event.revision) == ('ADDED' if revision == 1 else 'MODIFIED', revision)
+
+        # The slow watcher never read, so the third event did not fit its queue
+        try:
+            await slow.next(1)
+            assert False, 'Slow watcher was not disconnected'
+        except HTTPException as e:
+            assert e.status_code == 429
+
+        # A late watcher is replayed from the history of the shared watch
+        late_hub, late = manager.subscribe('/registry/', 2)
+        assert late_hub is hub
+        assert [(await late.next(1)).revision for _ in range(2)] == [2, 3]
+        assert client.watches == 1
+
+        for subscriber in (fast, slow, late):
+            manager.unsubscribe(hub, subscriber)
+        assert hub.closed
+
+    asyncio.run(run())
+
+
+def test_watchers_are_closed_when_the_watch_fails():
+    async def run():
+        client = QueueWatchClient()
+        manager = WatchManager(client, history_size=10, queue_size=2)
+        hub, subscriber = manager.subscribe('/registry/', 1)
+
+        # A malformed line from the gateway
+        client.responses.put_nowait(ValueError('Expecting value: line 1 column 1 (char 0)'))
+        try:
+            await subscriber.next(1)
+            assert False, 'Watcher was not closed'
+        except HTTPException as e:
+            assert e.status_code == 500
+        assert hub.closed
+
+        # The next watcher gets a new watch
+        new_hub, _ = manager.subscribe('/registry/', 1)
+        await asyncio.sleep(0)
+        assert new_hub is not hub and client.watches == 2
+
+    asyncio.run(run())
@@ -0,0 +1,336 @@
+import json
+import os
+import subprocess
+import time
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import core_api.api.etcd as etcd_api
+from core_api.etcd.cache import resource_definition_cache
+from core_api.etcd.client import EtcdCompactedError
+from core_api.etcd.informer import resource_informer
+from core_api.storage import storage
+from main import app
+from settings import BASE_DIR, config
+
+
+@pytest.fixture(scope="module", autouse=True)
+def docker_compose():
+    """Start and stop Docker Compose before and after tests."""
+    subprocess.run(["docker", "compose", "-f", BASE_DIR / 'docker-compose.yaml', "up", "-d"], check=True)
+    os.environ['ETCDCTL_API'] = '3'
+    time.sleep(2)
+
+    yield
+
+    subprocess.run(["docker", "compose", "-f", BASE_DIR / 'docker-compose.yaml', "down"], check=True)
+
+
+@pytest.fixture(scope="module")
+def client(docker_compose):
+    """
+    A client of the app with its lifespan running, so reads are served by the informer unless consistent=true.
+    """
+    events_enabled, config.events_enabled = config.events_enabled, False
+    with TestClient(app) as client:
+        deadline = time.monotonic() + 60
+        while not (resource_informer.ready and client.get('/health/ready').status_code == 200):
+            assert time.monotonic() < deadline, 'The app did not become ready'
+            time.sleep(0.1)
+        yield client
+    config.events_enabled = events_enabled
+
+
+def define(client: TestClient, kind: str, group: str = 'catcode.io') -> str:
+    """
+    Stores a ResourceDefinition for kind and returns its plural.
+    """
+    plural = f'{kind.lower()}s'
+    definition = {
+        'apiVersion': 'api.catcode.io/v1alpha1',
+        'kind': 'ResourceDefinition',
+        'metadata': {'name': f'{kind}ResourceDefinition'},
+        'spec': {
+            'group': group,
+            'names': {'plural': plural, 'singular': kind.lower(), 'kind': kind},
+            'versions': [{
+                'name': 'v1alpha1',
+                'schemaVersion': 'openAPISchemaV3',
+                'schema': {'type': 'object', 'properties': {'owner': {'type': 'string'}}, 'required': ['owner']}
+            }]
+        }
+    }
+    resp = client.post('/resource/v1/', json=definition)
+    assert resp.status_code == 200, f"Failed to insert definition {kind}: {resp.content}"
+    return plural
+
+
+def create(client: TestClient, kind: str, name: str, owner: str = 'test', group: str = 'catcode.io', **labels) -> dict:
+    resource = {
+        'apiVersion': f'{group}/v1alpha1',
+        'kind': kind,
+        'metadata': {'name': name, 'labels': labels},
+        'spec': {'owner': owner}
+    }
+    resp = client.put('/resource/v1/', json=resource)
+    assert resp.status_code == 200, f"Failed to put resource {name}: {resp.content}"
+    return resource
+
+
+def names(resp) -> list[str]:
+    assert resp.status_code == 200, resp.content
+    return [resource['metadata']['name'] for resource in resp.json()['resources']]
+
+
+@pytest.mark.parametrize('consistent', [False, True])
+def test_list_pages_with_continue(client, consistent):
+    kind = 'Paged' if consistent else 'Cached'
+    plural = define(client, kind)
+    for i in range(5):
+        create(client, kind, f'item{i}')
+
+    path = f'/resource/v1/{plural}?limit=2&consistent={str(consistent).lower()}'
+    resp = client.get(path)
+    pages = [names(resp)]
+    assert resp.json()['count'] == 2 and resp.json()['continue']
+
+    # Every page is read at the revision of the first, later writes are not part of the list
+    revision = resp.json()['revision']
+    create(client, kind, 'item5')
+
+    while continue_token := resp.json()['continue']:
+        resp = client.get(path, params={'continue': continue_token})
+        assert resp.json()['revision'] == revision
+        pages.append(names(resp))
+
+    assert pages == [['item0', 'item1'], ['item2', 'item3'], ['item4']]
+    assert len(names(client.get(f'/resource/v1/{plural}'))) == 6
+
+
+def test_compacted_continue_token_is_gone(client, monkeypatch):
+    plural = define(client, 'Expiring')
+    for i in range(3):
+        create(client, 'Expiring', f'item{i}')
+    continue_token = client.get(f'/resource/v1/{plural}?limit=1').json()['continue']
+
+    class Compacted:
+        """
+        Storage that has compacted every revision but the current one.
+        """
+        def __init__(self, storage):
+            self.storage = storage
+
+        async def get_range(self, key, revision: int = 0, **kwargs):
+            if revision:
+                raise EtcdCompactedError(detail=f'required revision {revision} has been compacted')
+            return await self.storage.get_range(key, **kwargs)
+
+        def __getattr__(self, name: str):
+            return getattr(self.storage, name)
+
+    monkeypatch.setattr(etcd_api, 'storage', Compacted(etcd_api.storage))
+    create(client, 'Expiring', 'item3')
+
+    resp = client.get(f'/resource/v1/{plural}?limit=1', params={'continue': continue_token})
+    assert resp.status_code == 410, resp.content
+
+    resp = client.get(f'/resource/v1/{plural}?limit=1', params={'continue': 'not a token'})
+    assert resp.status_code == 400
+
+
+def test_stream_sends_one_document_per_line(client, monkeypatch):
+    monkeypatch.setattr(config, 'list_page_size', 2)
+    plural = define(client, 'Streamed')
+    for i in range(4):
+        create(client, 'Streamed', f'item{i}')
+    create(client, 'Streamed', 'multiline', owner='first line\nsecond line')
+
+    for consistent in ('false', 'true'):
+        resp = client.get(f'/resource/v1/{plural}?stream=true&consistent={consistent}')
+        assert resp.status_code == 200, resp.content
+        assert resp.headers['content-type'] == 'application/x-ndjson'
+
+        lines = resp.text.splitlines()
+        resources = [json.loads(line) for line in lines]
+        assert [resource['metadata']['name'] for resource in resources] == ['item0', 'item1', 'item2', 'item3', 'multiline']
+        assert resources[-1]['spec']['owner'] == 'first line\nsecond line'
+        assert all(resource['metadata']['resourceVersion'] for resource in resources)
+
+
+def test_resource_etag(client):
+    define(client, 'Tagged')
+    create(client, 'Tagged', 'item')
+
+    resp = client.get('/resource/v1/tagged/item')
+    etag = resp.headers['etag']
+    assert resp.status_code == 200 and etag == f'W/"{resp.json()["resource"]["metadata"]["resourceVersion"]}"'
+
+    for consistent in ('false', 'true'):
+        resp = client.get(f'/resource/v1/tagged/item?consistent={consistent}', headers={'If-None-Match': etag})
+        assert resp.status_code == 304 and resp.headers['etag'] == etag and not resp.content
+
+    create(client, 'Tagged', 'item', owner='someone else')
+    resp = client.get('/resource/v1/tagged/item', headers={'If-None-Match': etag})
+    assert resp.status_code == 200 and resp.headers['etag'] != etag
+    assert resp.json()['resource']['spec']['owner'] == 'someone else'
+
+
+@pytest.mark.parametrize('consistent', ['false', 'true'])
+def test_list_etag_changes_after_a_delete(client, consistent, monkeypatch):
+    kind = 'Listed' if consistent == 'true' else 'Watched'
+    plural = define(client, kind)
+    for i in range(3):
+        create(client, kind, f'item{i}')
+    path = f'/resource/v1/{plural}?consistent={consistent}'
+
+    # One tag for every encoding of the list, so it is a weak one
+    monkeypatch.setattr(config, 'compression_min_bytes', 1)
+    resp = client.get(path, headers={'Accept-Encoding': 'gzip'})
+    etag = resp.headers['etag']
+    assert resp.headers['content-encoding'] == 'gzip' and etag.startswith('W/"')
+    assert client.get(path, headers={'Accept-Encoding': 'identity'}).headers['etag'] == etag
+
+    resp = client.get(path, headers={'If-None-Match': etag})
+    assert resp.status_code == 304 and resp.headers['etag'] == etag
+
+    assert client.delete(f'/resource/v1/{kind.lower()}/item1').status_code == 200
+    resp = client.get(path, headers={'If-None-Match': etag})
+    assert resp.status_code == 200 and resp.headers['etag'] != etag
+    assert names(resp) == ['item0', 'item2']
+
+
+def test_delete_collection(client):
+    plural = define(client, 'Swept')
+    for i, tier in enumerate(['a', 'a', 'b', None]):
+        create(client, 'Swept', f'item{i}', **({'tier': tier} if tier else {}))
+
+    resp = client.delete(f'/resource/v1/{plural}?labelSelector=tier=a')
+    assert resp.status_code == 200, resp.content
+    assert (resp.json()['count'], resp.json()['skipped']) == (2, 0)
+    for consistent in ('false', 'true'):
+        assert names(client.get(f'/resource/v1/{plural}?consistent={consistent}')) == ['item2', 'item3']
+
+    resp = client.delete(f'/resource/v1/{plural}')
+    assert resp.status_code == 200 and resp.json()['count'] == 2
+    for consistent in ('false', 'true'):
+        assert client.get(f'/resource/v1/{plural}?consistent={consistent}').status_code == 404
+
+    # The type itself stays
+    assert resource_definition_cache.resolve(plural) is not None
+    create(client, 'Swept', 'item4')
+
+
+def test_cascading_definition_delete(client):
+    for group in ('catcode.io', 'other.io'):
+        define(client, 'Crate', group)
+        for i in range(2):
+            create(client, 'Crate', f'item{i}', group=group)
+    define(client, 'Box')
+    create(client, 'Box', 'item0')
+
+    resp = client.delete('/resource/v1/resourcedefinitions?fieldSelector=spec.group=catcode.io,spec.names.kind=Crate&cascade=true')
+    assert resp.status_code == 200, resp.content
+    # The definition and both of its resources
+    assert resp.json()['count'] == 3
+
+    resp = client.delete('/resource/v1/resourcedefinition/box?cascade=true')
+    assert resp.status_code == 200, resp.content
+
+    for type, prefix in (('crates.catcode.io', '/registry/catcode.io/crate/'), ('boxs', '/registry/catcode.io/box/')):
+        assert resource_definition_cache.resolve(type) is None
+        assert client.get(f'/resource/v1/{type}').status_code == 404
+        assert client.portal.call(storage.get_prefix, prefix).kvs == []
+
+    # The type of the same name in another group keeps its definition and resources
+    assert resource_definition_cache.resolve('crates.other.io') is not None
+    for consistent in ('false', 'true'):
+        assert names(client.get(f'/resource/v1/crates.other.io?consistent={consistent}')) == ['item0', 'item1']
+
+
+@pytest.mark.parametrize('consistent', ['false', 'true'])
+def test_count_and_keys_only(client, consistent):
+    kind = 'Counted' if consistent == 'true' else 'Tallied'
+    plural = define(client, kind)
+    for i, tier in enumerate(['a', 'b', 'a']):
+        create(client, kind, f'item{i}', tier=tier)
+    path = f'/resource/v1/{plural}?consistent={consistent}'
+
+    resp = client.get(f'{path}&count=true')
+    assert resp.status_code == 200, resp.content
+    assert resp.json()['count'] == 3 and set(resp.json()) == {'key_prefix', 'count', 'revision'}
+    assert client.get(f'{path}&count=true&labelSelector=tier=a').json()['count'] == 2
+    assert client.get(f'{path}&count=true&labelSelector=tier=c').json()['count'] == 0
+
+    resp = client.get(f'{path}&keysOnly=true')
+    assert resp.status_code == 200, resp.content
+    assert resp.json()['names'] == ['item0', 'item1', 'item2'] and 'resources' not in resp.json()
+    assert client.get(f'{path}&keysOnly=true&labelSelector=tier=a').json()['names'] == ['item0', 'item2']
+
+    resp = client.get(f'{path}&keysOnly=true&limit=2')
+    assert resp.json()['names'] == ['item0', 'item1']
+    resp = client.get(f'{path}&keysOnly=true&limit=2', params={'continue': resp.json()['continue']})
+    assert resp.json()['names'] == ['item2'] and resp.json()['continue'] is None
+
+
+def test_cascade_of_a_definition_already_deleted_keeps_the_resources(client):
+    define(client, 'Orphan')
+    create(client, 'Orphan', 'item0')
+    definition = resource_definition_cache.get_definition('catcode.io', 'orphan')
+
+    # Deleted through another worker, this one has not heard of it yet
+    key = '/registry/api.catcode.io/resourcedefinition/catcode.io/orphan'
+    client.portal.call(storage.delete, key)
+    deadline = time.monotonic() + 10
+    while resource_definition_cache.resolve('orphans') is not None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    resource_definition_cache.add_resource(definition)
+
+    resp = client.delete('/resource/v1/resourcedefinition/orphan?cascade=true')
+    assert resp.status_code == 404, resp.content
+    assert len(client.portal.call(storage.get_prefix, '/registry/catcode.io/orphan/').kvs) == 1
+    resource_definition_cache.remove(definition)
+
+
+def test_failed_definition_post_is_not_kept_in_the_cache(client, monkeypatch):
+    class Unavailable:
+        def __init__(self, storage):
+            self.storage = storage
+
+        async def put(self, key, value, **kwargs):
+            raise HTTPException(status_code=503, detail='etcd is unavailable')
+
+        def __getattr__(self, name: str):
+            return getattr(self.storage, name)
+
+    monkeypatch.setattr(etcd_api, 'storage', Unavailable(etcd_api.storage))
+    resp = client.post('/resource/v1/', json={
+        'apiVersion': 'api.catcode.io/v1alpha1',
+        'kind': 'ResourceDefinition',
+        'metadata': {'name': 'UnwrittenResourceDefinition'},
+        'spec': {
+            'group': 'catcode.io',
+            'names': {'plural': 'unwrittens', 'singular': 'unwritten', 'kind': 'Unwritten'},
+            'versions': [{'name': 'v1alpha1', 'schemaVersion': 'openAPISchemaV3', 'schema': {'type': 'object'}}]
+        }
+    })
+    assert resp.status_code == 503, resp.content
+    assert resource_definition_cache.get_definition('catcode.io', 'unwritten') is None
+    assert resource_definition_cache.resolve('unwrittens') is None
+
+
+def test_patch_is_validated(client):
+    define(client, 'Patched')
+    create(client, 'Patched', 'item0')
+
+    resp = client.patch('/resource/v1/patched/item0', json={'spec': {'owner': 1}})
+    assert resp.status_code == 400, resp.content
+    resp = client.get('/resource/v1/patched/item0?consistent=true')
+    assert resp.json()['resource']['spec'] == {'owner': 'test'}
+
+    # Nor is a definition whose versions no longer have a schema
+    resp = client.patch('/resource/v1/resourcedefinition/patched', json={'spec': {'versions': [{'name': 'v1alpha2'}]}})
+    assert resp.status_code == 400, resp.content
+    assert resource_definition_cache.versions('catcode.io', 'patched') == ['v1alpha1']
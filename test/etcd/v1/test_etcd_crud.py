@@ -16,6 +16,20 @@ def dict_formatter(obj1):
     return json.dumps(obj1, sort_keys=True)
 
 
+def client_fields(resource: dict) -> dict:
+    """
+    The fields of resource a client sets, without the uid and timestamps a POST adds to its metadata.
+    """
+    metadata = resource['metadata']
+    return {
+        'apiVersion': resource['apiVersion'],
+        'kind': resource['kind'],
+        'name': metadata['name'],
+        'labels': metadata.get('labels') or {},
+        'spec': resource['spec']
+    }
+
+
 @pytest.fixture(scope="module", autouse=True)
 def docker_compose():
     """Start and stop Docker Compose before and after tests."""
@@ -99,7 +113,8 @@ def test_custom_resource_insert(mock_resource_definition):
 
     # Verify the inserted resource matches the mock resource definition
     retrieved = resp.json()['resource']
-    assert retrieved == mock_resource_definition, "Inserted resource does not match"
+    assert retrieved['metadata'].pop('resourceVersion')
+    assert client_fields(retrieved) == client_fields(mock_resource_definition), "Inserted resource does not match"
 
     # Retrieve the inserted resource
     resp = client.get('/resource/v1/resourcedefinition/system')
@@ -109,7 +124,8 @@ def test_custom_resource_insert(mock_resource_definition):
 
     # Verify the retrieved resource matches the mock resource definition
     retrieved = resp.json()['resource']
-    assert retrieved == mock_resource_definition, "Retrieved resource does not match"
+    assert retrieved['metadata'].pop('resourceVersion')
+    assert client_fields(retrieved) == client_fields(mock_resource_definition), "Retrieved resource does not match"
 
 
 @pytest.mark.order(2)
@@ -122,7 +138,8 @@ def test_resource_insert(mock_resources):
 
     assert resp.status_code == 200, f"Failed to get resource {mock_resources} with error {resp.content}"
     retrieved = resp.json()['resource']
-    assert retrieved == mock_resources
+    assert retrieved['metadata'].pop('resourceVersion')
+    assert client_fields(retrieved) == client_fields(mock_resources)
 
 
 @pytest.mark.order(3)
@@ -137,8 +154,21 @@ def test_resource_put(mock_resources):
 
     assert resp.status_code == 200, f"Failed to get resource {mock_resources} with error {resp.content}"
     retrieved = resp.json()['resource']
+    assert retrieved['metadata'].pop('resourceVersion')
     assert retrieved == mock_resources
 
+@pytest.mark.order(3)
+def test_resource_put_conflict(mock_resources):
+    resp = client.get('/resource/v1/system/test')
+    resource = resp.json()['resource']
+
+    resp = client.put('/resource/v1', json=resource)
+    assert resp.status_code == 200, f"Failed to put resource with its resourceVersion with error {resp.content}"
+
+    # The resourceVersion read above is stale after the put
+    resp = client.put('/resource/v1', json=resource)
+    assert resp.status_code == 409, f"Put with a stale resourceVersion did not conflict {resp.content}"
+
 @pytest.mark.order(4)
 def test_resource_patch(mock_resources2):
     resp = client.post('/resource/v1', json=mock_resources2)
@@ -180,3 +210,23 @@ def test_resource_delete(mock_resources):
 
 
 
+
+@pytest.mark.order(7)
+def test_bulk_apply(mock_resources):
+    resources = [{**mock_resources, 'metadata': {'name': f'bulk{i}'}} for i in range(3)]
+
+    resp = client.post('/resource/v1/bulk', json=resources)
+
+    assert resp.status_code == 200, f"Failed to bulk apply resources with error {resp.content}"
+    assert resp.json()['count'] == 3
+
+    resp = client.get('/resource/v1/system/bulk2')
+    assert resp.status_code == 200, f"Failed to get bulk applied resource with error {resp.content}"
+
+    # One invalid resource fails the whole atomic batch
+    resources = [{**mock_resources, 'metadata': {'name': 'bulk3'}}, {**mock_resources, 'metadata': {'name': 'bulk4'}, 'spec': {}}]
+    resp = client.post('/resource/v1/bulk', json=resources)
+    assert resp.status_code == 400
+
+    resp = client.get('/resource/v1/system/bulk3')
+    assert resp.status_code == 404, "Atomic bulk apply wrote part of a failed batch"
@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+from core_api.event.events import Events
+from core_api.event.publisher import EventPublisher
+from core_api.metrics import Metrics
+
+
+class FlakyProducer:
+    """
+    Records what it publishes, failing the first publish of every connection while failures lasts.
+    """
+    sent = []
+    failures = 1
+
+    def __init__(self, url):
+        self.first = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def publish(self, exchange, body):
+        if self.first and FlakyProducer.failures:
+            FlakyProducer.failures -= 1
+            self.first = False
+            raise ConnectionError('broker went away')
+        FlakyProducer.sent.append(body)
+
+
+def test_events_are_batched_and_retried():
+    async def run():
+        publisher = EventPublisher('amqp://test', max_queue=3, batch_size=2, producer_factory=FlakyProducer)
+        task = publisher.start()
+
+        for i in range(4):
+            publisher.emit(Events.COMPONENT_CREATED, f'/registry/{i}', i, json.dumps({'name': i}))
+
+        # The queue holds three events, the fourth is dropped instead of blocking
+        assert publisher.dropped == 1
+
+        await asyncio.sleep(1.5)
+        await publisher.drain(timeout=1)
+        task.cancel()
+        return publisher
+
+    publisher = asyncio.run(run())
+
+    assert publisher.published == 3
+    assert publisher.failures == 1
+    assert sorted(json.loads(body)['key'] for body in FlakyProducer.sent) == ['/registry/0', '/registry/1', '/registry/2']
+    assert json.loads(FlakyProducer.sent[0])['event'] == 'COMPONENT_CREATED'
+
+
+def test_queue_depth_and_dropped_events_are_exported():
+    async def run():
+        publisher = EventPublisher(
+            'amqp://test', max_queue=2, batch_size=10, producer_factory=FlakyProducer, metrics=Metrics(enabled=True)
+        )
+        task = publisher.start()
+
+        for i in range(3):
+            publisher.emit(Events.COMPONENT_UPDATED, f'/registry/{i}', i, '{}')
+        rendered = publisher.metrics.render()
+        assert 'core_api_event_queue_depth 2' in rendered
+        assert 'core_api_events_dropped_total 1' in rendered
+
+        # Taken off the queue by the batch loop
+        await publisher.drain(timeout=1)
+        task.cancel()
+        assert 'core_api_event_queue_depth 0' in publisher.metrics.render()
+
+    FlakyProducer.failures = 0
+    asyncio.run(run())
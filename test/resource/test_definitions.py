@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+from core_api.etcd.cache import ResourceDefinitionCache
+from core_api.etcd.keys import KeyBuilder
+from core_api.resource.definitions import DefinitionSync
+from core_api.storage.sqlite import SQLiteStorage
+from test.etcd.test_cache import resource_definition
+
+
+class StalledWatch:
+    """
+    A store whose watches never deliver anything, like a watch stuck on a dead connection.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def watch(self, key: str, **kwargs):
+        await asyncio.Event().wait()
+        yield
+
+    def __getattr__(self, name: str):
+        return getattr(self.storage, name)
+
+
+async def eventually(condition, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+def test_workers_follow_definitions_written_by_others():
+    async def run():
+        storage = SQLiteStorage(':memory:')
+        workers = []
+        for _ in range(2):
+            cache = ResourceDefinitionCache()
+            workers.append(DefinitionSync(storage, cache, KeyBuilder(cache), check_interval=60))
+        tasks = [asyncio.create_task(worker.run()) for worker in workers]
+
+        key = workers[0].key_builder.from_resource(resource_definition())
+        await storage.put(key, json.dumps(resource_definition()))
+        for worker in workers:
+            await eventually(lambda: worker.resource_definition_cache.get_validator('catcode.io', 'System', 'v1alpha1') is not None)
+
+        await storage.delete(key)
+        for worker in workers:
+            await eventually(lambda: worker.resource_definition_cache.resolve('systems') is None)
+            assert await worker.in_sync()
+
+        for task in tasks:
+            task.cancel()
+
+    asyncio.run(run())
+
+
+def test_stalled_watch_is_replaced_within_two_checks():
+    async def run():
+        storage = SQLiteStorage(':memory:')
+        cache = ResourceDefinitionCache()
+        worker = DefinitionSync(StalledWatch(storage), cache, KeyBuilder(cache), check_interval=0.05)
+        task = asyncio.create_task(worker.run())
+        await worker.loaded.wait()
+
+        await storage.put(worker.key_builder.from_resource(resource_definition()), json.dumps(resource_definition()))
+        await eventually(lambda: cache.resolve('systems') is not None, timeout=0.5)
+        task.cancel()
+
+    asyncio.run(run())
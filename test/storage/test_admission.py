@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from core_api.metrics import Metrics
+from core_api.storage.admission import AdmissionController
+
+
+def test_queued_calls_run_by_priority():
+    async def run():
+        admission = AdmissionController(limit=1, queue_size=10, timeout=5, metrics=Metrics(enabled=True))
+        order = []
+
+        async def call(priority: str):
+            async with admission.slot(priority):
+                order.append(priority)
+                await asyncio.sleep(0.01)
+
+        holder = asyncio.ensure_future(call('write'))
+        await asyncio.sleep(0)
+        waiting = [asyncio.ensure_future(call(priority)) for priority in ('bulk', 'write', 'read')]
+        await asyncio.sleep(0)
+        assert admission.stats()['waiting'] == {'read': 1, 'write': 1, 'bulk': 1}
+
+        await asyncio.gather(holder, *waiting)
+        assert order == ['write', 'read', 'write', 'bulk']
+        assert admission.active == 0
+        assert 'core_api_storage_queue_wait_seconds_count{priority="bulk"} 1' in admission.metrics.render()
+
+    asyncio.run(run())
+
+
+def test_overload_is_shed_with_retry_after():
+    async def run():
+        admission = AdmissionController(limit=1, queue_size=1, timeout=0.05, metrics=Metrics(enabled=False))
+        await admission.acquire('read')
+        waiter = asyncio.ensure_future(admission.acquire('read'))
+        await asyncio.sleep(0)
+
+        with pytest.raises(HTTPException) as full:
+            await admission.acquire('read')
+        assert full.value.status_code == 429 and full.value.headers['Retry-After'] == '1'
+
+        with pytest.raises(HTTPException) as timeout:
+            await waiter
+        assert timeout.value.status_code == 503
+
+        # Neither shed call kept a place, the slot is free again once its holder is done
+        admission.release()
+        assert admission.active == 0 and admission.stats()['waiting']['read'] == 0
+        assert admission.shed == 2
+
+    asyncio.run(run())
+
+
+def test_timeout_racing_a_release_is_still_shed():
+    async def run():
+        admission = AdmissionController(limit=1, queue_size=1, timeout=0.05, metrics=Metrics(enabled=False))
+        await admission.acquire('read')
+        waiter = asyncio.ensure_future(admission.acquire('read'))
+        await asyncio.sleep(0)
+        future = admission._waiting[0][2]
+
+        # The release lands after the timeout cancelled the waiter, before the waiter cleaned up after it
+        while not future.cancelled():
+            await asyncio.sleep(0)
+        admission.release()
+
+        with pytest.raises(HTTPException) as timeout:
+            await waiter
+        assert timeout.value.status_code == 503
+        assert admission.active == 0 and admission.stats()['waiting']['read'] == 0
+
+    asyncio.run(run())
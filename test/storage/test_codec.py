@@ -0,0 +1,42 @@
+import asyncio
+import json
+
+from core_api.etcd.client import put_request
+from core_api.storage.codec import ZLIB, ValueCodec
+from core_api.storage.encoded import EncodedStorage
+from core_api.storage.migrate import migrate
+from core_api.storage.sqlite import SQLiteStorage
+
+VALUE = json.dumps({'metadata': {'name': 'a'}, 'spec': {'description': 'catalog ' * 100}}).encode()
+
+
+def test_codec_round_trip_and_plain_values():
+    codec = ValueCodec('zlib', min_bytes=100)
+    encoded = codec.encode(VALUE)
+    assert encoded[:1] == ZLIB and len(encoded) < len(VALUE)
+    assert codec.decode(encoded) == VALUE
+
+    # Plain JSON written before the encoding was turned on, and values too small to encode
+    assert codec.decode(VALUE) == VALUE
+    assert codec.encode(b'{}') == b'{}'
+    assert codec.is_current(encoded) and codec.is_current(b'{}') and not codec.is_current(VALUE)
+    assert not ValueCodec('json').is_current(encoded)
+
+
+def test_encoded_storage_and_migration():
+    async def run():
+        backend = SQLiteStorage(':memory:')
+        storage = EncodedStorage(backend, ValueCodec('zlib', min_bytes=100))
+
+        await backend.put('/registry/plain', VALUE)
+        await storage.put('/registry/put', VALUE)
+        await storage.txn(success=[put_request('/registry/txn', VALUE)])
+
+        assert [kv.value for kv in (await storage.get_prefix('/registry/')).kvs] == [VALUE] * 3
+        assert (await backend.get('/registry/txn')).value[:1] == ZLIB
+
+        stats = await migrate(backend, ValueCodec('zlib', min_bytes=100), '/registry/', batch_size=2)
+        assert (stats['migrated'], stats['current']) == (1, 2)
+        assert all(kv.value[:1] == ZLIB for kv in (await backend.get_prefix('/registry/')).kvs)
+
+    asyncio.run(run())
@@ -0,0 +1,65 @@
+import asyncio
+
+from fastapi.exceptions import HTTPException
+
+from core_api.etcd.client import compare_mod_revision, put_request
+from core_api.storage.sqlite import SQLiteStorage
+
+
+def test_revisions_transactions_and_pinned_reads():
+    async def run():
+        storage = SQLiteStorage(':memory:')
+        first = await storage.put('/registry/a', '1')
+        second = await storage.put('/registry/a', '2', prev_kv=True)
+        await storage.put('/registry/b', '1')
+        assert second.revision == first.revision + 1
+        assert second.prev_kv.value == b'1'
+
+        kv = await storage.get('/registry/a')
+        assert (kv.value, kv.create_revision, kv.mod_revision, kv.version) == (b'2', first.revision, second.revision, 2)
+
+        # A compare on a stale mod_revision fails and writes nothing
+        output = await storage.txn(
+            compare=[compare_mod_revision('/registry/a', first.revision)],
+            success=[put_request('/registry/a', '3')]
+        )
+        assert not output.succeeded and output.revision == storage.revision
+
+        deleted = await storage.delete('/registry/', prefix=True, prev_kv=True)
+        assert deleted.deleted == 2
+        assert (await storage.get_prefix('/registry/')).kvs == []
+
+        pinned = await storage.get_prefix('/registry/', revision=second.revision)
+        assert [(kv.key, kv.value) for kv in pinned.kvs] == [('/registry/a', b'2')]
+
+        page = await storage.get_prefix('/registry/', revision=deleted.revision - 1, limit=1)
+        assert (len(page.kvs), page.count, page.more) == (1, 2, True)
+
+        storage.compact(deleted.revision)
+        try:
+            await storage.get_prefix('/registry/', revision=first.revision)
+            assert False, 'Compacted revision was read'
+        except HTTPException as e:
+            assert e.status_code == 410
+
+    asyncio.run(run())
+
+
+def test_watch_replays_history_and_follows_writes():
+    async def run():
+        storage = SQLiteStorage(':memory:')
+        created = await storage.put('/registry/a', '1')
+
+        watch = storage.watch('/registry/', range_end=b'/registry0', start_revision=created.revision, prev_kv=True)
+        assert (await anext(watch)).created
+
+        replayed = await anext(watch)
+        assert [(event.type, event.kv.key) for event in replayed.events] == [('PUT', '/registry/a')]
+
+        await storage.put('/other', '1')
+        await storage.delete('/registry/a')
+        deleted = await asyncio.wait_for(anext(watch), 1)
+        assert [(event.type, event.prev_kv.value) for event in deleted.events] == [('DELETE', b'1')]
+        await watch.aclose()
+
+    asyncio.run(run())